@@ -36,7 +36,8 @@ export default function AttendanceReport({ schoolId }) {
             const lastDay = new Date(year, month, 0).getDate();
             const endDate = `${year}-${String(month).padStart(2, '0')}-${lastDay}`;
 
-            const res = await api.get(`/school/attendance?startDate=${startDate}&endDate=${endDate}`);
+            // view=daily: primeira chegada/última saída de cada dia, do resumo diário do servidor
+            const res = await api.get(`/school/attendance?startDate=${startDate}&endDate=${endDate}&view=daily`);
             // Filtrar apenas entradas (entry/arrival) para evitar duplicidade com saídas
             const entries = res.data.filter(r => r.type === 'entry' || r.type === 'arrival');
             setAttendanceData(entries);
@@ -0,0 +1,216 @@
+"""
+EduFocus - Índice aproximado (ANN) para embeddings faciais
+
+Usado quando a escola (ou rede de escolas filiadas) tem embeddings demais
+para a busca exata. Todos os vetores devem estar normalizados (norma 1), e
+a similaridade é o produto interno (= cosseno).
+
+Backends:
+    IVFIndex   - NumPy puro: k-means grosseiro + listas invertidas; a busca
+                 visita apenas as `nprobe` listas mais próximas.
+    HNSWIndex  - hnswlib (opcional, se instalado).
+
+Os rótulos (labels) são inteiros escolhidos por quem usa o índice; em
+app.py são as posições das linhas em SchoolEmbeddings.
+"""
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+
+class IVFIndex:
+    kind = 'ivf'
+
+    def __init__(self, dim, nlist=None, nprobe=8):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self.list_labels = []   # [np.ndarray(int64)] por lista
+        self.list_vectors = []  # [np.ndarray(float32, (n, dim))] por lista
+        self.label_list = {}    # {label: índice da lista}
+
+    def __len__(self):
+        return len(self.label_list)
+
+    def train(self, vectors, iterations=10, seed=0):
+        """K-means esférico (vetores normalizados) para definir os centróides."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n = len(vectors)
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        nlist = min(nlist, n)
+
+        rng = np.random.default_rng(seed)
+        sample = vectors if n <= nlist * 64 else vectors[rng.choice(n, nlist * 64, replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+                else:
+                    # Centróide vazio: recomeçar num ponto aleatório
+                    centroids[c] = sample[rng.integers(len(sample))]
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids /= norms
+
+        self.nlist = nlist
+        self.centroids = centroids
+        self.list_labels = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self.list_vectors = [np.empty((0, self.dim), dtype=np.float32) for _ in range(nlist)]
+        self.label_list = {}
+
+    def add(self, labels, vectors):
+        """Insere (ou substitui) vetores; pode ser chamado a qualquer momento após train()."""
+        labels = np.asarray(labels, dtype=np.int64).ravel()
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+
+        for label in labels:
+            if int(label) in self.label_list:
+                self.remove(int(label))
+
+        assign = np.argmax(vectors @ self.centroids.T, axis=1)
+        for c in np.unique(assign):
+            mask = assign == c
+            self.list_labels[c] = np.concatenate([self.list_labels[c], labels[mask]])
+            self.list_vectors[c] = np.vstack([self.list_vectors[c], vectors[mask]])
+            for label in labels[mask]:
+                self.label_list[int(label)] = int(c)
+
+    def remove(self, label):
+        c = self.label_list.pop(int(label), None)
+        if c is None:
+            return
+        keep = self.list_labels[c] != label
+        self.list_labels[c] = self.list_labels[c][keep]
+        self.list_vectors[c] = self.list_vectors[c][keep]
+
+    def search(self, queries, k=1):
+        """Retorna (labels, scores), ambos (Q, k); posições sem resultado têm label -1."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        nprobe = min(self.nprobe, self.nlist)
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+
+        out_labels = np.full((len(queries), k), -1, dtype=np.int64)
+        out_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+
+        for q, lists in enumerate(probes):
+            labels = np.concatenate([self.list_labels[c] for c in lists])
+            if not len(labels):
+                continue
+            vectors = np.vstack([self.list_vectors[c] for c in lists])
+            scores = vectors @ queries[q]
+            top = np.argsort(-scores)[:k]
+            out_labels[q, :len(top)] = labels[top]
+            out_scores[q, :len(top)] = scores[top]
+
+        return out_labels, out_scores
+
+    def save(self, path):
+        sizes = np.array([len(l) for l in self.list_labels], dtype=np.int64)
+        np.savez(
+            path,
+            kind=self.kind,
+            dim=self.dim,
+            nprobe=self.nprobe,
+            centroids=self.centroids,
+            sizes=sizes,
+            labels=np.concatenate(self.list_labels) if self.list_labels else np.empty(0, dtype=np.int64),
+            vectors=np.vstack(self.list_vectors) if self.list_vectors else np.empty((0, self.dim), dtype=np.float32),
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        index = cls(int(data['dim']), nlist=len(data['centroids']), nprobe=int(data['nprobe']))
+        index.centroids = data['centroids']
+        bounds = np.concatenate([[0], np.cumsum(data['sizes'])])
+        index.list_labels = [data['labels'][bounds[i]:bounds[i + 1]] for i in range(index.nlist)]
+        index.list_vectors = [data['vectors'][bounds[i]:bounds[i + 1]] for i in range(index.nlist)]
+        index.label_list = {int(l): i for i, labels in enumerate(index.list_labels) for l in labels}
+        return index
+
+
+class HNSWIndex:
+    kind = 'hnsw'
+
+    def __init__(self, dim, max_elements=1024, M=16, ef_construction=200, ef=64):
+        if hnswlib is None:
+            raise RuntimeError('hnswlib não está instalado')
+        self.dim = dim
+        self.ef = ef
+        self.index = hnswlib.Index(space='ip', dim=dim)
+        self.index.init_index(max_elements=max_elements, M=M, ef_construction=ef_construction, allow_replace_deleted=True)
+        self.index.set_ef(ef)
+        self.labels = set()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def train(self, vectors, **kwargs):
+        pass
+
+    def add(self, labels, vectors):
+        labels = np.asarray(labels, dtype=np.int64).ravel()
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        needed = self.index.get_current_count() + len(labels)
+        if needed > self.index.get_max_elements():
+            self.index.resize_index(max(needed, self.index.get_max_elements() * 2))
+        # Com o label já presente, add_items atualiza o vetor no lugar
+        self.index.add_items(vectors, labels, replace_deleted=True)
+        self.labels.update(int(l) for l in labels)
+
+    def remove(self, label):
+        if int(label) in self.labels:
+            self.index.mark_deleted(int(label))
+            self.labels.discard(int(label))
+
+    def search(self, queries, k=1):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(self.labels))
+        if k == 0:
+            return (np.full((len(queries), 1), -1, dtype=np.int64),
+                    np.full((len(queries), 1), -np.inf, dtype=np.float32))
+        labels, distances = self.index.knn_query(queries, k=k)
+        # Espaço 'ip': distância = 1 - produto interno
+        return labels.astype(np.int64), (1.0 - distances).astype(np.float32)
+
+    def save(self, path):
+        self.index.save_index(path)
+
+    @classmethod
+    def load(cls, path, dim, ef=64):
+        obj = cls.__new__(cls)
+        obj.dim = dim
+        obj.ef = ef
+        obj.index = hnswlib.Index(space='ip', dim=dim)
+        obj.index.load_index(path, allow_replace_deleted=True)
+        obj.index.set_ef(ef)
+        obj.labels = set(int(l) for l in obj.index.get_ids_list())
+        return obj
+
+
+def build_index(vectors, labels, backend='ivf', nprobe=8):
+    """Cria e popula um índice com os vetores (já normalizados) informados."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if backend == 'hnsw' and hnswlib is not None:
+        index = HNSWIndex(vectors.shape[1], max_elements=max(1024, len(vectors) * 2))
+    else:
+        index = IVFIndex(vectors.shape[1], nprobe=nprobe)
+        index.train(vectors)
+    index.add(labels, vectors)
+    return index
+
+
+def exact_search(queries, matrix, k=1):
+    """Busca exata (referência para medir o recall do índice)."""
+    scores = np.atleast_2d(queries) @ matrix.T
+    top = np.argsort(-scores, axis=1)[:, :k]
+    return top, np.take_along_axis(scores, top, axis=1)
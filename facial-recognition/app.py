@@ -16,6 +16,11 @@ from datetime import datetime
 from dotenv import load_dotenv
 import base64
 import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ann_index import IVFIndex, HNSWIndex, build_index
+from entry_queue import EntryQueue
 
 load_dotenv()
 
@@ -28,8 +33,19 @@ EDUFOCUS_API = os.getenv('EDUFOCUS_API_URL', 'http://localhost:5000')
 WHAPI_TOKEN = os.getenv('WHAPI_TOKEN', '')
 WHAPI_URL = os.getenv('WHAPI_URL', 'https://gate.whapi.cloud')
 EMBEDDINGS_DIR = 'embeddings_cache'
+# Corpo binário aceito no /process-frame e /register-face (além de JSON base64 e multipart)
+RAW_IMAGE_TYPES = ('image/jpeg', 'image/png', 'application/octet-stream')
+MAX_BATCH_FRAMES = int(os.getenv('MAX_BATCH_FRAMES', '32'))
+DETECTION_WORKERS = int(os.getenv('DETECTION_WORKERS', '2'))
 SIMILARITY_THRESHOLD = 0.4  # Quanto menor, mais rigoroso
 
+# Índice aproximado (ANN): usado quando a escola/rede passa de ANN_MIN_SIZE embeddings
+ANN_BACKEND = os.getenv('ANN_BACKEND', 'ivf')  # ivf | hnsw | exact
+ANN_MIN_SIZE = int(os.getenv('ANN_MIN_SIZE', '2000'))
+ANN_NPROBE = int(os.getenv('ANN_NPROBE', '8'))
+# Idade máxima do cache em disco antes de recarregar da API (segundos)
+EMBEDDINGS_CACHE_MAX_AGE = int(os.getenv('EMBEDDINGS_CACHE_MAX_AGE', str(6 * 3600)))
+
 # Criar diretórios
 os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
 
@@ -39,56 +55,321 @@ face_app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
 face_app.prepare(ctx_id=0, det_size=(640, 640))
 print("✅ Modelo carregado com sucesso!")
 
-# Cache de embeddings
+# Pool para detectar os frames do /process-frames em paralelo
+detection_pool = ThreadPoolExecutor(max_workers=DETECTION_WORKERS, thread_name_prefix='detection')
+
+# Cache de embeddings: {'school_<id>' | 'group_<id>_<id>...': SchoolEmbeddings}
 embeddings_cache = {}
+embeddings_lock = threading.Lock()
+
+
+class SchoolEmbeddings:
+    """
+    Embeddings de uma escola (ou de um grupo de escolas filiadas) prontos
+    para busca vetorizada.
+
+    matrix:     float32 (N, D), cada linha já normalizada (norma 1)
+    ids:        array (N,) com o id do aluno de cada linha
+    school_ids: array (N,) com a escola de cada linha
+    students:   lista (N) com os dados do aluno de cada linha
+    index:      índice ANN sobre as linhas (None = busca exata)
+
+    As linhas não mudam depois de criadas: upsert() e remove() devolvem uma
+    base nova, trocada no cache com uma atribuição. Quem está comparando um
+    frame continua na versão que pegou, com matrix, ids e students coerentes.
+    O índice ANN é compartilhado entre as versões e usado sob index_lock.
+    """
+
+    def __init__(self, ids, matrix, students, school_ids=None, rows=None):
+        self.ids = ids
+        self.matrix = matrix
+        self.students = students
+        self.school_ids = school_ids if school_ids is not None else np.zeros(len(ids), dtype=np.int64)
+        if rows is None:
+            rows = {(int(sc), int(st)): row for row, (sc, st) in enumerate(zip(self.school_ids, self.ids))}
+        self.rows = rows
+        self.index = None
+        self.index_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32), [])
+
+    def build_index(self):
+        """Cria o índice ANN se a base for grande o bastante; abaixo disso a busca exata é mais rápida."""
+        if ANN_BACKEND == 'exact' or len(self) < ANN_MIN_SIZE:
+            self.index = None
+            return
+        self.index = build_index(self.matrix, np.arange(len(self)), backend=ANN_BACKEND, nprobe=ANN_NPROBE)
+
+    def _updated(self, ids, matrix, students, school_ids, rows):
+        """Nova versão com estas linhas, compartilhando o índice ANN."""
+        updated = SchoolEmbeddings(ids, matrix, students, school_ids, rows)
+        updated.index = self.index
+        updated.index_lock = self.index_lock
+        return updated
+
+    def upsert(self, school_id, student_id, student_data, embedding):
+        """Base nova com o embedding do aluno inserido ou substituído (sem reconstruir)."""
+        embedding = normalize_rows(np.asarray(embedding, dtype=np.float32).ravel())
+        if len(self) and embedding.size != self.matrix.shape[1]:
+            raise ValueError(f'Dimensão {embedding.size} diferente da base ({self.matrix.shape[1]})')
+
+        key = (int(school_id), int(student_id))
+        row = self.rows.get(key)
+        students = list(self.students)
+        if row is None:
+            row = len(self)
+            matrix = np.vstack([self.matrix.reshape(-1, embedding.size), embedding[None, :]])
+            ids = np.append(self.ids, int(student_id))
+            school_ids = np.append(self.school_ids, int(school_id))
+            students.append(student_data)
+        else:
+            matrix = self.matrix.copy()
+            matrix[row] = embedding
+            ids, school_ids = self.ids, self.school_ids
+            students[row] = student_data
+        updated = self._updated(ids, matrix, students, school_ids, {**self.rows, key: row})
+
+        if updated.index is not None:
+            with updated.index_lock:
+                updated.index.add([row], embedding[None, :])
+        elif len(updated) >= ANN_MIN_SIZE:
+            updated.build_index()
+        return updated
+
+    def remove(self, school_id, student_id):
+        """Base nova sem o aluno (a linha fica zerada até a próxima recarga); None se ele não estiver nela."""
+        key = (int(school_id), int(student_id))
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        matrix = self.matrix.copy()
+        matrix[row] = 0
+        rows = {k: r for k, r in self.rows.items() if k != key}
+        updated = self._updated(self.ids, matrix, list(self.students), self.school_ids, rows)
+        if updated.index is not None:
+            with updated.index_lock:
+                updated.index.remove(row)
+        return updated
 
+    def save(self, path):
+        """Persiste a base (e o índice) em disco: <path>.npz (+ <path>.hnsw)."""
+        kind = self.index.kind if self.index is not None else 'exact'
+        np.savez(
+            path + '.npz',
+            ids=self.ids,
+            school_ids=self.school_ids,
+            matrix=self.matrix,
+            students=json.dumps(self.students),
+            index_kind=kind,
+            saved_at=time.time(),
+        )
+        if kind == 'ivf':
+            self.index.save(path + '.ivf.npz')
+        elif kind == 'hnsw':
+            self.index.save(path + '.hnsw')
+
+    @classmethod
+    def load(cls, path, max_age=None):
+        """Carrega do disco; retorna None se não existir ou estiver velho demais."""
+        if not os.path.exists(path + '.npz'):
+            return None
+        data = np.load(path + '.npz')
+        if max_age is not None and time.time() - float(data['saved_at']) > max_age:
+            return None
+
+        obj = cls(data['ids'], data['matrix'].copy(), json.loads(str(data['students'])), data['school_ids'])
+        # Linhas zeradas = alunos removidos
+        removed = ~np.any(obj.matrix, axis=1)
+        for row in np.flatnonzero(removed):
+            obj.rows.pop((int(obj.school_ids[row]), int(obj.ids[row])), None)
+
+        kind = str(data['index_kind'])
+        if kind == 'ivf' and os.path.exists(path + '.ivf.npz'):
+            obj.index = IVFIndex.load(path + '.ivf.npz')
+        elif kind == 'hnsw' and os.path.exists(path + '.hnsw'):
+            obj.index = HNSWIndex.load(path + '.hnsw', obj.matrix.shape[1])
+        elif kind != 'exact':
+            obj.build_index()
+        return obj
 
-def load_embeddings_from_api(school_id):
-    """Carrega embeddings de alunos da API do EduFocus"""
+
+def normalize_rows(vectors):
+    """Normaliza cada linha para norma 1 (linhas nulas continuam nulas)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def parse_descriptor(descriptor):
+    """Descritor da API (lista ou JSON) -> vetor float32; None se inválido/vazio."""
     try:
-        response = requests.get(f'{EDUFOCUS_API}/api/school/{school_id}/students/embeddings')
-        if response.status_code == 200:
-            students = response.json()
-            cache = {}
-            for student in students:
-                if student.get('face_descriptor'):
-                    # Converter string JSON para numpy array
-                    embedding = np.array(json.loads(student['face_descriptor']))
-                    cache[student['id']] = {
-                        'name': student['name'],
-                        'embedding': embedding,
-                        'guardian_phone': student.get('guardian_phone', ''),
-                        'class_name': student.get('class_name', '')
-                    }
-            return cache
-        return {}
+        if isinstance(descriptor, str):
+            descriptor = json.loads(descriptor)
+        embedding = np.asarray(descriptor, dtype=np.float32).ravel()
+    except (ValueError, TypeError):
+        return None
+    if embedding.size == 0 or not np.any(embedding):
+        return None
+    return embedding
+
+
+def student_data(student):
+    return {
+        'name': student['name'],
+        'guardian_phone': student.get('guardian_phone', ''),
+        'class_name': student.get('class_name', '')
+    }
+
+
+def build_school_embeddings(students, school_id=None):
+    """
+    Monta a matriz normalizada a partir da lista de alunos da API.
+    Cada aluno pode trazer 'school_id' (grupos de escolas); senão usa school_id.
+    """
+    rows = []
+    for student in students:
+        if not student.get('face_descriptor'):
+            continue
+        embedding = parse_descriptor(student['face_descriptor'])
+        if embedding is None:
+            print(f"⚠️ Descritor inválido para aluno {student.get('id')}")
+            continue
+        rows.append((student, embedding))
+
+    if not rows:
+        return SchoolEmbeddings.empty()
+
+    # Descritores de outro modelo (dimensão diferente) não podem ser comparados
+    dims = [e.size for _, e in rows]
+    dim = max(set(dims), key=dims.count)
+    skipped = sum(1 for d in dims if d != dim)
+    if skipped:
+        print(f"⚠️ {skipped} descritores ignorados (dimensão diferente de {dim})")
+    rows = [(s, e) for s, e in rows if e.size == dim]
+
+    ids = np.array([s['id'] for s, _ in rows], dtype=np.int64)
+    school_ids = np.array([int(s.get('school_id') or school_id or 0) for s, _ in rows], dtype=np.int64)
+    matrix = normalize_rows(np.stack([e for _, e in rows]))
+    students_data = [student_data(s) for s, _ in rows]
+    school_embeddings = SchoolEmbeddings(ids, np.ascontiguousarray(matrix), students_data, school_ids)
+    school_embeddings.build_index()
+    return school_embeddings
+
+
+def fetch_students_from_api(school_id):
+    """Alunos com descritor de uma escola, marcados com o school_id"""
+    response = requests.get(f'{EDUFOCUS_API}/api/school/{school_id}/students/embeddings')
+    if response.status_code != 200:
+        return []
+    students = response.json()
+    for student in students:
+        student['school_id'] = int(school_id)
+    return students
+
+
+def load_embeddings_from_api(school_ids):
+    """Carrega embeddings de alunos da API do EduFocus (uma escola ou um grupo de filiadas)"""
+    if not isinstance(school_ids, (list, tuple)):
+        school_ids = [school_ids]
+    try:
+        students = []
+        for school_id in school_ids:
+            students.extend(fetch_students_from_api(school_id))
+        return build_school_embeddings(students)
     except Exception as e:
         print(f"❌ Erro ao carregar embeddings: {e}")
-        return {}
+        return SchoolEmbeddings.empty()
+
+
+def embeddings_key(school_ids):
+    """'school_<id>' para uma escola; 'group_<ids ordenados>' para um grupo de filiadas"""
+    if len(school_ids) == 1:
+        return f'school_{school_ids[0]}'
+    return 'group_' + '_'.join(str(i) for i in sorted(school_ids))
+
+
+def key_school_ids(cache_key):
+    return [int(i) for i in cache_key.split('_')[1:]]
+
+
+def get_school_embeddings(school_ids, reload=False):
+    """Base de embeddings do grupo: memória -> disco (se recente) -> API"""
+    cache_key = embeddings_key(school_ids)
+    path = os.path.join(EMBEDDINGS_DIR, cache_key)
+
+    with embeddings_lock:
+        if not reload and cache_key in embeddings_cache:
+            return embeddings_cache[cache_key]
+
+    school_embeddings = None if reload else SchoolEmbeddings.load(path, EMBEDDINGS_CACHE_MAX_AGE)
+    if school_embeddings is None:
+        school_embeddings = load_embeddings_from_api(school_ids)
+        if len(school_embeddings):
+            school_embeddings.save(path)
+
+    with embeddings_lock:
+        embeddings_cache[cache_key] = school_embeddings
+    return school_embeddings
+
+
+def find_matching_students(face_embeddings, school_embeddings):
+    """
+    Encontra o aluno correspondente a cada rosto do frame.
+    Similaridade cosseno de todos os rostos contra todos os alunos em um
+    único produto de matrizes (F, D) x (D, N). Retorna uma lista (F) com o
+    match de cada rosto ou None.
+    """
+    faces = np.atleast_2d(np.asarray(face_embeddings, dtype=np.float32))
+    if len(school_embeddings) == 0 or faces.shape[1] != school_embeddings.matrix.shape[1]:
+        return [None] * len(faces)
+
+    if school_embeddings.index is not None:
+        # Base grande: índice ANN visita só uma fração dos alunos
+        with school_embeddings.index_lock:
+            labels, scores = school_embeddings.index.search(normalize_rows(faces), k=1)
+        best_rows, best_scores = labels[:, 0], scores[:, 0]
+    else:
+        similarities = normalize_rows(faces) @ school_embeddings.matrix.T
+        best_rows = np.argmax(similarities, axis=1)
+        best_scores = similarities[np.arange(len(faces)), best_rows]
+
+    matches = []
+    for row, score in zip(best_rows, best_scores):
+        # O índice é compartilhado: pode já ter linhas acrescentadas depois desta versão
+        if 0 <= row < len(school_embeddings) and score > SIMILARITY_THRESHOLD:
+            student = school_embeddings.students[row]
+            matches.append({
+                'id': school_embeddings.ids[row].item(),
+                'school_id': school_embeddings.school_ids[row].item(),
+                'name': student['name'],
+                'similarity': float(score),
+                'guardian_phone': student['guardian_phone'],
+                'class_name': student['class_name']
+            })
+        else:
+            matches.append(None)
+    return matches
 
 
 def find_matching_student(face_embedding, school_embeddings):
     """Encontra aluno correspondente comparando embeddings"""
-    best_match = None
-    best_similarity = -1
-    
-    for student_id, data in school_embeddings.items():
-        # Calcular similaridade cosseno
-        similarity = np.dot(face_embedding, data['embedding']) / (
-            np.linalg.norm(face_embedding) * np.linalg.norm(data['embedding'])
-        )
-        
-        if similarity > best_similarity and similarity > SIMILARITY_THRESHOLD:
-            best_similarity = similarity
-            best_match = {
-                'id': student_id,
-                'name': data['name'],
-                'similarity': float(similarity),
-                'guardian_phone': data['guardian_phone'],
-                'class_name': data['class_name']
-            }
-    
-    return best_match
+    return find_matching_students(face_embedding, school_embeddings)[0]
+
+
+# Sessão HTTP por thread (workers da fila): reaproveita conexões com a API e o whapi
+_http = threading.local()
+
+
+def http_session():
+    if not hasattr(_http, 'session'):
+        _http.session = requests.Session()
+    return _http.session
 
 
 def send_whatsapp_notification(phone, student_name, school_name, timestamp):
@@ -124,7 +405,7 @@ _Mensagem automática do sistema EduFocus_
             'body': message
         }
         
-        response = requests.post(
+        response = http_session().post(
             f'{WHAPI_URL}/messages/text',
             headers=headers,
             json=payload,
@@ -143,15 +424,15 @@ _Mensagem automática do sistema EduFocus_
         return False
 
 
-def register_entry(school_id, student_id, student_name):
+def register_entry(school_id, student_id, student_name, timestamp=None):
     """Registra entrada do aluno na API"""
     try:
-        response = requests.post(
+        response = http_session().post(
             f'{EDUFOCUS_API}/api/school/{school_id}/attendance',
             json={
                 'student_id': student_id,
                 'type': 'entry',
-                'timestamp': datetime.now().isoformat()
+                'timestamp': timestamp or datetime.now().isoformat()
             },
             timeout=5
         )
@@ -161,70 +442,176 @@ def register_entry(school_id, student_id, student_name):
         return False
 
 
+def handle_attendance_jobs(payloads):
+    """Worker da fila: registra as entradas do lote"""
+    return [
+        register_entry(p['school_id'], p['student_id'], p['student_name'], p['timestamp'])
+        for p in payloads
+    ]
+
+
+def handle_whatsapp_jobs(payloads):
+    """
+    Worker da fila: uma mensagem por telefone, mesmo que vários alunos
+    (irmãos) do mesmo responsável tenham sido reconhecidos no lote.
+    """
+    groups = {}
+    for i, p in enumerate(payloads):
+        groups.setdefault((p['phone'], p['school_name']), []).append(i)
+
+    results = [False] * len(payloads)
+    for (phone, school_name), indexes in groups.items():
+        names = ' e '.join(dict.fromkeys(payloads[i]['student_name'] for i in indexes))
+        ok = send_whatsapp_notification(phone, names, school_name, payloads[indexes[-1]]['timestamp_display'])
+        for i in indexes:
+            results[i] = ok
+    return results
+
+
+entry_queue = EntryQueue({
+    'attendance': handle_attendance_jobs,
+    'whatsapp': handle_whatsapp_jobs,
+})
+
+
+def enqueue_entry(match, recognized_at):
+    """Envia registro de entrada + WhatsApp para a fila; False se o aluno já estava na janela de de-duplicação"""
+    school_id = match['school_id']
+    jobs = [('attendance', {
+        'school_id': school_id,
+        'student_id': match['id'],
+        'student_name': match['name'],
+        'timestamp': recognized_at.isoformat()
+    })]
+    if WHAPI_TOKEN and match['guardian_phone']:
+        jobs.append(('whatsapp', {
+            'phone': match['guardian_phone'],
+            'student_name': match['name'],
+            'school_name': f"Escola ID {school_id}",  # Pode buscar nome da escola da API
+            'timestamp_display': recognized_at.strftime('%d/%m/%Y %H:%M:%S')
+        }))
+    entry_queue.start()
+    return entry_queue.enqueue_recognition(school_id, match['id'], jobs)
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check"""
-    return jsonify({'status': 'ok', 'service': 'facial-recognition'})
+    return jsonify({'status': 'ok', 'service': 'facial-recognition', 'queue': entry_queue.stats()})
 
 
-@app.route('/process-frame', methods=['POST'])
-def process_frame():
-    """Processa frame de vídeo e detecta rostos"""
-    try:
-        data = request.json
-        school_id = data.get('school_id')
-        frame_base64 = data.get('frame')
-        
-        if not school_id or not frame_base64:
-            return jsonify({'error': 'Missing school_id or frame'}), 400
-        
-        # Decodificar imagem
-        img_data = base64.b64decode(frame_base64.split(',')[1] if ',' in frame_base64 else frame_base64)
-        nparr = np.frombuffer(img_data, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # Detectar rostos
-        faces = face_app.get(frame)
-        
-        if not faces:
-            return jsonify({'detected': False, 'faces': []})
-        
-        # Carregar embeddings da escola (com cache)
-        cache_key = f'school_{school_id}'
-        if cache_key not in embeddings_cache:
-            embeddings_cache[cache_key] = load_embeddings_from_api(school_id)
-        
-        school_embeddings = embeddings_cache[cache_key]
-        
-        results = []
+def decode_image(buffer):
+    """JPEG/PNG -> imagem BGR lida direto do buffer (bytes ou memoryview), sem cópia intermediária"""
+    nparr = np.frombuffer(buffer, np.uint8)
+    if nparr.size == 0:
+        return None
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+
+def decode_base64_image(data):
+    return decode_image(base64.b64decode(data.split(',')[1] if ',' in data else data))
+
+
+def upload_buffer(upload):
+    """Conteúdo de um arquivo multipart; uploads pequenos ficam num BytesIO e são lidos sem cópia"""
+    if hasattr(upload.stream, 'getbuffer'):
+        return upload.stream.getbuffer()
+    return upload.stream.read()
+
+
+def read_request_image(field):
+    """
+    Imagem e parâmetros da requisição, em qualquer dos formatos aceitos:
+      - corpo binário (image/jpeg, image/png, application/octet-stream), parâmetros na query string
+      - multipart/form-data com o arquivo no campo `field`, parâmetros nos campos do formulário
+      - JSON com a imagem em base64 no campo `field` (formato original)
+    Retorna (imagem BGR ou None, parâmetros).
+    """
+    if request.mimetype in RAW_IMAGE_TYPES:
+        return decode_image(request.get_data(cache=False)), request.args
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get(field)
+        return (decode_image(upload_buffer(upload)) if upload else None), request.form
+    data = request.get_json(silent=True) or {}
+    return (decode_base64_image(data[field]) if data.get(field) else None), data
+
+
+def request_school_ids(params):
+    """school_id + group_school_ids (lista JSON ou '1,2,3') -> lista ordenada, ou None"""
+    school_id = params.get('school_id')
+    if not school_id:
+        return None
+    group = params.get('group_school_ids') or []
+    if isinstance(group, str):
+        group = [i for i in group.split(',') if i.strip()]
+    return sorted({int(school_id), *(int(i) for i in group)})
+
+
+def detect_faces(frames):
+    """Detecção + embeddings de vários frames em paralelo (o ONNX Runtime libera o GIL)"""
+    if len(frames) == 1:
+        return [face_app.get(frames[0])]
+    return list(detection_pool.map(face_app.get, frames))
+
+
+def recognize_frames(items):
+    """
+    items: [(frame, school_ids), ...] -> lista (por frame) com os alunos reconhecidos.
+    Os rostos de todos os frames da mesma escola/grupo são comparados num
+    único produto de matrizes.
+    """
+    faces_per_frame = detect_faces([frame for frame, _ in items])
+
+    by_group = {}
+    for i, ((_, school_ids), faces) in enumerate(zip(items, faces_per_frame)):
         for face in faces:
-            embedding = face.embedding
-            
-            # Buscar correspondência
-            match = find_matching_student(embedding, school_embeddings)
-            
+            by_group.setdefault(tuple(school_ids), []).append((i, face))
+
+    results = [[] for _ in items]
+    recognized_at = datetime.now()
+    timestamp = recognized_at.strftime('%d/%m/%Y %H:%M:%S')
+
+    for school_ids, entries in by_group.items():
+        # Carregar embeddings da escola/grupo (memória, disco ou API)
+        school_embeddings = get_school_embeddings(list(school_ids))
+        matches = find_matching_students(np.stack([face.embedding for _, face in entries]), school_embeddings)
+
+        for (i, face), match in zip(entries, matches):
             if match:
-                # Registrar entrada
-                register_entry(school_id, match['id'], match['name'])
-                
-                # Enviar WhatsApp
-                timestamp = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
-                send_whatsapp_notification(
-                    match['guardian_phone'],
-                    match['name'],
-                    f"Escola ID {school_id}",  # Pode buscar nome da escola da API
-                    timestamp
-                )
-                
-                results.append({
+                # Registro de entrada e WhatsApp ficam com os workers da fila
+                # (na escola do aluno, que pode ser uma filiada)
+                queued = enqueue_entry(match, recognized_at)
+
+                results[i].append({
                     'detected': True,
                     'student_id': match['id'],
+                    'school_id': match['school_id'],
                     'student_name': match['name'],
                     'similarity': match['similarity'],
                     'class': match['class_name'],
                     'bbox': face.bbox.tolist(),
-                    'timestamp': timestamp
+                    'timestamp': timestamp,
+                    'queued': queued
                 })
+    return results
+
+
+@app.route('/process-frame', methods=['POST'])
+def process_frame():
+    """
+    Processa frame de vídeo e detecta rostos.
+    Aceita JSON com base64 ({school_id, frame, group_school_ids?}), corpo
+    JPEG/PNG binário (?school_id=1&group_school_ids=1,2) ou multipart (campo 'frame').
+    """
+    try:
+        frame, params = read_request_image('frame')
+        # Câmera compartilhada por escolas filiadas: buscar em todas do grupo
+        school_ids = request_school_ids(params)
+        
+        if not school_ids or frame is None:
+            return jsonify({'error': 'Missing school_id or frame'}), 400
+        
+        results = recognize_frames([(frame, school_ids)])[0]
         
         return jsonify({
             'detected': len(results) > 0,
@@ -236,22 +623,61 @@ def process_frame():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/process-frames', methods=['POST'])
+def process_frames():
+    """
+    Lote de frames de várias câmeras, detectados em conjunto.
+      - JSON: {frames: [{school_id, camera_id?, group_school_ids?, frame (base64)}, ...]}
+      - multipart: arquivos repetidos no campo 'frames' + campo 'meta' com a lista
+        JSON [{school_id, camera_id?, group_school_ids?}, ...] na mesma ordem
+    Retorna {results: [{camera_id, detected, faces} | {camera_id, error}, ...]} na ordem recebida.
+    """
+    try:
+        if request.mimetype == 'multipart/form-data':
+            uploads = request.files.getlist('frames')
+            meta = json.loads(request.form.get('meta') or '[]')
+            entries = [(m, decode_image(upload_buffer(u))) for m, u in zip(meta, uploads)]
+        else:
+            data = request.get_json(silent=True) or {}
+            entries = [(f, decode_base64_image(f['frame']) if f.get('frame') else None)
+                       for f in data.get('frames', [])]
+
+        if not entries:
+            return jsonify({'error': 'No frames'}), 400
+        if len(entries) > MAX_BATCH_FRAMES:
+            return jsonify({'error': f'Too many frames (max {MAX_BATCH_FRAMES})'}), 400
+
+        results = [None] * len(entries)
+        items, positions = [], []
+        for i, (meta, frame) in enumerate(entries):
+            school_ids = request_school_ids(meta)
+            if not school_ids or frame is None:
+                results[i] = {'camera_id': meta.get('camera_id'), 'error': 'Missing school_id or frame'}
+                continue
+            items.append((frame, school_ids))
+            positions.append(i)
+
+        if items:
+            for i, faces in zip(positions, recognize_frames(items)):
+                results[i] = {'camera_id': entries[i][0].get('camera_id'), 'detected': len(faces) > 0, 'faces': faces}
+
+        return jsonify({'results': results})
+
+    except Exception as e:
+        print(f"❌ Erro ao processar lote de frames: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/register-face', methods=['POST'])
 def register_face():
-    """Registra novo rosto de aluno"""
+    """Registra novo rosto de aluno (JSON base64, corpo JPEG/PNG com ?student_id= ou multipart 'image')"""
     try:
-        data = request.json
-        student_id = data.get('student_id')
-        image_base64 = data.get('image')
+        img, params = read_request_image('image')
+        student_id = params.get('student_id')
         
-        if not student_id or not image_base64:
+        if not student_id or img is None:
             return jsonify({'error': 'Missing student_id or image'}), 400
         
-        # Decodificar imagem
-        img_data = base64.b64decode(image_base64.split(',')[1] if ',' in image_base64 else image_base64)
-        nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
         # Detectar rosto
         faces = face_app.get(img)
         
@@ -280,18 +706,64 @@ def register_face():
 
 @app.route('/reload-embeddings/<school_id>', methods=['POST'])
 def reload_embeddings(school_id):
-    """Recarrega embeddings de uma escola"""
+    """Recarrega embeddings de uma escola (e dos grupos em memória que a incluem)"""
     try:
-        cache_key = f'school_{school_id}'
-        embeddings_cache[cache_key] = load_embeddings_from_api(school_id)
+        with embeddings_lock:
+            keys = [k for k in embeddings_cache if int(school_id) in key_school_ids(k)]
+        keys = set(keys) | {f'school_{school_id}'}
+        for cache_key in keys:
+            get_school_embeddings(key_school_ids(cache_key), reload=True)
         return jsonify({
             'success': True,
-            'count': len(embeddings_cache[cache_key])
+            'count': len(embeddings_cache[f'school_{school_id}'])
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/embeddings/<int:school_id>/students/<int:student_id>', methods=['PUT', 'DELETE'])
+def update_student_embedding(school_id, student_id):
+    """
+    Atualização incremental: chamado pelo backend quando a biometria do aluno
+    muda (PUT) ou o aluno é removido (DELETE). Atualiza todas as bases em
+    memória que incluem a escola, sem recarregar da API, e persiste em disco.
+    """
+    try:
+        embedding = None
+        if request.method == 'PUT':
+            data = request.json or {}
+            embedding = parse_descriptor(data.get('face_descriptor'))
+            if embedding is None:
+                return jsonify({'error': 'Invalid face_descriptor'}), 400
+
+        with embeddings_lock:
+            keys = [k for k in embeddings_cache if school_id in key_school_ids(k)]
+            updated = 0
+            for cache_key in keys:
+                school_embeddings = embeddings_cache[cache_key]
+                if embedding is None:
+                    school_embeddings = school_embeddings.remove(school_id, student_id)
+                else:
+                    school_embeddings = school_embeddings.upsert(
+                        school_id, student_id, student_data({**data, 'id': student_id}), embedding)
+                if school_embeddings is not None:
+                    # Uma atribuição: frames em andamento seguem com a versão anterior inteira
+                    embeddings_cache[cache_key] = school_embeddings
+                    school_embeddings.save(os.path.join(EMBEDDINGS_DIR, cache_key))
+                    updated += 1
+
+            # Bases em disco que não estão em memória ficaram desatualizadas
+            for filename in os.listdir(EMBEDDINGS_DIR):
+                cache_key = filename.split('.')[0]
+                if cache_key not in keys and school_id in key_school_ids(cache_key):
+                    os.remove(os.path.join(EMBEDDINGS_DIR, filename))
+
+        return jsonify({'success': True, 'updated': updated})
+    except Exception as e:
+        print(f"❌ Erro ao atualizar embedding: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
 if __name__ == '__main__':
     print("🚀 Iniciando serviço de reconhecimento facial...")
     print(f"📡 EduFocus API: {EDUFOCUS_API}")
@@ -0,0 +1,232 @@
+"""
+EduFocus - Fila durável de efeitos colaterais do reconhecimento
+
+O /process-frame só reconhece os rostos; o registro de entrada na API e o
+WhatsApp para o responsável vão para esta fila (arquivo SQLite local) e são
+processados por um pool de workers:
+
+- Durável: jobs sobrevivem a reinícios; jobs em 'processing' de uma execução
+  anterior voltam para 'pending' na subida.
+- Retentativas: backoff exponencial até MAX_ATTEMPTS, depois status 'dead'.
+- Lotes: cada worker pega até BATCH_SIZE jobs do mesmo tipo e o handler
+  recebe todos de uma vez (ex: uma mensagem por telefone com vários alunos).
+- De-duplicação: um aluno reconhecido de novo dentro de DEDUP_SECONDS não
+  gera novos jobs. A checagem passa primeiro por um cache TTL em memória
+  (os frames seguintes do mesmo aluno nem tocam no SQLite) e depois pela
+  tabela, que cobre reinícios do processo.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+QUEUE_DB = os.getenv('ENTRY_QUEUE_DB', 'entry_queue.db')
+WORKERS = int(os.getenv('ENTRY_QUEUE_WORKERS', '4'))
+BATCH_SIZE = int(os.getenv('ENTRY_QUEUE_BATCH_SIZE', '20'))
+DEDUP_SECONDS = int(os.getenv('ENTRY_DEDUP_SECONDS', '300'))
+DEDUP_CACHE_SIZE = 50000
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 5
+POLL_INTERVAL = 0.5
+RETENTION_SECONDS = 7 * 24 * 3600
+
+
+class TTLCache:
+    """Conjunto de chaves que expiram após `ttl` segundos (limitado a max_size chaves)."""
+
+    def __init__(self, ttl, max_size=DEDUP_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def add_if_absent(self, key, now=None):
+        """Registra a chave; retorna False se ela já estava presente e válida."""
+        now = now or time.time()
+        with self._lock:
+            expires = self._expires.get(key)
+            if expires is not None and expires > now:
+                return False
+            if len(self._expires) >= self.max_size:
+                self._purge(now)
+            self._expires[key] = now + self.ttl
+            return True
+
+    def discard(self, key):
+        with self._lock:
+            self._expires.pop(key, None)
+
+    def _purge(self, now):
+        self._expires = {k: e for k, e in self._expires.items() if e > now}
+        # Ainda cheio: descartar as que expiram primeiro
+        while len(self._expires) >= self.max_size:
+            del self._expires[min(self._expires, key=self._expires.get)]
+
+    def __len__(self):
+        return len(self._expires)
+
+
+class EntryQueue:
+    """
+    handlers: {kind: fn(payloads) -> [bool, ...]}
+    Cada handler recebe a lista de payloads do lote e devolve, na mesma ordem,
+    True (concluído) ou False (tentar de novo). Exceção = lote inteiro falhou.
+    """
+
+    def __init__(self, handlers, path=QUEUE_DB, workers=WORKERS):
+        self.handlers = handlers
+        self.path = path
+        self.workers = workers
+        self._wakeup = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+        self.recent = TTLCache(DEDUP_SECONDS)
+
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            school_id INTEGER,
+            student_id INTEGER,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            last_error TEXT
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs(status, kind, next_attempt_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_student ON jobs(school_id, student_id, created_at)')
+        # Jobs que estavam em andamento quando o processo caiu
+        conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'processing'")
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            for i in range(self.workers):
+                threading.Thread(target=self._work, daemon=True, name=f'entry-worker-{i}').start()
+            self._started = True
+
+    def enqueue_recognition(self, school_id, student_id, jobs):
+        """
+        Enfileira os jobs [(kind, payload), ...] de um reconhecimento.
+        Retorna False (e não enfileira) se o aluno já foi enfileirado dentro de DEDUP_SECONDS.
+        """
+        now = time.time()
+        key = (int(school_id), int(student_id))
+        dedup = DEDUP_SECONDS > 0
+        if dedup and not self.recent.add_if_absent(key, now):
+            return False
+
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            if dedup:
+                recent = conn.execute('''
+                    SELECT 1 FROM jobs WHERE school_id = ? AND student_id = ? AND created_at > ? LIMIT 1
+                ''', (school_id, student_id, now - DEDUP_SECONDS)).fetchone()
+                if recent:
+                    conn.rollback()
+                    return False
+            conn.executemany('''
+                INSERT INTO jobs (kind, school_id, student_id, payload, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(kind, school_id, student_id, json.dumps(payload), now, now) for kind, payload in jobs])
+            conn.commit()
+        except Exception:
+            self.recent.discard(key)
+            raise
+        finally:
+            conn.close()
+
+        self._wakeup.set()
+        return True
+
+    def _claim(self, conn):
+        """Reserva um lote de jobs prontos, todos do mesmo tipo."""
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        first = conn.execute('''
+            SELECT kind FROM jobs WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at LIMIT 1
+        ''', (now,)).fetchone()
+        if not first:
+            conn.rollback()
+            return None, []
+
+        rows = conn.execute('''
+            SELECT id, payload, attempts FROM jobs
+            WHERE status = 'pending' AND kind = ? AND next_attempt_at <= ?
+            ORDER BY next_attempt_at LIMIT ?
+        ''', (first['kind'], now, BATCH_SIZE)).fetchall()
+        conn.executemany("UPDATE jobs SET status = 'processing' WHERE id = ?", [(r['id'],) for r in rows])
+        conn.commit()
+        return first['kind'], rows
+
+    def _finish(self, conn, rows, results, error=None):
+        now = time.time()
+        updates = []
+        for row, ok in zip(rows, results):
+            attempts = row['attempts'] + 1
+            if ok:
+                updates.append(('done', attempts, now, None, row['id']))
+            elif attempts >= MAX_ATTEMPTS:
+                updates.append(('dead', attempts, now, error, row['id']))
+            else:
+                delay = RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+                updates.append(('pending', attempts, now + delay, error, row['id']))
+        conn.executemany('''
+            UPDATE jobs SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?
+        ''', updates)
+        conn.commit()
+
+    def _work(self):
+        conn = self._connect()
+        last_prune = 0
+        while True:
+            try:
+                kind, rows = self._claim(conn)
+                if not rows:
+                    self._wakeup.wait(POLL_INTERVAL)
+                    self._wakeup.clear()
+
+                    now = time.time()
+                    if now - last_prune > 3600:
+                        conn.execute("DELETE FROM jobs WHERE status = 'done' AND created_at < ?",
+                                     (now - RETENTION_SECONDS,))
+                        conn.commit()
+                        last_prune = now
+                    continue
+
+                payloads = [json.loads(r['payload']) for r in rows]
+                try:
+                    results = self.handlers[kind](payloads)
+                    self._finish(conn, rows, results, None if all(results) else 'handler returned failure')
+                except Exception as e:
+                    print(f"❌ Erro processando lote '{kind}': {e}")
+                    self._finish(conn, rows, [False] * len(rows), str(e))
+            except Exception as e:
+                print(f"❌ Erro na fila de entradas: {e}")
+                time.sleep(POLL_INTERVAL)
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT kind, status, COUNT(*) AS total FROM jobs GROUP BY kind, status').fetchall()
+            stats = {f"{r['kind']}_{r['status']}": r['total'] for r in rows}
+            stats['dedup_cache'] = len(self.recent)
+            return stats
+        finally:
+            conn.close()
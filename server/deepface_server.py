@@ -3,25 +3,37 @@
 # Autor: EduFocus Team
 
 from flask import Flask, jsonify, request
-from flask_cors import CORS
 from deepface import DeepFace
 import cv2
 import numpy as np
-import base64
-import threading
-import time
 import os
+import time
 import sqlite3
 from datetime import datetime
-
-app = Flask(__name__)
-CORS(app)
+from embedding_store import EmbeddingStore
+from face_pipeline import FacePipeline, StageTimings
 
 # Configurações
 CAMERA_STREAMS = {}  # {room_id: camera_url}
-ANALYSIS_THREADS = {}  # {room_id: thread}
 CURRENT_ANALYSIS = {}  # {room_id: analysis_data}
-STUDENT_FACES = {}  # {student_id: face_encoding}
+STUDENT_FACES = {}  # {school_id: (StoredEmbeddings, verificado_em)} (cache de cada processo worker)
+FACE_MODEL = 'Facenet'
+MATCH_THRESHOLD = 0.6  # distância euclidiana máxima para considerar o mesmo aluno
+# Intervalo para checar se o banco da escola mudou (fotos novas/alteradas)
+FACES_REFRESH_SECONDS = int(os.environ.get('FACES_REFRESH_SECONDS', '60'))
+
+# Embeddings dos alunos em disco, compartilhados por todas as salas e workers
+# (aberto no primeiro uso: só os processos do pool carregam rostos)
+embedding_store = None
+
+# Pipeline com os modelos carregados (criado em cada processo worker)
+PIPELINE = None
+# Tempos por etapa do pipeline, acumulados no processo principal
+PIPELINE_TIMINGS = StageTimings()
+
+# Histórico das métricas e agendador das salas: só no processo do servidor (create_app)
+metrics_store = None
+scheduler = None
 
 # Banco de dados
 def get_db_connection(school_id):
@@ -31,295 +43,298 @@ def get_db_connection(school_id):
     conn.row_factory = sqlite3.Row
     return conn
 
-def load_student_faces(school_id):
-    """Carrega fotos dos alunos cadastrados"""
-    print(f"📚 Carregando rostos dos alunos da escola {school_id}...")
-    
+def get_db_version(school_id):
+    """Muda sempre que o banco da escola é alterado (arquivo principal ou WAL)"""
+    db_path = f'../databases/school_{school_id}.db'
+    stats = [os.stat(p) for p in (db_path, db_path + '-wal') if os.path.exists(p)]
+    return [[st.st_mtime_ns, st.st_size] for st in stats]
+
+def fetch_students_with_photo(school_id):
     conn = get_db_connection(school_id)
-    cursor = conn.cursor()
-    
-    # Buscar alunos com foto
-    cursor.execute("""
-        SELECT id, name, photo_url, class_id 
-        FROM students 
-        WHERE photo_url IS NOT NULL AND photo_url != ''
-    """)
+    try:
+        # Buscar alunos com foto (base64 ou referência do blob store; ver embedding_store.decode_photo)
+        return [dict(row) for row in conn.execute("""
+            SELECT id, name, photo_url, class_id 
+            FROM students 
+            WHERE photo_url IS NOT NULL AND photo_url != ''
+            ORDER BY id
+        """)]
+    finally:
+        conn.close()
+
+def represent_photo(img_data):
+    """Bytes da foto do aluno -> embedding Facenet"""
+    nparr = np.frombuffer(img_data, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
     
-    students = cursor.fetchall()
-    conn.close()
+    # Extrair embedding facial usando DeepFace
+    return DeepFace.represent(
+        img_path=img,
+        model_name=FACE_MODEL,
+        enforce_detection=False
+    )[0]['embedding']
+
+def load_student_faces(school_id):
+    """
+    Rostos dos alunos cadastrados, do armazenamento persistente. Só as fotos
+    novas ou alteradas desde a última vez passam pelo modelo.
+    """
+    global embedding_store
+    if embedding_store is None:
+        embedding_store = EmbeddingStore()
+    started = time.perf_counter()
+    stored, computed = embedding_store.refresh(
+        school_id, FACE_MODEL,
+        lambda: fetch_students_with_photo(school_id),
+        represent_photo,
+        source_version=get_db_version(school_id)
+    )
+    if computed:
+        print(f"📚 Escola {school_id}: {computed} rostos novos/alterados processados")
+    print(f"✅ {len(stored)} alunos carregados ({time.perf_counter() - started:.2f}s)")
+    return stored
+
+def init_worker():
+    """Roda uma vez em cada processo do pool: carrega os modelos antes do primeiro frame"""
+    global PIPELINE
+    PIPELINE = FacePipeline(face_model=FACE_MODEL)
+    print(f"🧠 Worker de análise pronto (pid {os.getpid()})")
+
+def get_student_faces(school_id):
+    """
+    Rostos dos alunos da escola, compartilhados pelas salas. A cada
+    FACES_REFRESH_SECONDS confere se o banco mudou (atualização incremental).
+    """
+    cached = STUDENT_FACES.get(school_id)
+    now = time.monotonic()
+    if cached and now - cached[1] < FACES_REFRESH_SECONDS:
+        return cached[0]
+    stored = load_student_faces(school_id)
+    STUDENT_FACES[school_id] = (stored, now)
+    return stored
+
+def analyze_frame(room_id, school_id, frame):
+    """Analisa um frame amostrado de uma sala (roda nos processos do pool)"""
+    started = time.perf_counter()
+    student_faces = get_student_faces(school_id)
+    load_ms = (time.perf_counter() - started) * 1000
+
+    # Detecção única + emoção e Facenet em lote para todos os rostos
+    faces, timings = PIPELINE.run(frame)
+    timings['load_faces'] = round(load_ms, 2)
     
-    student_data = {}
+    analysis_results = []
+    emotion_counts = {
+        'happy': 0,
+        'sad': 0,
+        'angry': 0,
+        'fear': 0,
+        'surprise': 0,
+        'disgust': 0,
+        'neutral': 0
+    }
+
+    # Comparar todos os rostos com os alunos cadastrados de uma vez
+    started = time.perf_counter()
+    matches = student_faces.find_closest([f['embedding'] for f in faces], MATCH_THRESHOLD) if faces else []
+    timings['match'] = round((time.perf_counter() - started) * 1000, 2)
     
-    for student in students:
-        student_id = student['id']
-        name = student['name']
-        photo_base64 = student['photo_url']
-        class_id = student['class_id']
+    for face, match in zip(faces, matches):
+        emotion_scores = face['emotion_scores']
+        dominant_emotion = face['emotion']
         
-        try:
-            # Decodificar base64 para imagem
-            if photo_base64.startswith('data:image'):
-                photo_base64 = photo_base64.split(',')[1]
-            
-            img_data = base64.b64decode(photo_base64)
-            nparr = np.frombuffer(img_data, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            # Extrair embedding facial usando DeepFace
-            embedding = DeepFace.represent(
-                img_path=img,
-                model_name='Facenet',
-                enforce_detection=False
-            )
-            
-            student_data[student_id] = {
-                'name': name,
-                'class_id': class_id,
-                'embedding': embedding[0]['embedding']
-            }
-            
-            print(f"  ✓ {name} (ID: {student_id})")
-            
-        except Exception as e:
-            print(f"  ✗ Erro ao processar {name}: {e}")
+        # Adicionar ao resultado
+        analysis_results.append({
+            'student_id': match[0]['student_id'] if match else None,
+            'student_name': match[0]['name'] if match else "Desconhecido",
+            'emotion': dominant_emotion,
+            'emotion_scores': emotion_scores,
+            'confidence': max(emotion_scores.values())
+        })
+        
+        # Contar emoção
+        emotion_counts[dominant_emotion] += 1
     
-    print(f"✅ {len(student_data)} alunos carregados")
-    return student_data
+    return build_room_analysis(analysis_results, emotion_counts), timings
 
-def analyze_camera_stream(room_id, camera_url, school_id):
-    """Analisa stream da câmera continuamente"""
-    print(f"🎥 Iniciando análise da sala {room_id}")
+def build_room_analysis(analysis_results, emotion_counts):
+    """Métricas globais da sala; None se nenhum rosto foi encontrado"""
+    total_faces = len(analysis_results)
     
-    # Carregar rostos dos alunos
-    student_faces = load_student_faces(school_id)
+    if total_faces == 0:
+        return None
+
+    # Atenção: baseada em emoções positivas
+    positive = emotion_counts['happy'] + emotion_counts['surprise']
+    negative = emotion_counts['sad'] + emotion_counts['angry'] + emotion_counts['fear']
+    attention = round(((positive + emotion_counts['neutral']) / total_faces) * 100)
     
-    # Conectar à câmera
-    cap = cv2.VideoCapture(camera_url)
+    # Disposição: baseada em felicidade
+    disposition = round((emotion_counts['happy'] / total_faces) * 100)
     
-    if not cap.isOpened():
-        print(f"❌ Erro ao conectar câmera da sala {room_id}")
-        return
+    # Engajamento: inverso de neutro e negativo
+    engagement = round((1 - ((emotion_counts['neutral'] + negative) / total_faces)) * 100)
     
-    frame_count = 0
+    # Desempenho: média
+    performance = round((attention + disposition + engagement) / 3)
     
-    while room_id in ANALYSIS_THREADS:
-        ret, frame = cap.read()
-        
-        if not ret:
-            print(f"⚠️ Erro ao ler frame da sala {room_id}")
-            time.sleep(1)
-            continue
-        
-        # Analisar a cada 30 frames (1 vez por segundo em 30fps)
-        frame_count += 1
-        if frame_count % 30 != 0:
-            continue
-        
-        try:
-            # Detectar rostos no frame
-            faces = DeepFace.extract_faces(
-                img_path=frame,
-                detector_backend='opencv',
-                enforce_detection=False
-            )
-            
-            analysis_results = []
-            emotion_counts = {
-                'happy': 0,
-                'sad': 0,
-                'angry': 0,
-                'fear': 0,
-                'surprise': 0,
-                'disgust': 0,
-                'neutral': 0
-            }
-            
-            for face_data in faces:
-                face_img = face_data['face']
-                
-                # Analisar emoção
-                emotion_result = DeepFace.analyze(
-                    img_path=face_img,
-                    actions=['emotion'],
-                    enforce_detection=False
-                )
-                
-                dominant_emotion = emotion_result[0]['dominant_emotion']
-                emotion_scores = emotion_result[0]['emotion']
-                
-                # Tentar reconhecer aluno
-                student_id = None
-                student_name = "Desconhecido"
-                
-                try:
-                    # Extrair embedding do rosto detectado
-                    face_embedding = DeepFace.represent(
-                        img_path=face_img,
-                        model_name='Facenet',
-                        enforce_detection=False
-                    )[0]['embedding']
-                    
-                    # Comparar com rostos cadastrados
-                    min_distance = float('inf')
-                    best_match = None
-                    
-                    for sid, sdata in student_faces.items():
-                        # Calcular distância euclidiana
-                        distance = np.linalg.norm(
-                            np.array(face_embedding) - np.array(sdata['embedding'])
-                        )
-                        
-                        if distance < min_distance and distance < 0.6:  # Threshold
-                            min_distance = distance
-                            best_match = sid
-                    
-                    if best_match:
-                        student_id = best_match
-                        student_name = student_faces[best_match]['name']
-                
-                except Exception as e:
-                    print(f"⚠️ Erro ao reconhecer rosto: {e}")
-                
-                # Adicionar ao resultado
-                analysis_results.append({
-                    'student_id': student_id,
-                    'student_name': student_name,
-                    'emotion': dominant_emotion,
-                    'emotion_scores': emotion_scores,
-                    'confidence': max(emotion_scores.values())
-                })
-                
-                # Contar emoção
-                emotion_counts[dominant_emotion] += 1
-            
-            # Calcular métricas globais
-            total_faces = len(faces)
-            
-            if total_faces > 0:
-                # Atenção: baseada em emoções positivas
-                positive = emotion_counts['happy'] + emotion_counts['surprise']
-                negative = emotion_counts['sad'] + emotion_counts['angry'] + emotion_counts['fear']
-                attention = round(((positive + emotion_counts['neutral']) / total_faces) * 100)
-                
-                # Disposição: baseada em felicidade
-                disposition = round((emotion_counts['happy'] / total_faces) * 100)
-                
-                # Engajamento: inverso de neutro e negativo
-                engagement = round((1 - ((emotion_counts['neutral'] + negative) / total_faces)) * 100)
-                
-                # Desempenho: média
-                performance = round((attention + disposition + engagement) / 3)
-                
-                # Atualizar dados globais
-                CURRENT_ANALYSIS[room_id] = {
-                    'timestamp': datetime.now().isoformat(),
-                    'total_faces': total_faces,
-                    'students': analysis_results,
-                    'emotion_counts': emotion_counts,
-                    'metrics': {
-                        'attention': attention,
-                        'disposition': disposition,
-                        'engagement': engagement,
-                        'performance': performance
-                    },
-                    'distribution': {
-                        'high': positive,
-                        'medium': emotion_counts['neutral'],
-                        'low': negative
-                    }
-                }
-                
-                print(f"📊 Sala {room_id}: {total_faces} rostos | Atenção: {attention}%")
-        
-        except Exception as e:
-            print(f"❌ Erro na análise: {e}")
-            time.sleep(1)
-    
-    cap.release()
-    print(f"🛑 Análise da sala {room_id} finalizada")
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'total_faces': total_faces,
+        'students': analysis_results,
+        'emotion_counts': emotion_counts,
+        'metrics': {
+            'attention': attention,
+            'disposition': disposition,
+            'engagement': engagement,
+            'performance': performance
+        },
+        'distribution': {
+            'high': positive,
+            'medium': emotion_counts['neutral'],
+            'low': negative
+        }
+    }
+
+def store_analysis(room_id, result):
+    """Resultado de um worker -> dados em tempo real da sala"""
+    analysis, timings = result
+    PIPELINE_TIMINGS.merge(timings)
+    if analysis is None or room_id not in CAMERA_STREAMS:
+        return
+    CURRENT_ANALYSIS[room_id] = analysis
+    room = scheduler.rooms.get(room_id)
+    metrics_store.add(room_id, room.school_id if room else None, analysis)
+    print(f"📊 Sala {room_id}: {analysis['total_faces']} rostos | Atenção: {analysis['metrics']['attention']}%")
+
+def create_app():
+    """Aplicação com o agendador das salas, o histórico de métricas e as rotas."""
+    global metrics_store, scheduler
+    # Importadas aqui: os processos do pool de análise (ver abaixo) não abrem banco de métricas nem câmeras
+    from flask_cors import CORS
+    from room_scheduler import RoomScheduler
+    from metrics_store import MetricsStore
+
+    app = Flask(__name__)
+    CORS(app)
+
+    # Histórico das métricas (amostras em lote + rollups por minuto/hora/dia)
+    metrics_store = MetricsStore()
+    # Frames amostrados de todas as salas -> pool fixo de processos com os modelos carregados
+    scheduler = RoomScheduler(analyze_frame, store_analysis, initializer=init_worker)
+
+    register_routes(app)
+    return app
 
 # ========== ENDPOINTS DA API ==========
 
-@app.route('/api/analysis/start', methods=['POST'])
-def start_analysis():
-    """Inicia análise de uma sala"""
-    data = request.json
-    room_id = data.get('room_id')
-    camera_url = data.get('camera_url')
-    school_id = data.get('school_id')
-    
-    if not all([room_id, camera_url, school_id]):
-        return jsonify({'error': 'Parâmetros faltando'}), 400
-    
-    # Verificar se já está rodando
-    if room_id in ANALYSIS_THREADS:
-        return jsonify({'message': 'Análise já está rodando'}), 200
-    
-    # Iniciar thread de análise
-    thread = threading.Thread(
-        target=analyze_camera_stream,
-        args=(room_id, camera_url, school_id),
-        daemon=True
-    )
-    thread.start()
-    
-    ANALYSIS_THREADS[room_id] = thread
-    CAMERA_STREAMS[room_id] = camera_url
-    
-    return jsonify({
-        'success': True,
-        'message': f'Análise iniciada para sala {room_id}'
-    })
-
-@app.route('/api/analysis/stop', methods=['POST'])
-def stop_analysis():
-    """Para análise de uma sala"""
-    data = request.json
-    room_id = data.get('room_id')
-    
-    if room_id in ANALYSIS_THREADS:
-        del ANALYSIS_THREADS[room_id]
-        del CAMERA_STREAMS[room_id]
-        if room_id in CURRENT_ANALYSIS:
-            del CURRENT_ANALYSIS[room_id]
-        
+def register_routes(app):
+    @app.route('/api/analysis/start', methods=['POST'])
+    def start_analysis():
+        """Inicia análise de uma sala"""
+        data = request.json
+        room_id = data.get('room_id')
+        camera_url = data.get('camera_url')
+        school_id = data.get('school_id')
+
+        if not all([room_id, camera_url, school_id]):
+            return jsonify({'error': 'Parâmetros faltando'}), 400
+
+        # Verificar se já está rodando
+        if not scheduler.add_room(room_id, camera_url, school_id):
+            return jsonify({'message': 'Análise já está rodando'}), 200
+
+        print(f"🎥 Iniciando análise da sala {room_id}")
+        CAMERA_STREAMS[room_id] = camera_url
+
         return jsonify({
             'success': True,
-            'message': f'Análise parada para sala {room_id}'
+            'message': f'Análise iniciada para sala {room_id}'
         })
-    
-    return jsonify({'error': 'Análise não está rodando'}), 404
 
-@app.route('/api/analysis/data/<int:room_id>', methods=['GET'])
-def get_analysis_data(room_id):
-    """Retorna dados de análise em tempo real"""
-    if room_id in CURRENT_ANALYSIS:
-        return jsonify(CURRENT_ANALYSIS[room_id])
-    
-    return jsonify({
-        'error': 'Nenhuma análise disponível para esta sala'
-    }), 404
-
-@app.route('/api/analysis/status', methods=['GET'])
-def get_status():
-    """Retorna status de todas as análises"""
-    return jsonify({
-        'active_rooms': list(ANALYSIS_THREADS.keys()),
-        'total_analyses': len(ANALYSIS_THREADS)
-    })
-
-@app.route('/health', methods=['GET'])
-def health():
-    """Health check"""
-    return jsonify({'status': 'ok', 'service': 'deepface-analysis'})
+    @app.route('/api/analysis/stop', methods=['POST'])
+    def stop_analysis():
+        """Para análise de uma sala"""
+        data = request.json
+        room_id = data.get('room_id')
+
+        if scheduler.remove_room(room_id):
+            CAMERA_STREAMS.pop(room_id, None)
+            if room_id in CURRENT_ANALYSIS:
+                del CURRENT_ANALYSIS[room_id]
+
+            return jsonify({
+                'success': True,
+                'message': f'Análise parada para sala {room_id}'
+            })
+
+        return jsonify({'error': 'Análise não está rodando'}), 404
+
+    @app.route('/api/analysis/data/<int:room_id>', methods=['GET'])
+    def get_analysis_data(room_id):
+        """Retorna dados de análise em tempo real"""
+        if room_id in CURRENT_ANALYSIS:
+            return jsonify(CURRENT_ANALYSIS[room_id])
+
+        return jsonify({
+            'error': 'Nenhuma análise disponível para esta sala'
+        }), 404
+
+    @app.route('/api/analysis/history/<int:room_id>', methods=['GET'])
+    def get_analysis_history(room_id):
+        """
+        Série histórica da sala, lida dos rollups.
+        Query: from/to (epoch em segundos; padrão últimas 24h) e
+        granularity (minute, hour, day ou raw; padrão conforme o período)
+        """
+        now = int(time.time())
+        try:
+            end = int(request.args.get('to', now))
+            start = int(request.args.get('from', end - 86400))
+        except ValueError:
+            return jsonify({'error': 'from/to devem ser epoch em segundos'}), 400
+
+        granularity = request.args.get('granularity')
+        if granularity and granularity not in ('minute', 'hour', 'day', 'raw'):
+            return jsonify({'error': 'granularity inválida'}), 400
+        if start >= end:
+            return jsonify({'error': 'Período inválido'}), 400
+
+        history = metrics_store.query(room_id, start, end, granularity)
+        if request.args.get('students') == '1':
+            history['students'] = metrics_store.query_students(room_id, start, end)
+        return jsonify(history)
+
+    @app.route('/api/analysis/status', methods=['GET'])
+    def get_status():
+        """Retorna status de todas as análises"""
+        return jsonify({
+            'active_rooms': list(CAMERA_STREAMS.keys()),
+            'total_analyses': len(CAMERA_STREAMS),
+            'scheduler': scheduler.status(),
+            'pipeline_timings': PIPELINE_TIMINGS.snapshot()
+        })
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        """Health check"""
+        return jsonify({'status': 'ok', 'service': 'deepface-analysis'})
+
+# Os processos do pool de análise (spawn) reimportam o script principal como
+# __mp_main__ quando o servidor roda com "python deepface_server.py": neles não
+# se cria app, agendador nem banco de métricas.
+if __name__ != '__mp_main__':
+    app = create_app()
 
 if __name__ == '__main__':
     print("🚀 Servidor DeepFace iniciando...")
     print("📡 Porta: 5001")
+    print(f"🧠 Workers de análise: {scheduler.workers} (ANALYSIS_WORKERS)")
     print("🔗 Endpoints disponíveis:")
     print("   POST /api/analysis/start - Iniciar análise")
     print("   POST /api/analysis/stop - Parar análise")
     print("   GET /api/analysis/data/<room_id> - Obter dados")
+    print("   GET /api/analysis/history/<room_id> - Histórico (from, to, granularity)")
     print("   GET /api/analysis/status - Status geral")
     print("")
     
@@ -0,0 +1,262 @@
+# Armazenamento persistente de embeddings dos alunos
+# EduFocus - Sistema de Monitoramento de Emoções
+#
+# Evita rodar DeepFace.represent em todas as fotos a cada início de análise
+# (e de novo para cada sala da mesma escola).
+#
+# Por (escola, modelo) ficam em EMBEDDING_STORE_DIR:
+#   school_<id>_<modelo>.json      índice: arquivo da matriz atual + uma linha por
+#                                  aluno (student_id, photo_hash, name, class_id)
+#   school_<id>_<modelo>.<v>.npy   matriz float32 (N, D) da versão v, aberta com mmap
+#
+# Cada versão grava uma matriz nova e só depois troca o índice (os.replace),
+# então um leitor sempre vê índice e matriz coerentes.
+#
+# Cada linha é identificada por (school_id, student_id, photo_hash, modelo):
+# na atualização só as fotos novas ou alteradas passam pelo modelo. Os
+# processos workers abrem a matriz em modo somente leitura (mmap), então as
+# páginas são compartilhadas pelo sistema operacional entre todas as salas.
+
+import os
+import json
+import base64
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+EMBEDDING_STORE_DIR = os.environ.get('EMBEDDING_STORE_DIR', 'embedding_store')
+LOCK_STALE_SECONDS = 600
+
+# Fotos migradas para o blob store do backend (server_python/blob_store.py):
+# photo_url vira '/api/blobs/<sha256>.<ext>' e o arquivo fica em BLOB_DIR
+BLOB_DIR = os.environ.get('BLOB_DIR', os.path.join('..', 'database', 'blobs'))
+BLOB_URL_MARKER = '/api/blobs/'
+
+
+def blob_name(photo):
+    """'<sha256>.<ext>' se photo_url for uma referência do blob store, senão None."""
+    if not isinstance(photo, str) or BLOB_URL_MARKER not in photo:
+        return None
+    name = photo.split(BLOB_URL_MARKER, 1)[1].split('?', 1)[0]
+    digest, _, ext = name.partition('.')
+    if len(digest) != 64 or not ext.isalnum() or any(c not in '0123456789abcdef' for c in digest):
+        return None
+    return name
+
+
+def photo_hash(photo):
+    name = blob_name(photo)
+    if name:
+        # O nome do blob já é o SHA-256 do conteúdo
+        return name.partition('.')[0]
+    return hashlib.blake2b(photo.encode('utf-8') if isinstance(photo, str) else photo, digest_size=16).hexdigest()
+
+
+def decode_photo(photo):
+    """photo_url (referência do blob store, ou base64 com ou sem prefixo data:image) -> bytes da imagem"""
+    name = blob_name(photo)
+    if name:
+        digest = name.partition('.')[0]
+        with open(os.path.join(BLOB_DIR, digest[:2], digest[2:4], name), 'rb') as f:
+            return f.read()
+    if photo.startswith('data:image'):
+        photo = photo.split(',')[1]
+    return base64.b64decode(photo)
+
+
+class StoredEmbeddings:
+    """Embeddings de uma escola carregados do disco (matrix é um memmap somente leitura)."""
+
+    def __init__(self, rows, matrix, version):
+        self.rows = rows
+        self.matrix = matrix
+        self.version = version
+        self.student_ids = [r['student_id'] for r in rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def find_closest(self, embeddings, threshold):
+        """
+        Aluno mais próximo (distância euclidiana) de cada embedding, numa
+        única operação vetorizada. Retorna [(row, distance) | None, ...].
+        """
+        queries = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if not len(self) or queries.shape[1] != self.matrix.shape[1]:
+            return [None] * len(queries)
+
+        # ||a - b||² = ||a||² - 2ab + ||b||²
+        distances = (
+            np.sum(queries ** 2, axis=1, keepdims=True)
+            - 2 * queries @ self.matrix.T
+            + self.squared_norms[None, :]
+        )
+        distances = np.sqrt(np.maximum(distances, 0))
+        best = np.argmin(distances, axis=1)
+        return [
+            (self.rows[row], float(distances[i, row])) if distances[i, row] < threshold else None
+            for i, row in enumerate(best)
+        ]
+
+    @property
+    def squared_norms(self):
+        if not hasattr(self, '_squared_norms'):
+            self._squared_norms = np.sum(np.asarray(self.matrix, dtype=np.float32) ** 2, axis=1)
+        return self._squared_norms
+
+
+class EmbeddingStore:
+    def __init__(self, directory=EMBEDDING_STORE_DIR):
+        self.directory = directory
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._loaded = {}  # {(school_id, model): StoredEmbeddings}
+        os.makedirs(directory, exist_ok=True)
+
+    def _base(self, school_id, model_name):
+        return os.path.join(self.directory, f'school_{int(school_id)}_{model_name}')
+
+    @contextmanager
+    def _lock(self, school_id, model_name):
+        """Exclusão entre threads (Lock) e entre os processos workers (arquivo .lock)."""
+        with self._locks_guard:
+            lock = self._locks.setdefault((int(school_id), model_name), threading.Lock())
+        with lock:
+            lock_path = self._base(school_id, model_name) + '.lock'
+            while True:
+                try:
+                    fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                    break
+                except FileExistsError:
+                    try:
+                        # Processo que morreu segurando o lock
+                        if time.time() - os.path.getmtime(lock_path) > LOCK_STALE_SECONDS:
+                            os.remove(lock_path)
+                            continue
+                    except OSError:
+                        continue
+                    time.sleep(0.2)
+            try:
+                yield
+            finally:
+                os.close(fd)
+                os.remove(lock_path)
+
+    def _read_index(self, school_id, model_name):
+        index_path = self._base(school_id, model_name) + '.json'
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path) as f:
+            return json.load(f)
+
+    def load(self, school_id, model_name):
+        """
+        Embeddings salvos da escola (None se ainda não houver). Reabre os
+        arquivos só quando outra atualização os substituiu.
+        """
+        index_path = self._base(school_id, model_name) + '.json'
+        if not os.path.exists(index_path):
+            return None
+
+        stat = os.stat(index_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        key = (int(school_id), model_name)
+        cached = self._loaded.get(key)
+        if cached and cached.version == version:
+            return cached
+
+        index = self._read_index(school_id, model_name)
+        if index['rows']:
+            matrix = np.load(os.path.join(self.directory, index['matrix']), mmap_mode='r')
+        else:
+            matrix = np.empty((0, index.get('dim') or 0), dtype=np.float32)
+        stored = StoredEmbeddings(index['rows'], matrix, version)
+        self._loaded[key] = stored
+        return stored
+
+    def refresh(self, school_id, model_name, load_students, represent, source_version=None):
+        """
+        Atualiza o armazenamento da escola.
+
+        load_students:  fn() -> [{'id', 'name', 'class_id', 'photo_url'}, ...] (estado atual do banco;
+                        photo_url em base64 ou referência '/api/blobs/...')
+        represent:      fn(bytes da imagem) -> embedding, chamada só para fotos novas ou alteradas
+        source_version: identificador da versão do banco (ex: mtime); se for igual ao
+                        da última atualização, nem os alunos são lidos.
+        Retorna (StoredEmbeddings, número de embeddings recalculados).
+        """
+        with self._lock(school_id, model_name):
+            old_index = self._read_index(school_id, model_name) or {'rows': [], 'version': 0}
+            if source_version is not None and old_index.get('source_version') == source_version:
+                return self.load(school_id, model_name), 0
+
+            old = self.load(school_id, model_name) if old_index['rows'] else None
+            old_rows = {(r['student_id'], r['photo_hash']): i for i, r in enumerate(old_index['rows'])}
+
+            rows, vectors, computed = [], [], 0
+            for student in load_students():
+                photo = student.get('photo_url')
+                if not photo:
+                    continue
+                digest = photo_hash(photo)
+                row = {
+                    'student_id': student['id'],
+                    'photo_hash': digest,
+                    'name': student['name'],
+                    'class_id': student.get('class_id')
+                }
+
+                previous = old_rows.get((student['id'], digest))
+                if previous is not None:
+                    vectors.append(np.asarray(old.matrix[previous], dtype=np.float32))
+                else:
+                    try:
+                        vectors.append(np.asarray(represent(decode_photo(photo)), dtype=np.float32).ravel())
+                        computed += 1
+                    except Exception as e:
+                        print(f"  ✗ Erro ao processar {student['name']}: {e}")
+                        continue
+                rows.append(row)
+
+            if rows == old_index['rows']:
+                # Nada mudou: só registrar a versão do banco para o caminho rápido
+                self._write_index(school_id, model_name, {**old_index, 'source_version': source_version})
+            else:
+                self._write(school_id, model_name, old_index, rows, vectors, source_version)
+            return self.load(school_id, model_name), computed
+
+    def _write(self, school_id, model_name, old_index, rows, vectors, source_version):
+        """Grava a matriz da nova versão e depois troca o índice."""
+        base = self._base(school_id, model_name)
+        version = old_index.get('version', 0) + 1
+        matrix_name = None
+        if rows:
+            matrix_name = os.path.basename(base) + f'.{version}.npy'
+            np.save(os.path.join(self.directory, matrix_name),
+                    np.ascontiguousarray(np.stack(vectors), dtype=np.float32))
+
+        self._write_index(school_id, model_name, {
+            'model': model_name,
+            'version': version,
+            'source_version': source_version,
+            'matrix': matrix_name,
+            'dim': len(vectors[0]) if vectors else 0,
+            'rows': rows
+        })
+
+        # Versões antigas: manter a anterior (pode estar mapeada por um worker)
+        for old_version in range(1, version - 1):
+            try:
+                os.remove(base + f'.{old_version}.npy')
+            except OSError:
+                pass
+
+    def _write_index(self, school_id, model_name, index):
+        index_path = self._base(school_id, model_name) + '.json'
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
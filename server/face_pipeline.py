@@ -0,0 +1,153 @@
+# Pipeline de análise facial em passada única
+# EduFocus - Sistema de Monitoramento de Emoções
+#
+# Antes, cada rosto passava por DeepFace.analyze (emoção) e DeepFace.represent
+# (Facenet) separadamente: cada chamada repetia detecção/pré-processamento e
+# buscava o modelo de novo. Aqui:
+#
+#   detect     -> DeepFace.extract_faces uma vez no frame (rostos alinhados)
+#   preprocess -> um lote com todos os rostos para cada modelo
+#   emotion    -> modelo de emoção no lote inteiro
+#   embedding  -> Facenet no lote inteiro
+#
+# Os modelos são carregados uma única vez (no worker); os tempos de cada
+# etapa voltam junto com o resultado e são acumulados em StageTimings.
+#
+# Os embeddings do frame são comparados com os das fotos cadastradas, gerados
+# por DeepFace.represent (embedding_store), então o lote do Facenet repete o
+# pré-processamento do represent (deepface==0.0.90): volta para BGR e
+# redimensiona com preprocessing.resize_image (mantém a proporção, com bordas).
+# Isso depende de internos do DeepFace: a versão fica fixada em requirements.txt
+# e, com outra instalada, o embedding volta para DeepFace.represent rosto a rosto.
+
+import time
+
+import cv2
+import deepface
+import numpy as np
+from deepface import DeepFace
+
+try:
+    from deepface.modules import preprocessing
+except ImportError:
+    preprocessing = None
+
+# Versão cujo pré-processamento do represent o lote do Facenet reproduz
+DEEPFACE_BATCH_VERSION = '0.0.90'
+BATCH_EMBEDDINGS = preprocessing is not None and getattr(deepface, '__version__', None) == DEEPFACE_BATCH_VERSION
+
+# Ordem das saídas do modelo de emoção do DeepFace
+EMOTION_LABELS = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+EMOTION_INPUT_SIZE = (48, 48)
+
+
+class StageTimings:
+    """Tempo (ms) de cada etapa do último frame + média móvel exponencial."""
+
+    SMOOTHING = 0.1
+
+    def __init__(self):
+        self.last = {}
+        self.average = {}
+        self.frames = 0
+
+    def record(self, name, ms):
+        self.last[name] = round(ms, 2)
+        previous = self.average.get(name)
+        self.average[name] = round(ms if previous is None else previous + self.SMOOTHING * (ms - previous), 2)
+
+    def merge(self, frame_timings):
+        """Acumula os tempos de um frame vindos de outro processo."""
+        self.frames += 1
+        for name, ms in frame_timings.items():
+            self.record(name, ms)
+
+    def snapshot(self):
+        return {'frames': self.frames, 'last_ms': dict(self.last), 'average_ms': dict(self.average)}
+
+
+class FacePipeline:
+    def __init__(self, face_model='Facenet', detector_backend='opencv'):
+        self.detector_backend = detector_backend
+        self.face_model_name = face_model
+        self.emotion_model = DeepFace.build_model('Emotion')
+        self.face_model = DeepFace.build_model(face_model)
+        self.face_input_size = tuple(getattr(self.face_model, 'input_shape', (160, 160)))
+        self.batch_embeddings = BATCH_EMBEDDINGS
+        if not self.batch_embeddings:
+            print(f"⚠️ deepface {getattr(deepface, '__version__', '?')} instalado (esperado {DEEPFACE_BATCH_VERSION}): "
+                  f"embeddings via DeepFace.represent, sem lote")
+
+    def represent_input(self, crop):
+        """Rosto RGB [0, 1] de extract_faces -> entrada (1, h, w, 3) do Facenet, igual ao DeepFace.represent."""
+        height, width = self.face_input_size[:2]
+        img = preprocessing.resize_image(img=crop[:, :, ::-1], target_size=(width, height))
+        return preprocessing.normalize_input(img=img, normalization='base')
+
+    def represent(self, crop):
+        """Embedding de um rosto já recortado pelo próprio DeepFace.represent (fora da versão fixada)."""
+        img = (crop[:, :, ::-1] * 255).astype(np.uint8)
+        return DeepFace.represent(
+            img_path=img,
+            model_name=self.face_model_name,
+            detector_backend='skip',
+            enforce_detection=False
+        )[0]['embedding']
+
+    def run(self, frame):
+        """
+        Analisa todos os rostos do frame.
+        Retorna (faces, timings): faces = [{facial_area, emotion, emotion_scores, embedding}]
+        e timings = {etapa: ms} deste frame.
+        """
+        timings = {}
+        started = time.perf_counter()
+
+        def lap(name):
+            nonlocal started
+            now = time.perf_counter()
+            timings[name] = round((now - started) * 1000, 2)
+            started = now
+
+        detected = DeepFace.extract_faces(
+            img_path=frame,
+            detector_backend=self.detector_backend,
+            enforce_detection=False,
+            align=True
+        )
+        # Sem rosto, o DeepFace devolve a imagem inteira com confidence 0
+        detected = [f for f in detected if f.get('confidence', 1) > 0]
+        lap('detect')
+
+        if not detected:
+            return [], timings
+
+        # Rostos já vêm recortados, alinhados e normalizados para [0, 1]
+        crops = [np.asarray(f['face'], dtype=np.float32) for f in detected]
+        emotion_batch = np.stack([
+            cv2.resize(cv2.cvtColor(c, cv2.COLOR_RGB2GRAY), EMOTION_INPUT_SIZE)[..., None] for c in crops
+        ])
+        if self.batch_embeddings:
+            face_batch = np.concatenate([self.represent_input(c) for c in crops])
+        lap('preprocess')
+
+        emotion_predictions = self.emotion_model.model.predict(emotion_batch, verbose=0)
+        lap('emotion')
+
+        if self.batch_embeddings:
+            embeddings = self.face_model.model.predict(face_batch, verbose=0)
+        else:
+            embeddings = [np.asarray(self.represent(c), dtype=np.float32) for c in crops]
+        lap('embedding')
+
+        faces = []
+        for face, predictions, embedding in zip(detected, emotion_predictions, embeddings):
+            total = float(predictions.sum()) or 1.0
+            scores = {label: round(100 * float(p) / total, 2) for label, p in zip(EMOTION_LABELS, predictions)}
+            faces.append({
+                'facial_area': face.get('facial_area'),
+                'emotion': max(scores, key=scores.get),
+                'emotion_scores': scores,
+                'embedding': embedding
+            })
+        return faces, timings
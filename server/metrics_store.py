@@ -0,0 +1,270 @@
+# Histórico das métricas das salas
+# EduFocus - Sistema de Monitoramento de Emoções
+#
+# Cada análise (CURRENT_ANALYSIS) vira uma amostra gravada em lote num
+# SQLite em modo WAL (METRICS_DB):
+#
+#   metric_samples          uma linha por amostra, colunas numéricas (sem JSON)
+#   student_emotion_samples emoção de cada aluno reconhecido na amostra
+#   metric_rollups          somas por sala e período (minute, hour, day),
+#                           atualizadas na mesma transação do lote
+#   student_emotion_daily   contagem de emoções por aluno/dia
+#
+# As consultas de período leem os rollups (nunca as amostras brutas, exceto
+# com granularity=raw), então o custo não cresce com a frequência de amostragem.
+
+import os
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+METRICS_DB = os.environ.get('METRICS_DB', 'metrics.db')
+FLUSH_SECONDS = 5
+FLUSH_MAX_SAMPLES = 500
+RAW_RETENTION_DAYS = int(os.environ.get('METRICS_RAW_RETENTION_DAYS', '7'))
+MINUTE_RETENTION_DAYS = 30
+
+EMOTIONS = ['happy', 'sad', 'angry', 'fear', 'surprise', 'disgust', 'neutral']
+METRICS = ['attention', 'disposition', 'engagement', 'performance']
+GRANULARITIES = ('minute', 'hour', 'day')
+
+
+def bucket_start(ts, granularity):
+    """Início do período (epoch em segundos); 'day' usa a meia-noite local."""
+    if granularity == 'minute':
+        return ts - ts % 60
+    if granularity == 'hour':
+        return ts - ts % 3600
+    day = datetime.fromtimestamp(ts).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int(day.timestamp())
+
+
+def pick_granularity(start, end):
+    """Menor granularidade que mantém a resposta em algumas centenas de pontos"""
+    span = end - start
+    if span <= 6 * 3600:
+        return 'minute'
+    if span <= 14 * 86400:
+        return 'hour'
+    return 'day'
+
+
+class MetricsStore:
+    def __init__(self, path=METRICS_DB):
+        self.path = path
+        self._buffer = []  # [(room_id, school_id, ts, analysis)]
+        self._lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._thread = None
+
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        emotion_cols = ', '.join(f'{e} INTEGER NOT NULL DEFAULT 0' for e in EMOTIONS)
+        metric_sums = ', '.join(f'sum_{m} REAL NOT NULL DEFAULT 0' for m in METRICS)
+        conn.executescript(f'''
+        CREATE TABLE IF NOT EXISTS metric_samples (
+            room_id INTEGER NOT NULL,
+            school_id INTEGER,
+            ts INTEGER NOT NULL,
+            total_faces INTEGER NOT NULL,
+            attention INTEGER, disposition INTEGER, engagement INTEGER, performance INTEGER,
+            {emotion_cols}
+        );
+        CREATE INDEX IF NOT EXISTS idx_metric_samples_room_ts ON metric_samples(room_id, ts);
+
+        CREATE TABLE IF NOT EXISTS student_emotion_samples (
+            room_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            emotion TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_student_emotion_samples_room_ts ON student_emotion_samples(room_id, ts);
+
+        CREATE TABLE IF NOT EXISTS metric_rollups (
+            granularity TEXT NOT NULL,
+            room_id INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            samples INTEGER NOT NULL DEFAULT 0,
+            sum_faces INTEGER NOT NULL DEFAULT 0,
+            {metric_sums},
+            {emotion_cols},
+            PRIMARY KEY (granularity, room_id, bucket)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS student_emotion_daily (
+            room_id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            {emotion_cols},
+            PRIMARY KEY (room_id, day, student_id)
+        ) WITHOUT ROWID;
+        ''')
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    # ----- escrita -----
+
+    def add(self, room_id, school_id, analysis):
+        """Enfileira uma amostra (gravada no próximo flush)."""
+        ts = int(datetime.fromisoformat(analysis['timestamp']).timestamp()) if analysis.get('timestamp') else int(time.time())
+        with self._lock:
+            self._buffer.append((int(room_id), school_id, ts, analysis))
+            full = len(self._buffer) >= FLUSH_MAX_SAMPLES
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='metrics-writer')
+                self._thread.start()
+        if full:
+            self._flush_event.set()
+
+    def _run(self):
+        conn = self._connect()
+        last_prune = 0
+        while True:
+            self._flush_event.wait(FLUSH_SECONDS)
+            self._flush_event.clear()
+            try:
+                self.flush(conn)
+                if time.time() - last_prune > 3600:
+                    self.prune(conn)
+                    last_prune = time.time()
+            except Exception as e:
+                print(f"❌ Erro ao gravar métricas: {e}")
+
+    def flush(self, conn=None):
+        """Grava as amostras pendentes e atualiza os rollups numa única transação."""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+
+        own_conn = conn is None
+        conn = conn or self._connect()
+
+        samples, students = [], []
+        rollups = {}   # {(granularity, room_id, bucket): [samples, faces, metric sums..., emotions...]}
+        daily = {}     # {(room_id, day, student_id): [emotions...]}
+
+        for room_id, school_id, ts, analysis in batch:
+            metrics = analysis.get('metrics', {})
+            counts = analysis.get('emotion_counts', {})
+            metric_values = [metrics.get(m) or 0 for m in METRICS]
+            emotion_values = [counts.get(e, 0) for e in EMOTIONS]
+
+            samples.append((room_id, school_id, ts, analysis.get('total_faces', 0), *metric_values, *emotion_values))
+
+            for granularity in GRANULARITIES:
+                key = (granularity, room_id, bucket_start(ts, granularity))
+                acc = rollups.setdefault(key, [0] * (2 + len(METRICS) + len(EMOTIONS)))
+                for i, value in enumerate([1, analysis.get('total_faces', 0), *metric_values, *emotion_values]):
+                    acc[i] += value
+
+            day = bucket_start(ts, 'day')
+            for student in analysis.get('students', []):
+                if student.get('student_id') is None or student.get('emotion') not in EMOTIONS:
+                    continue
+                students.append((room_id, ts, student['student_id'], student['emotion']))
+                acc = daily.setdefault((room_id, day, student['student_id']), [0] * len(EMOTIONS))
+                acc[EMOTIONS.index(student['emotion'])] += 1
+
+        sample_cols = ['room_id', 'school_id', 'ts', 'total_faces', *METRICS, *EMOTIONS]
+        rollup_cols = ['samples', 'sum_faces', *[f'sum_{m}' for m in METRICS], *EMOTIONS]
+
+        try:
+            conn.execute('BEGIN')
+            conn.executemany(
+                f'INSERT INTO metric_samples ({", ".join(sample_cols)}) VALUES ({", ".join("?" * len(sample_cols))})',
+                samples
+            )
+            conn.executemany(
+                'INSERT INTO student_emotion_samples (room_id, ts, student_id, emotion) VALUES (?, ?, ?, ?)',
+                students
+            )
+            conn.executemany(f'''
+                INSERT INTO metric_rollups (granularity, room_id, bucket, {", ".join(rollup_cols)})
+                VALUES (?, ?, ?, {", ".join("?" * len(rollup_cols))})
+                ON CONFLICT (granularity, room_id, bucket) DO UPDATE SET
+                {", ".join(f"{c} = {c} + excluded.{c}" for c in rollup_cols)}
+            ''', [(*key, *values) for key, values in rollups.items()])
+            conn.executemany(f'''
+                INSERT INTO student_emotion_daily (room_id, day, student_id, {", ".join(EMOTIONS)})
+                VALUES (?, ?, ?, {", ".join("?" * len(EMOTIONS))})
+                ON CONFLICT (room_id, day, student_id) DO UPDATE SET
+                {", ".join(f"{e} = {e} + excluded.{e}" for e in EMOTIONS)}
+            ''', [(*key, *values) for key, values in daily.items()])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # Devolver ao buffer para a próxima tentativa
+            with self._lock:
+                self._buffer[:0] = batch
+            raise
+        finally:
+            if own_conn:
+                conn.close()
+        return len(batch)
+
+    def prune(self, conn):
+        now = int(time.time())
+        conn.execute('DELETE FROM metric_samples WHERE ts < ?', (now - RAW_RETENTION_DAYS * 86400,))
+        conn.execute('DELETE FROM student_emotion_samples WHERE ts < ?', (now - RAW_RETENTION_DAYS * 86400,))
+        conn.execute("DELETE FROM metric_rollups WHERE granularity = 'minute' AND bucket < ?",
+                     (now - MINUTE_RETENTION_DAYS * 86400,))
+        conn.commit()
+
+    # ----- leitura -----
+
+    def query(self, room_id, start, end, granularity=None):
+        """Série da sala entre start e end (epoch); granularity: minute, hour, day ou raw."""
+        granularity = granularity or pick_granularity(start, end)
+        conn = self._connect()
+        try:
+            if granularity == 'raw':
+                rows = conn.execute('''
+                    SELECT * FROM metric_samples WHERE room_id = ? AND ts >= ? AND ts < ? ORDER BY ts
+                ''', (room_id, start, end)).fetchall()
+                points = [{
+                    'timestamp': r['ts'],
+                    'total_faces': r['total_faces'],
+                    'metrics': {m: r[m] for m in METRICS},
+                    'emotion_counts': {e: r[e] for e in EMOTIONS}
+                } for r in rows]
+            else:
+                rows = conn.execute('''
+                    SELECT * FROM metric_rollups
+                    WHERE granularity = ? AND room_id = ? AND bucket >= ? AND bucket < ?
+                    ORDER BY bucket
+                ''', (granularity, room_id, bucket_start(start, granularity), end)).fetchall()
+                points = [{
+                    'timestamp': r['bucket'],
+                    'samples': r['samples'],
+                    'avg_faces': round(r['sum_faces'] / r['samples'], 2),
+                    'metrics': {m: round(r[f'sum_{m}'] / r['samples'], 1) for m in METRICS},
+                    'emotion_counts': {e: r[e] for e in EMOTIONS}
+                } for r in rows]
+            return {'room_id': room_id, 'granularity': granularity, 'from': start, 'to': end, 'points': points}
+        finally:
+            conn.close()
+
+    def query_students(self, room_id, start, end):
+        """Emoções por aluno, somando os dias do período (tabela diária)"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(f'''
+                SELECT student_id, {", ".join(f"SUM({e}) AS {e}" for e in EMOTIONS)}
+                FROM student_emotion_daily
+                WHERE room_id = ? AND day >= ? AND day < ?
+                GROUP BY student_id
+            ''', (room_id, bucket_start(start, 'day'), end)).fetchall()
+            return [{
+                'student_id': r['student_id'],
+                'emotion_counts': {e: r[e] for e in EMOTIONS}
+            } for r in rows]
+        finally:
+            conn.close()
@@ -0,0 +1,234 @@
+"""
+Fila persistente de mensagens do WhatsApp (PyWhatKit)
+
+O /send só grava a mensagem nesta fila (arquivo SQLite local) e devolve o id;
+os workers enviam em segundo plano:
+
+- Durável: mensagens sobrevivem a reinícios; as que estavam em 'sending'
+  quando o processo caiu voltam para 'queued' na subida.
+- Limite de envio: intervalo mínimo entre mensagens e teto por minuto,
+  compartilhados por todos os workers (o WhatsApp Web bloqueia rajadas).
+- Retentativas: backoff exponencial até MAX_ATTEMPTS, depois status 'dead'
+  (dead-letter), que pode ser reenfileirado manualmente.
+
+Status: queued -> sending -> sent | queued (nova tentativa) | dead
+"""
+
+import os
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from collections import deque
+
+QUEUE_DB = os.getenv('WHATSAPP_QUEUE_DB', 'whatsapp_queue.db')
+# PyWhatKit controla o navegador/teclado: mais de um worker só faz sentido
+# com outro provedor de envio
+WORKERS = int(os.getenv('WHATSAPP_WORKERS', '1'))
+MIN_INTERVAL_SECONDS = float(os.getenv('WHATSAPP_MIN_INTERVAL', '5'))
+MAX_PER_MINUTE = int(os.getenv('WHATSAPP_MAX_PER_MINUTE', '6'))
+MAX_ATTEMPTS = int(os.getenv('WHATSAPP_MAX_ATTEMPTS', '4'))
+RETRY_BASE_SECONDS = 30
+POLL_INTERVAL = 1.0
+MAX_BULK = 1000
+RETENTION_SECONDS = 30 * 24 * 3600
+
+
+class RateLimiter:
+    """Intervalo mínimo entre envios + no máximo max_per_minute em 60s (janela deslizante)."""
+
+    def __init__(self, min_interval=MIN_INTERVAL_SECONDS, max_per_minute=MAX_PER_MINUTE):
+        self.min_interval = min_interval
+        self.max_per_minute = max_per_minute
+        self._sent = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Bloqueia até ser permitido enviar mais uma mensagem."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= 60:
+                    self._sent.popleft()
+
+                wait = 0.0
+                if self._sent:
+                    wait = self._sent[-1] + self.min_interval - now
+                if self.max_per_minute and len(self._sent) >= self.max_per_minute:
+                    wait = max(wait, self._sent[0] + 60 - now)
+
+                if wait <= 0:
+                    self._sent.append(now)
+                    return
+            time.sleep(wait)
+
+
+class MessageQueue:
+    """send_fn(phone, message) -> (success, detail); chamado pelos workers."""
+
+    def __init__(self, send_fn, path=QUEUE_DB, workers=WORKERS):
+        self.send_fn = send_fn
+        self.path = path
+        self.workers = workers
+        self.limiter = RateLimiter()
+        self._wakeup = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id TEXT PRIMARY KEY,
+            phone TEXT NOT NULL,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            sent_at REAL,
+            last_error TEXT
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_queued ON messages(status, next_attempt_at)')
+        recovered = conn.execute("UPDATE messages SET status = 'queued' WHERE status = 'sending'").rowcount
+        conn.commit()
+        conn.close()
+        if recovered:
+            logging.info(f"{recovered} mensagens em envio na última execução voltaram para a fila")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            for i in range(self.workers):
+                threading.Thread(target=self._work, daemon=True, name=f'whatsapp-worker-{i}').start()
+            self._started = True
+
+    def enqueue(self, messages):
+        """Grava [(phone, message), ...] numa única transação e retorna os ids, na mesma ordem."""
+        now = time.time()
+        rows = [(uuid.uuid4().hex, phone, message, now, now) for phone, message in messages]
+        conn = self._connect()
+        try:
+            conn.executemany('''
+                INSERT INTO messages (id, phone, message, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+        finally:
+            conn.close()
+        self._wakeup.set()
+        return [r[0] for r in rows]
+
+    def get(self, message_id):
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM messages WHERE id = ?', (message_id,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def list(self, status, limit=100):
+        conn = self._connect()
+        try:
+            return [dict(r) for r in conn.execute('''
+                SELECT * FROM messages WHERE status = ? ORDER BY created_at DESC LIMIT ?
+            ''', (status, limit))]
+        finally:
+            conn.close()
+
+    def retry(self, message_id):
+        """Devolve uma mensagem do dead-letter para a fila (tentativas zeradas)."""
+        conn = self._connect()
+        try:
+            updated = conn.execute('''
+                UPDATE messages SET status = 'queued', attempts = 0, next_attempt_at = ?
+                WHERE id = ? AND status = 'dead'
+            ''', (time.time(), message_id)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        if updated:
+            self._wakeup.set()
+        return bool(updated)
+
+    def _claim(self, conn):
+        """Reserva a próxima mensagem pronta (uma por vez: cada envio leva vários segundos)."""
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('''
+            SELECT id, phone, message, attempts FROM messages
+            WHERE status = 'queued' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at LIMIT 1
+        ''', (time.time(),)).fetchone()
+        if row:
+            conn.execute("UPDATE messages SET status = 'sending' WHERE id = ?", (row['id'],))
+        conn.commit()
+        return row
+
+    def _finish(self, conn, row, success, detail):
+        now = time.time()
+        attempts = row['attempts'] + 1
+        if success:
+            conn.execute('''
+                UPDATE messages SET status = 'sent', attempts = ?, sent_at = ?, last_error = NULL WHERE id = ?
+            ''', (attempts, now, row['id']))
+        elif attempts >= MAX_ATTEMPTS:
+            conn.execute('''
+                UPDATE messages SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?
+            ''', (attempts, detail, row['id']))
+            logging.error(f"Mensagem {row['id']} para {row['phone']} desistida após {attempts} tentativas: {detail}")
+        else:
+            delay = RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+            conn.execute('''
+                UPDATE messages SET status = 'queued', attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?
+            ''', (attempts, now + delay, detail, row['id']))
+        conn.commit()
+
+    def _work(self):
+        conn = self._connect()
+        last_prune = 0
+        while True:
+            try:
+                row = self._claim(conn)
+                if not row:
+                    self._wakeup.wait(POLL_INTERVAL)
+                    self._wakeup.clear()
+
+                    now = time.time()
+                    if now - last_prune > 3600:
+                        conn.execute("DELETE FROM messages WHERE status = 'sent' AND created_at < ?",
+                                     (now - RETENTION_SECONDS,))
+                        conn.commit()
+                        last_prune = now
+                    continue
+
+                self.limiter.acquire()
+                try:
+                    success, detail = self.send_fn(row['phone'], row['message'])
+                except Exception as e:
+                    success, detail = False, str(e)
+                self._finish(conn, row, success, None if success else detail)
+            except Exception as e:
+                logging.error(f"Erro na fila do WhatsApp: {e}")
+                time.sleep(POLL_INTERVAL)
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT status, COUNT(*) AS total FROM messages GROUP BY status').fetchall()
+            stats = {s: 0 for s in ('queued', 'sending', 'sent', 'dead')}
+            stats.update({r['status']: r['total'] for r in rows})
+            oldest = conn.execute(
+                "SELECT MIN(created_at) FROM messages WHERE status = 'queued'"
+            ).fetchone()[0]
+            stats['oldest_queued_seconds'] = round(time.time() - oldest, 1) if oldest else None
+            stats['workers'] = self.workers
+            return stats
+        finally:
+            conn.close()
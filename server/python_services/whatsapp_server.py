@@ -2,10 +2,10 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import pywhatkit
 import time
-import threading
 import pyautogui
 import logging
 from datetime import datetime
+from message_queue import MessageQueue, MAX_BULK
 
 # Configuração de logging
 logging.basicConfig(
@@ -20,65 +20,109 @@ logging.basicConfig(
 app = Flask(__name__)
 CORS(app)
 
-# Lock para garantir que apenas uma mensagem seja enviada por vez
-send_lock = threading.Lock()
-
 def send_message_task(phone, message, wait_time=15):
     """
-    Função auxiliar para enviar mensagem via PyWhatKit
+    Função auxiliar para enviar mensagem via PyWhatKit (chamada pelos workers da fila)
     """
-    with send_lock:
-        try:
-            logging.info(f"Iniciando envio para {phone}")
-            
-            # Formatar número: PyWhatKit espera +55...
-            if not phone.startswith('+'):
-                phone = '+' + phone
-            
-            # Enviar mensagem instantaneamente (abre o navegador)
-            # wait_time: tempo para carregar o WhatsApp Web
-            # tab_close: se True, fecha a aba depois
-            pywhatkit.sendwhatmsg_instantly(
-                phone_no=phone, 
-                message=message, 
-                wait_time=wait_time, 
-                tab_close=True,
-                close_time=3
-            )
-            
-            logging.info(f"Mensagem enviada para {phone}")
-            return True, "Enviado com sucesso"
-        except Exception as e:
-            logging.error(f"Erro ao enviar para {phone}: {str(e)}")
-            return False, str(e)
+    try:
+        logging.info(f"Iniciando envio para {phone}")
+        
+        # Formatar número: PyWhatKit espera +55...
+        if not phone.startswith('+'):
+            phone = '+' + phone
+        
+        # Enviar mensagem instantaneamente (abre o navegador)
+        # wait_time: tempo para carregar o WhatsApp Web
+        # tab_close: se True, fecha a aba depois
+        pywhatkit.sendwhatmsg_instantly(
+            phone_no=phone, 
+            message=message, 
+            wait_time=wait_time, 
+            tab_close=True,
+            close_time=3
+        )
+        
+        logging.info(f"Mensagem enviada para {phone}")
+        return True, "Enviado com sucesso"
+    except Exception as e:
+        logging.error(f"Erro ao enviar para {phone}: {str(e)}")
+        return False, str(e)
+
+# Fila persistente: o /send responde na hora e os workers enviam com limite de taxa
+message_queue = MessageQueue(send_message_task)
+
+def parse_message(item):
+    """{'phone', 'message'} -> (phone, message) ou None se faltar algum campo"""
+    phone = str(item.get('phone') or '').strip()
+    message = item.get('message')
+    if not phone or not message:
+        return None
+    return phone, message
 
 @app.route('/send', methods=['POST'])
 def send_message():
-    data = request.json
-    phone = data.get('phone')
-    message = data.get('message')
+    data = request.json or {}
+    parsed = parse_message(data)
     
-    if not phone or not message:
+    if not parsed:
         return jsonify({'success': False, 'error': 'Phone and message are required'}), 400
 
-    logging.info(f"Recebida solicitação de envio para {phone}")
-    
-    # Processar em thread separada para não bloquear a resposta HTTP
-    # Mas como o PyWhatKit usa GUI, idealmente deve ser síncrono ou com fila
-    # Vamos fazer síncrono por enquanto para garantir o retorno correto
+    message_id = message_queue.enqueue([parsed])[0]
+    logging.info(f"Mensagem {message_id} para {parsed[0]} enfileirada")
     
-    success, result = send_message_task(phone, message)
-    
-    if success:
-        return jsonify({'success': True, 'message': result})
+    return jsonify({'success': True, 'id': message_id, 'status': 'queued'}), 202
+
+@app.route('/send/bulk', methods=['POST'])
+def send_bulk():
+    """
+    Enfileira várias mensagens de uma vez:
+    {"messages": [{"phone", "message"}, ...]} ou {"phones": [...], "message": "..."}
+    """
+    data = request.json or {}
+    if 'phones' in data:
+        items = [{'phone': phone, 'message': data.get('message')} for phone in data.get('phones') or []]
     else:
-        return jsonify({'success': False, 'error': result}), 500
+        items = data.get('messages') or []
+
+    if not items:
+        return jsonify({'success': False, 'error': 'No messages'}), 400
+    if len(items) > MAX_BULK:
+        return jsonify({'success': False, 'error': f'Maximum {MAX_BULK} messages per request'}), 400
+
+    parsed = [parse_message(item) for item in items]
+    invalid = [i for i, p in enumerate(parsed) if p is None]
+    if invalid:
+        return jsonify({'success': False, 'error': 'Phone and message are required', 'invalid': invalid}), 400
+
+    ids = message_queue.enqueue(parsed)
+    logging.info(f"{len(ids)} mensagens enfileiradas em lote")
+    return jsonify({'success': True, 'ids': ids, 'status': 'queued'}), 202
+
+@app.route('/messages/<message_id>', methods=['GET'])
+def message_status(message_id):
+    message = message_queue.get(message_id)
+    if not message:
+        return jsonify({'success': False, 'error': 'Message not found'}), 404
+    return jsonify({'success': True, **message})
+
+@app.route('/messages/dead', methods=['GET'])
+def dead_messages():
+    """Mensagens que esgotaram as tentativas (dead-letter)"""
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    return jsonify({'success': True, 'messages': message_queue.list('dead', limit)})
+
+@app.route('/messages/<message_id>/retry', methods=['POST'])
+def retry_message(message_id):
+    if not message_queue.retry(message_id):
+        return jsonify({'success': False, 'error': 'Message not found in dead-letter'}), 404
+    return jsonify({'success': True, 'id': message_id, 'status': 'queued'})
 
 @app.route('/status', methods=['GET'])
 def status():
-    return jsonify({'status': 'online', 'service': 'whatsapp-python-bridge'})
+    return jsonify({'status': 'online', 'service': 'whatsapp-python-bridge', 'queue': message_queue.stats()})
 
 if __name__ == '__main__':
     print("🚀 Servidor WhatsApp Python iniciando na porta 5002...")
     print("⚠️  IMPORTANTE: Mantenha o WhatsApp Web logado no navegador padrão!")
+    message_queue.start()
     app.run(host='0.0.0.0', port=5002)
@@ -0,0 +1,237 @@
+# Agendador de análise das câmeras das salas
+# EduFocus - Sistema de Monitoramento de Emoções
+#
+# Substitui a thread-por-sala que decodificava todos os frames:
+#
+# - CameraGrabber: uma thread leve por câmera que só faz cap.grab() (sem
+#   decodificar) e, quando o agendador pede, decodifica o frame mais recente
+#   com cap.retrieve().
+# - RoomScheduler: a cada tick pede um frame às salas cujo intervalo venceu.
+#   Cada sala tem no máximo um frame aguardando (um novo substitui o antigo)
+#   e as salas são atendidas em rodízio, então uma sala não monopoliza os
+#   workers. Os frames vão para um pool fixo de processos (os modelos são
+#   carregados uma vez por processo).
+# - Amostragem adaptativa: se a fila cresce, o intervalo de todas as salas
+#   aumenta (até MAX_INTERVAL); com os workers ociosos, volta ao BASE_INTERVAL.
+
+import os
+import time
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', '2'))
+BASE_INTERVAL = float(os.environ.get('ANALYSIS_INTERVAL', '1.0'))  # segundos entre análises da mesma sala
+MAX_INTERVAL = float(os.environ.get('ANALYSIS_MAX_INTERVAL', '10.0'))
+TICK_SECONDS = 0.1
+RECONNECT_SECONDS = 5
+
+
+class CameraGrabber:
+    """Mantém a câmera aberta descartando frames sem decodificá-los."""
+
+    def __init__(self, room_id, camera_url):
+        self.room_id = room_id
+        self.camera_url = camera_url
+        self.running = True
+        self.connected = False
+        self._request = threading.Event()
+        self._callback = None
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f'camera-{room_id}')
+        self._thread.start()
+
+    def request_frame(self, callback):
+        """Pede o próximo frame decodificado; callback(frame) é chamado na thread da câmera."""
+        self._callback = callback
+        self._request.set()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        cap = None
+        while self.running:
+            if cap is None or not cap.isOpened():
+                cap = cv2.VideoCapture(self.camera_url)
+                if not cap.isOpened():
+                    print(f"❌ Erro ao conectar câmera da sala {self.room_id}")
+                    self.connected = False
+                    time.sleep(RECONNECT_SECONDS)
+                    continue
+                self.connected = True
+
+            if not cap.grab():
+                print(f"⚠️ Erro ao ler frame da sala {self.room_id}")
+                cap.release()
+                cap = None
+                time.sleep(1)
+                continue
+
+            if self._request.is_set():
+                self._request.clear()
+                ret, frame = cap.retrieve()
+                if ret and self._callback:
+                    self._callback(frame)
+
+        if cap is not None:
+            cap.release()
+        print(f"🛑 Câmera da sala {self.room_id} liberada")
+
+
+class Room:
+    def __init__(self, room_id, camera_url, school_id):
+        self.room_id = room_id
+        self.camera_url = camera_url
+        self.school_id = school_id
+        self.grabber = CameraGrabber(room_id, camera_url)
+        self.next_due = 0.0
+        self.waiting_frame = False  # frame pedido à câmera e ainda não entregue
+        self.in_flight = False      # frame sendo analisado por um worker
+        self.processed = 0
+        self.dropped = 0            # frames substituídos por um mais novo antes de serem analisados
+        self.last_latency = None
+
+
+class RoomScheduler:
+    """
+    analyze_fn(room_id, school_id, frame) roda nos processos do pool e deve
+    ser uma função de módulo (picklable). on_result(room_id, result) roda no
+    processo principal.
+    """
+
+    def __init__(self, analyze_fn, on_result, workers=ANALYSIS_WORKERS, initializer=None):
+        self.analyze_fn = analyze_fn
+        self.on_result = on_result
+        self.workers = workers
+        self.initializer = initializer
+        self.rooms = {}
+        self.pending = OrderedDict()  # {room_id: (frame, captured_at)}, em ordem de chegada
+        self.in_flight = 0
+        self.load_factor = 1.0        # multiplicador do intervalo de amostragem
+        self._lock = threading.Lock()
+        self._executor = None
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread:
+            return
+        # spawn: o TensorFlow não se dá bem com fork
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=self.initializer
+        )
+        self._thread = threading.Thread(target=self._loop, daemon=True, name='room-scheduler')
+        self._thread.start()
+
+    def add_room(self, room_id, camera_url, school_id):
+        with self._lock:
+            if room_id in self.rooms:
+                return False
+            self._ensure_started()
+            self.rooms[room_id] = Room(room_id, camera_url, school_id)
+            return True
+
+    def remove_room(self, room_id):
+        with self._lock:
+            room = self.rooms.pop(room_id, None)
+            self.pending.pop(room_id, None)
+        if room:
+            room.grabber.stop()
+        return room is not None
+
+    def interval(self):
+        return min(MAX_INTERVAL, BASE_INTERVAL * self.load_factor)
+
+    def _loop(self):
+        while True:
+            try:
+                self._request_due_frames()
+                self._dispatch()
+                self._adapt()
+            except Exception as e:
+                print(f"❌ Erro no agendador: {e}")
+            time.sleep(TICK_SECONDS)
+
+    def _request_due_frames(self):
+        now = time.monotonic()
+        with self._lock:
+            rooms = list(self.rooms.values())
+        for room in rooms:
+            if room.waiting_frame or now < room.next_due:
+                continue
+            room.waiting_frame = True
+            room.next_due = now + self.interval()
+            room.grabber.request_frame(lambda frame, room=room: self._frame_ready(room, frame))
+
+    def _frame_ready(self, room, frame):
+        with self._lock:
+            room.waiting_frame = False
+            if room.room_id not in self.rooms:
+                return
+            if room.room_id in self.pending:
+                # Sala continua na mesma posição do rodízio, só com o frame mais novo
+                room.dropped += 1
+            self.pending[room.room_id] = (frame, time.monotonic())
+
+    def _dispatch(self):
+        """Entrega frames aos workers livres, em rodízio entre as salas."""
+        while True:
+            with self._lock:
+                if self.in_flight >= self.workers:
+                    return
+                ready = next((rid for rid in self.pending if not self.rooms[rid].in_flight), None)
+                if ready is None:
+                    return
+                frame, captured_at = self.pending.pop(ready)
+                room = self.rooms[ready]
+                room.in_flight = True
+                self.in_flight += 1
+
+            future = self._executor.submit(self.analyze_fn, room.room_id, room.school_id, frame)
+            future.add_done_callback(lambda f, room=room, t=captured_at: self._done(room, f, t))
+
+    def _done(self, room, future, captured_at):
+        with self._lock:
+            room.in_flight = False
+            self.in_flight -= 1
+            room.processed += 1
+            room.last_latency = time.monotonic() - captured_at
+            active = room.room_id in self.rooms
+
+        try:
+            result = future.result()
+            if active:
+                self.on_result(room.room_id, result)
+        except Exception as e:
+            print(f"❌ Erro na análise da sala {room.room_id}: {e}")
+
+    def _adapt(self):
+        """Fila acumulando -> amostrar menos; workers ociosos -> voltar ao intervalo base."""
+        with self._lock:
+            backlog = len(self.pending)
+            busy = self.in_flight
+        if backlog > self.workers:
+            self.load_factor = min(MAX_INTERVAL / BASE_INTERVAL, self.load_factor * 1.1)
+        elif backlog == 0 and busy < self.workers:
+            self.load_factor = max(1.0, self.load_factor * 0.95)
+
+    def status(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'in_flight': self.in_flight,
+                'queue_depth': len(self.pending),
+                'interval_seconds': round(self.interval(), 2),
+                'rooms': {
+                    str(r.room_id): {
+                        'connected': r.grabber.connected,
+                        'processed': r.processed,
+                        'dropped': r.dropped,
+                        'latency_seconds': round(r.last_latency, 3) if r.last_latency is not None else None
+                    } for r in self.rooms.values()
+                }
+            }
@@ -1,91 +1,123 @@
 from flask import Flask, send_from_directory, jsonify, request
-from flask_cors import CORS
 import os
-from database import init_system_db
-from routes.auth import auth_bp
-from routes.school import school_bp
-from routes.attendance import attendance_bp
-from routes.guardian import guardian_bp
-from routes.admin import admin_bp
-from routes.technician import technician_bp
-from routes.support import support_bp
-from routes.teacher import teacher_bp
-from routes.location import location_bp
-from routes.affiliates import affiliates_bp
-
-app = Flask(__name__, static_folder='../client/dist')
-app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0 # Desativar cache em desenvolvimento
-
-# Configuração CORS - permitir todas as origens em desenvolvimento
-CORS(app, resources={r"/api/*": {
-    "origins": ["http://localhost:5173", "http://localhost:3001", "http://127.0.0.1:5173", "http://127.0.0.1:3001"],
-    "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    "allow_headers": ["Content-Type", "Authorization", "X-Requested-With"],
-    "supports_credentials": True,
-    "expose_headers": ["Content-Type", "Authorization"]
-}})
-
-# Health check - rota crucial para monitoramento
-@app.route('/api/health')
-def health_check():
-    return {'status': 'healthy', 'service': 'edufocus-backend'}, 200
-
-# Inicializar DB ao arrancar
-with app.app_context():
-    init_system_db()
-
-# Registrar Blueprints
-app.register_blueprint(auth_bp)
-app.register_blueprint(attendance_bp)
-app.register_blueprint(guardian_bp)
-app.register_blueprint(school_bp)
-app.register_blueprint(admin_bp)
-app.register_blueprint(technician_bp)
-app.register_blueprint(support_bp)
-app.register_blueprint(teacher_bp)
-app.register_blueprint(location_bp)
-app.register_blueprint(affiliates_bp)
-from routes.teacher_academic import teacher_bp as teacher_academic_bp
-app.register_blueprint(teacher_academic_bp)
-from routes.financial import financial_bp
-app.register_blueprint(financial_bp)
-from routes.saas_billing import saas_billing_bp
-app.register_blueprint(saas_billing_bp)
-
-from routes.employee_app import employee_bp
-app.register_blueprint(employee_bp)
-
-# Rota para servir Uploads
-UPLOAD_FOLDER_ROOT = os.path.join(os.getcwd(), 'uploads')
-@app.route('/uploads/<path:path>')
-def serve_uploads(path):
-    return send_from_directory(UPLOAD_FOLDER_ROOT, path)
-
-# Rota para servir o frontend (Client)
-@app.route('/')
-def serve_index():
-    return send_from_directory(app.static_folder, 'index.html')
-
-@app.route('/<path:path>')
-def serve_static(path):
-    if os.path.exists(os.path.join(app.static_folder, path)):
-        return send_from_directory(app.static_folder, path)
-    else:
-        # Fallback para SPA (se usar history mode) ou 404
+
+
+def create_app():
+    """Aplicação com o banco inicializado e as rotas registradas."""
+    # Importadas aqui: os processos do pool do bcrypt (ver abaixo) não carregam rotas nem notificações
+    from flask_cors import CORS
+    from database import init_system_db, init_app as init_db_app, write_queue_stats
+    from password_hasher import password_hasher, PasswordHasherBusy, LoginBusy
+    from guardian_index import ensure_guardian_index
+    from notification_dispatcher import dispatcher
+    from routes.auth import auth_bp
+    from routes.school import school_bp
+    from routes.attendance import attendance_bp
+    from routes.guardian import guardian_bp
+    from routes.admin import admin_bp
+    from routes.technician import technician_bp
+    from routes.support import support_bp
+    from routes.teacher import teacher_bp
+    from routes.location import location_bp
+    from routes.affiliates import affiliates_bp
+    from routes.blobs import blobs_bp
+    from routes.teacher_academic import teacher_bp as teacher_academic_bp
+    from routes.financial import financial_bp
+    from routes.saas_billing import saas_billing_bp
+    from routes.employee_app import employee_bp
+
+    app = Flask(__name__, static_folder='../client/dist')
+    app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0 # Desativar cache em desenvolvimento
+
+    # Configuração CORS - permitir todas as origens em desenvolvimento
+    CORS(app, resources={r"/api/*": {
+        "origins": ["http://localhost:5173", "http://localhost:3001", "http://127.0.0.1:5173", "http://127.0.0.1:3001"],
+        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        "allow_headers": ["Content-Type", "Authorization", "X-Requested-With"],
+        "supports_credentials": True,
+        "expose_headers": ["Content-Type", "Authorization", "X-Next-Cursor", "Link"]
+    }})
+
+    # Health check - rota crucial para monitoramento
+    @app.route('/api/health')
+    def health_check():
+        return {'status': 'healthy', 'service': 'edufocus-backend', 'notifications': dispatcher.stats(),
+                'write_queues': write_queue_stats(), 'password_hasher': password_hasher.stats()}, 200
+
+    # Pico de logins: pool do bcrypt cheio (503) ou logins simultâneos demais do mesmo IP/email (429)
+    @app.errorhandler(PasswordHasherBusy)
+    def password_hasher_busy(e):
+        return jsonify({'success': False, 'message': str(e)}), 503, {'Retry-After': '2'}
+
+    @app.errorhandler(LoginBusy)
+    def login_busy(e):
+        return jsonify({'success': False, 'message': str(e)}), 429, {'Retry-After': '1'}
+
+    # Inicializar DB ao arrancar
+    with app.app_context():
+        init_system_db()
+        ensure_guardian_index()
+
+    # Devolver conexões ao pool ao fim de cada requisição
+    init_db_app(app)
+
+    # Registrar Blueprints
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(attendance_bp)
+    app.register_blueprint(guardian_bp)
+    app.register_blueprint(school_bp)
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(technician_bp)
+    app.register_blueprint(support_bp)
+    app.register_blueprint(teacher_bp)
+    app.register_blueprint(location_bp)
+    app.register_blueprint(affiliates_bp)
+    app.register_blueprint(blobs_bp)
+    app.register_blueprint(teacher_academic_bp)
+    app.register_blueprint(financial_bp)
+    app.register_blueprint(saas_billing_bp)
+    app.register_blueprint(employee_bp)
+
+    # Rota para servir Uploads
+    UPLOAD_FOLDER_ROOT = os.path.join(os.getcwd(), 'uploads')
+    @app.route('/uploads/<path:path>')
+    def serve_uploads(path):
+        return send_from_directory(UPLOAD_FOLDER_ROOT, path)
+
+    # Rota para servir o frontend (Client)
+    @app.route('/')
+    def serve_index():
         return send_from_directory(app.static_folder, 'index.html')
 
-# Rota específica para servir arquivos do Guardian PWA 
-GUARDIAN_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../client/dist/guardian-pwa')
+    @app.route('/<path:path>')
+    def serve_static(path):
+        if os.path.exists(os.path.join(app.static_folder, path)):
+            return send_from_directory(app.static_folder, path)
+        else:
+            # Fallback para SPA (se usar history mode) ou 404
+            return send_from_directory(app.static_folder, 'index.html')
+
+    # Rota específica para servir arquivos do Guardian PWA 
+    GUARDIAN_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../client/dist/guardian-pwa')
+
+    @app.route('/guardian/<path:path>')
+    def serve_guardian(path):
+        if os.path.exists(os.path.join(GUARDIAN_FOLDER, path)):
+            return send_from_directory(GUARDIAN_FOLDER, path)
+        return jsonify({'error': 'File not found'}), 404
+
+    @app.route('/guardian/')
+    def serve_guardian_index():
+        return send_from_directory(GUARDIAN_FOLDER, 'index.html')
+
+    return app
 
-@app.route('/guardian/<path:path>')
-def serve_guardian(path):
-    if os.path.exists(os.path.join(GUARDIAN_FOLDER, path)):
-        return send_from_directory(GUARDIAN_FOLDER, path)
-    return jsonify({'error': 'File not found'}), 404
 
-@app.route('/guardian/')
-def serve_guardian_index():
-    return send_from_directory(GUARDIAN_FOLDER, 'index.html')
+# Os processos do pool do bcrypt (password_hasher, 'spawn') reimportam o script
+# principal como __mp_main__ quando o servidor roda com "python app.py": neles
+# não se inicializa banco nem se registra rota. gunicorn usa app:app.
+if __name__ != '__mp_main__':
+    app = create_app()
 
 if __name__ == '__main__':
     print("🚀 Servidor Python EduFocus iniciando na porta 5000...")
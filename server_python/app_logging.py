@@ -0,0 +1,74 @@
+"""
+Logs com nível e campos estruturados, no lugar de print() nos caminhos de toda requisição.
+
+    LOG_LEVEL=INFO      DEBUG mostra o detalhe por requisição (token, conexões, acesso de filial)
+    LOG_FORMAT=text     'json' gera uma linha JSON por evento (para agregadores de log)
+
+Uso:
+    log = get_logger('auth')
+    log.info('login ok', extra={'email': email, 'role': role})
+
+Campos passados em extra saem como chave=valor no texto e como chaves no JSON.
+"""
+import os
+import sys
+import json
+import logging
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+
+# Atributos que todo LogRecord tem; o resto veio de extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def record_fields(record):
+    return {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS and not k.startswith('_')}
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            line += ' ' + ' '.join(f'{k}={v}' for k, v in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+_configured = False
+
+
+def setup_logging():
+    """Configura o logger 'edufocus' uma vez por processo (chamado por get_logger)."""
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+    root = logging.getLogger('edufocus')
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+
+def get_logger(name):
+    setup_logging()
+    return logging.getLogger(f'edufocus.{name}')
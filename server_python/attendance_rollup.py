@@ -0,0 +1,274 @@
+"""
+Resumo diário de presença (tabelas attendance_daily_student e attendance_daily_class
+de cada school_{id}.db), para painéis e calendários não relerem attendance.
+
+- attendance_daily_student: um registro por aluno/dia com primeira chegada,
+  última saída e atraso (primeira chegada depois de ATTENDANCE_LATE_AFTER).
+- attendance_daily_class: por turma/dia, quantos alunos chegaram e quantos atrasados.
+  Faltas = alunos da turma - presentes (calculado na leitura).
+
+record_event() (ou record_events(), para um lote) deve ser chamado na mesma
+transação do INSERT em attendance.
+Gravações fora das rotas (scripts force_*.py, restauração de backup) pedem
+reconstrução:
+    python attendance_rollup.py               # todas as escolas
+    python attendance_rollup.py --school 14 --since 2026-01-01
+"""
+import os
+
+# Horário (HH:MM, hora local) a partir do qual a primeira chegada conta como atraso
+ATTENDANCE_LATE_AFTER = os.environ.get('ATTENDANCE_LATE_AFTER', '07:30')
+
+ARRIVAL_TYPES = ('arrival', 'entry')
+DEPARTURE_TYPES = ('departure', 'exit')
+
+# 'AAAA-MM-DDTHH:MM:SS' independente do formato gravado (espaço, microssegundos, Z)
+NORMALIZED_TS_SQL = "replace(substr({column}, 1, 19), ' ', 'T')"
+
+
+def create_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS attendance_daily_student (
+        student_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        class_name TEXT NOT NULL DEFAULT '',
+        first_arrival TEXT,
+        last_departure TEXT,
+        late INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (student_id, day)
+    ) WITHOUT ROWID''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS attendance_daily_class (
+        class_name TEXT NOT NULL,
+        day TEXT NOT NULL,
+        present INTEGER NOT NULL DEFAULT 0,
+        late INTEGER NOT NULL DEFAULT 0,
+        first_arrival TEXT,
+        last_departure TEXT,
+        PRIMARY KEY (class_name, day)
+    ) WITHOUT ROWID''')
+    # Painel do dia inteiro da escola (todas as turmas)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_daily_student_day ON attendance_daily_student(day)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_daily_class_day ON attendance_daily_class(day)')
+
+
+def normalize_timestamp(timestamp):
+    return str(timestamp)[:19].replace(' ', 'T')
+
+
+def is_late(first_arrival):
+    return bool(first_arrival) and first_arrival[11:16] > ATTENDANCE_LATE_AFTER
+
+
+def record_event(cur, student_id, class_name, event_type, timestamp):
+    """Atualiza o resumo do aluno e da turma com um novo registro de attendance."""
+    if event_type not in ARRIVAL_TYPES and event_type not in DEPARTURE_TYPES:
+        return
+    timestamp = normalize_timestamp(timestamp)
+    day = timestamp[:10]
+
+    row = cur.execute('''
+        SELECT class_name, first_arrival, last_departure, late FROM attendance_daily_student
+        WHERE student_id = ? AND day = ?
+    ''', (student_id, day)).fetchone()
+    # A turma fica a do primeiro registro do dia
+    class_name = row[0] if row else (class_name or '')
+    old_arrival, old_departure, old_late = (row[1], row[2], row[3]) if row else (None, None, 0)
+
+    first_arrival, last_departure = old_arrival, old_departure
+    if event_type in ARRIVAL_TYPES:
+        first_arrival = min(old_arrival, timestamp) if old_arrival else timestamp
+    else:
+        last_departure = max(old_departure, timestamp) if old_departure else timestamp
+    late = int(is_late(first_arrival))
+
+    cur.execute('''
+        INSERT OR REPLACE INTO attendance_daily_student
+            (student_id, day, class_name, first_arrival, last_departure, late)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (student_id, day, class_name, first_arrival, last_departure, late))
+
+    # Turma: só as diferenças (aluno passou a presente, atraso mudou)
+    cur.execute('''
+        INSERT INTO attendance_daily_class (class_name, day, present, late, first_arrival, last_departure)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(class_name, day) DO UPDATE SET
+            present = present + excluded.present,
+            late = late + excluded.late,
+            first_arrival = COALESCE(MIN(first_arrival, excluded.first_arrival), first_arrival, excluded.first_arrival),
+            last_departure = COALESCE(MAX(last_departure, excluded.last_departure), last_departure, excluded.last_departure)
+    ''', (class_name, day, int(bool(first_arrival)) - int(bool(old_arrival)), late - old_late,
+          first_arrival, last_departure))
+
+
+def record_events(cur, events):
+    """
+    record_event de um lote [(student_id, class_name, event_type, timestamp)]: só a
+    primeira chegada e a última saída de cada aluno/dia mudam o resumo, então é
+    uma atualização por aluno/dia/tipo em vez de uma por registro.
+    """
+    latest = {}  # {(aluno, dia, tipo): (turma, event_type, timestamp)}
+    for student_id, class_name, event_type, timestamp in events:
+        arrival = event_type in ARRIVAL_TYPES
+        if not arrival and event_type not in DEPARTURE_TYPES:
+            continue
+        timestamp = normalize_timestamp(timestamp)
+        key = (student_id, timestamp[:10], arrival)
+        current = latest.get(key)
+        if current is None or (timestamp < current[2] if arrival else timestamp > current[2]):
+            latest[key] = (class_name, event_type, timestamp)
+    for (student_id, _, _), (class_name, event_type, timestamp) in latest.items():
+        record_event(cur, student_id, class_name, event_type, timestamp)
+
+
+def daily_student_select(where=''):
+    """
+    SELECT do resumo por aluno/dia direto de attendance (where: filtro extra em a.*).
+    O primeiro parâmetro é ATTENDANCE_LATE_AFTER, antes dos do where.
+    """
+    ts = NORMALIZED_TS_SQL.format(column='a.timestamp')
+    arrivals = ', '.join(f"'{t}'" for t in ARRIVAL_TYPES)
+    departures = ', '.join(f"'{t}'" for t in DEPARTURE_TYPES)
+    return f'''
+        SELECT student_id, day, class_name, first_arrival, last_departure,
+               COALESCE(substr(first_arrival, 12, 5) > ?, 0) AS late
+        FROM (
+            SELECT a.student_id, substr({ts}, 1, 10) AS day, COALESCE(s.class_name, '') AS class_name,
+                   MIN(CASE WHEN a.type IN ({arrivals}) THEN {ts} END) AS first_arrival,
+                   MAX(CASE WHEN a.type IN ({departures}) THEN {ts} END) AS last_departure
+            FROM attendance a
+            LEFT JOIN students s ON s.id = a.student_id
+            WHERE a.timestamp IS NOT NULL AND a.type IN ({arrivals}, {departures}) {where}
+            GROUP BY a.student_id, day
+        )
+    '''
+
+
+def rebuild(conn, since=None):
+    """Recalcula os resumos a partir de attendance (todos os dias, ou de since 'AAAA-MM-DD' em diante)."""
+    params = (since,) if since else ()
+    conn.execute(f"DELETE FROM attendance_daily_student {'WHERE day >= ?' if since else ''}", params)
+    conn.execute(f"DELETE FROM attendance_daily_class {'WHERE day >= ?' if since else ''}", params)
+    conn.execute(f'''
+        INSERT INTO attendance_daily_student (student_id, day, class_name, first_arrival, last_departure, late)
+        {daily_student_select('AND substr(a.timestamp, 1, 10) >= ?' if since else '')}
+    ''', (ATTENDANCE_LATE_AFTER, *params))
+    conn.execute(f'''
+        INSERT INTO attendance_daily_class (class_name, day, present, late, first_arrival, last_departure)
+        SELECT class_name, day, COUNT(first_arrival), SUM(late), MIN(first_arrival), MAX(last_departure)
+        FROM attendance_daily_student
+        {'WHERE day >= ?' if since else ''}
+        GROUP BY class_name, day
+    ''', params)
+
+
+def raw_student_days(start_day, end_day, student_id=None):
+    """
+    (subconsulta, parâmetros) com as colunas de attendance_daily_student calculadas
+    de attendance: leitura enquanto o rebuild da migração está pendente.
+    timestamp em texto ('T' ou espaço): '~' fecha o último dia nos dois formatos.
+    """
+    where = 'AND a.timestamp >= ? AND a.timestamp < ?'
+    params = [ATTENDANCE_LATE_AFTER, start_day, end_day + '~']
+    if student_id is not None:
+        where += ' AND a.student_id = ?'
+        params.append(student_id)
+    return f'({daily_student_select(where)})', params
+
+
+def student_days_query(start_day, end_day, student_id=None, class_name=None, raw=False):
+    """(sql, parâmetros) de student_days. raw=True lê de attendance em vez do resumo."""
+    source, params = raw_student_days(start_day, end_day, student_id) if raw else ('attendance_daily_student', [])
+    query = f'''
+        SELECT student_id, day, class_name, first_arrival, last_departure,
+               first_arrival IS NOT NULL AS present, late
+        FROM {source}
+        WHERE day BETWEEN ? AND ?
+    '''
+    params += [start_day, end_day]
+    if student_id is not None:
+        query += ' AND student_id = ?'
+        params.append(student_id)
+    if class_name is not None:
+        query += ' AND class_name = ?'
+        params.append(class_name)
+    query += ' ORDER BY day, student_id'
+    return query, params
+
+
+def day_events_query(start_day, end_day, student_id=None, raw=False):
+    """
+    (sql, parâmetros) do resumo no formato de registro de presença: primeira chegada
+    e última saída de cada aluno/dia como (student_id, timestamp, type).
+    """
+    days, params = student_days_query(start_day, end_day, student_id, raw=raw)
+    # Subconsulta repetida em vez de CTE: cada lado usa o índice (a CTE vira SCAN)
+    return f'''
+        SELECT student_id, first_arrival AS timestamp, 'arrival' AS type FROM ({days}) WHERE first_arrival IS NOT NULL
+        UNION ALL
+        SELECT student_id, last_departure, 'departure' FROM ({days}) WHERE last_departure IS NOT NULL
+    ''', params * 2
+
+
+def student_days(conn, start_day, end_day, student_id=None, class_name=None, raw=False):
+    """Resumo diário por aluno entre start_day e end_day (inclusive)."""
+    return conn.execute(*student_days_query(start_day, end_day, student_id, class_name, raw)).fetchall()
+
+
+def class_days(conn, start_day, end_day, class_name=None, raw=False):
+    """Resumo por turma/dia, com total de alunos da turma e faltas."""
+    source, params = 'attendance_daily_class', []
+    if raw:
+        students, params = raw_student_days(start_day, end_day)
+        source = f'''(
+            SELECT class_name, day, COUNT(first_arrival) AS present, SUM(late) AS late,
+                   MIN(first_arrival) AS first_arrival, MAX(last_departure) AS last_departure
+            FROM {students} GROUP BY class_name, day
+        )'''
+    query = f'''
+        SELECT c.class_name, c.day, c.present, c.late, c.first_arrival, c.last_departure,
+               COALESCE(e.enrolled, 0) AS enrolled,
+               MAX(COALESCE(e.enrolled, 0) - c.present, 0) AS absent
+        FROM {source} c
+        LEFT JOIN (SELECT COALESCE(class_name, '') AS class_name, COUNT(*) AS enrolled
+                   FROM students GROUP BY COALESCE(class_name, '')) e ON e.class_name = c.class_name
+        WHERE c.day BETWEEN ? AND ?
+    '''
+    params += [start_day, end_day]
+    if class_name is not None:
+        query += ' AND c.class_name = ?'
+        params.append(class_name)
+    query += ' ORDER BY c.day, c.class_name'
+    return conn.execute(query, params).fetchall()
+
+
+def main():
+    import glob
+    import argparse
+    from database import DB_DIR, connect, apply_migrations, SCHOOL_MIGRATIONS
+
+    parser = argparse.ArgumentParser(description='Reconstrói o resumo diário de presença')
+    parser.add_argument('--school', type=int, help='apenas esta escola')
+    parser.add_argument('--since', help='apenas dias a partir de AAAA-MM-DD')
+    args = parser.parse_args()
+
+    paths = [os.path.join(DB_DIR, f'school_{args.school}.db')] if args.school \
+        else sorted(glob.glob(os.path.join(DB_DIR, 'school_*.db')))
+    for path in paths:
+        conn = connect(path)
+        try:
+            apply_migrations(conn, SCHOOL_MIGRATIONS, os.path.basename(path))
+            conn.execute('BEGIN IMMEDIATE')
+            rebuild(conn, args.since)
+            conn.commit()
+            days = conn.execute('SELECT COUNT(*) FROM attendance_daily_student').fetchone()[0]
+            print(f"✅ {os.path.basename(path)}: {days} dias de aluno")
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ {os.path.basename(path)}: {e}")
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark das consultas de período (visão do mês / do dia) sobre attendance e
+access_logs com milhões de linhas.
+
+Compara as formas antigas, que filtram o texto de timestamp (LIKE 'AAAA-MM-%',
+comparação de strings, date(timestamp)), com a faixa em ts_epoch usada hoje
+pelas rotas (migração 6 de database.SCHOOL_MIGRATIONS).
+
+Uso:
+    python benchmark_attendance_ranges.py --rows 2000000 --students 2000
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import datetime
+
+from database import SCHOOL_MIGRATIONS, connect, apply_migrations, wall_clock_epoch, month_range_epoch
+
+YEAR, MONTH, DAY = 2024, 3, 12
+
+QUERIES = [
+    # (nome, sql, parâmetros(student_id))
+    ('responsável/mês LIKE', '''
+        SELECT timestamp, event_type FROM access_logs
+        WHERE student_id = ? AND timestamp LIKE ?
+    ''', lambda s: (s, f'{YEAR}-{MONTH:02d}-%')),
+    ('responsável/mês ts_epoch', '''
+        SELECT timestamp, event_type FROM access_logs
+        WHERE student_id = ? AND ts_epoch >= ? AND ts_epoch < ?
+    ''', lambda s: (s, *month_range_epoch(YEAR, MONTH))),
+    ('escola/mês texto', '''
+        SELECT a.id, a.student_id, a.timestamp, a.type, s.name
+        FROM attendance a JOIN students s ON a.student_id = s.id
+        WHERE a.timestamp >= ? AND a.timestamp <= ?
+        ORDER BY a.timestamp DESC
+    ''', lambda s: (f'{YEAR}-{MONTH:02d}-01', f'{YEAR}-{MONTH:02d}-31T23:59:59Z')),
+    ('escola/mês date()', '''
+        SELECT a.id, a.student_id, a.timestamp, a.type, s.name
+        FROM attendance a JOIN students s ON a.student_id = s.id
+        WHERE date(a.timestamp) BETWEEN ? AND ?
+        ORDER BY a.timestamp DESC
+    ''', lambda s: (f'{YEAR}-{MONTH:02d}-01', f'{YEAR}-{MONTH:02d}-31')),
+    ('escola/mês ts_epoch', '''
+        SELECT a.id, a.student_id, a.timestamp, a.type, s.name
+        FROM attendance a JOIN students s ON a.student_id = s.id
+        WHERE a.ts_epoch >= ? AND a.ts_epoch < ?
+        ORDER BY a.ts_epoch DESC
+    ''', lambda s: month_range_epoch(YEAR, MONTH)),
+    ('escola/dia LIKE', '''
+        SELECT a.id, a.student_id, a.timestamp, a.type, s.name
+        FROM attendance a JOIN students s ON a.student_id = s.id
+        WHERE a.timestamp LIKE ?
+        ORDER BY a.timestamp DESC
+    ''', lambda s: (f'{YEAR}-{MONTH:02d}-{DAY:02d}%',)),
+    ('escola/dia ts_epoch', '''
+        SELECT a.id, a.student_id, a.timestamp, a.type, s.name
+        FROM attendance a JOIN students s ON a.student_id = s.id
+        WHERE a.ts_epoch >= ? AND a.ts_epoch < ?
+        ORDER BY a.ts_epoch DESC
+    ''', lambda s: (wall_clock_epoch(f'{YEAR}-{MONTH:02d}-{DAY:02d}'),
+                    wall_clock_epoch(f'{YEAR}-{MONTH:02d}-{DAY:02d}') + 86400)),
+]
+
+
+def create_database(path, rows, students):
+    conn = connect(path)
+    apply_migrations(conn, SCHOOL_MIGRATIONS, os.path.basename(path))
+    conn.executemany('INSERT INTO students (name, class_name) VALUES (?, ?)',
+                     [(f'Aluno {i}', f'Turma {i % 40}') for i in range(students)])
+
+    # Dois anos de registros, com os formatos de timestamp que as rotas gravam
+    start = datetime.datetime(YEAR - 1, 1, 1)
+    span = 2 * 365 * 86400
+    formats = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S.123456']
+    batch = []
+
+    def flush():
+        conn.executemany('INSERT INTO attendance (student_id, timestamp, type, ts_epoch) VALUES (?, ?, ?, ?)', batch)
+        conn.executemany('INSERT INTO access_logs (student_id, timestamp, event_type, notified_guardian, ts_epoch) '
+                         'VALUES (?, ?, ?, 1, ?)', batch)
+        batch.clear()
+
+    for _ in range(rows // 2):
+        moment = start + datetime.timedelta(seconds=random.randrange(span))
+        batch.append((random.randint(1, students), moment.strftime(random.choice(formats)),
+                      random.choice(('arrival', 'departure')), wall_clock_epoch(moment)))
+        if len(batch) >= 50000:
+            flush()
+    flush()
+    conn.commit()
+    conn.execute('ANALYZE')
+    return conn
+
+
+def timed(conn, sql, params, repeat):
+    elapsed = []
+    found = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        found = len(conn.execute(sql, params()).fetchall())
+        elapsed.append((time.perf_counter() - started) * 1000)
+    elapsed.sort()
+    return found, elapsed[len(elapsed) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Consultas de período: texto de timestamp x ts_epoch')
+    parser.add_argument('--rows', type=int, default=2000000, help='total de linhas (metade em cada tabela)')
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'school_bench.db')
+    started = time.perf_counter()
+    conn = create_database(path, args.rows, args.students)
+    print(f"📦 {args.rows} linhas geradas em {time.perf_counter() - started:.1f}s ({path})\n")
+
+    print(f"{'consulta':<28} {'linhas':>8} {'mediana ms':>11}  plano")
+    student_id = random.randint(1, args.students)
+    for name, sql, params in QUERIES:
+        plan = '; '.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params(student_id)))
+        found, median = timed(conn, sql, lambda: params(student_id), args.repeat)
+        print(f"{name:<28} {found:>8} {median:>11.1f}  {plan}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Benchmark de disputa de locks no SQLite.
+
+Simula o horário de entrada: threads leitoras consultando access_logs como o
+SSE do responsável e threads escritoras registrando chegadas e marcando
+notified_guardian, no mesmo banco, em três configurações:
+
+    default  - sqlite3.connect puro (rollback journal, pragmas padrão)
+    tuned    - database.connect (WAL, busy_timeout, synchronous=NORMAL, mmap, cache)
+    queue    - database.connect para leitura + escritas pela WriteQueue do banco
+
+Uso:
+    python benchmark_sqlite_locking.py --seconds 5 --readers 8 --writers 8
+"""
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+from database import connect, WriteQueue
+
+READ_SQL = '''
+    SELECT al.id, al.student_id, s.name, al.event_type, al.timestamp
+    FROM access_logs al
+    JOIN students s ON al.student_id = s.id
+    JOIN student_guardians sg ON s.id = sg.student_id
+    WHERE sg.guardian_id = ? AND al.notified_guardian = 0
+'''
+
+
+def create_database(path, students):
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE students (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT);
+        CREATE TABLE student_guardians (id INTEGER PRIMARY KEY AUTOINCREMENT, student_id INTEGER, guardian_id INTEGER);
+        CREATE TABLE attendance (id INTEGER PRIMARY KEY AUTOINCREMENT, student_id INTEGER, timestamp DATETIME, type TEXT);
+        CREATE TABLE access_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, student_id INTEGER, event_type TEXT,
+                                  timestamp DATETIME, notified_guardian INTEGER DEFAULT 0);
+    ''')
+    conn.executemany('INSERT INTO students (name) VALUES (?)', [(f'Aluno {i}',) for i in range(students)])
+    conn.executemany('INSERT INTO student_guardians (student_id, guardian_id) VALUES (?, ?)',
+                     [(i + 1, i // 2 + 1) for i in range(students)])
+    conn.executemany('INSERT INTO access_logs (student_id, event_type, timestamp, notified_guardian) VALUES (?, ?, ?, 1)',
+                     [(random.randint(1, students), 'arrival', '2024-01-01T07:00:00') for _ in range(students * 20)])
+    conn.commit()
+    conn.close()
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(mode, path, args):
+    open_conn = (lambda: sqlite3.connect(path, check_same_thread=False)) if mode == 'default' \
+        else (lambda: connect(path, check_same_thread=False))
+    write_queue = WriteQueue(path) if mode == 'queue' else None
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    result = {'reads': 0, 'writes': 0, 'locked': 0, 'write_ms': []}
+
+    def reader():
+        conn = open_conn()
+        reads = locked = 0
+        while not stop.is_set():
+            try:
+                conn.execute(READ_SQL, (random.randint(1, args.students // 2),)).fetchall()
+                reads += 1
+            except sqlite3.OperationalError:
+                locked += 1
+        conn.close()
+        with lock:
+            result['reads'] += reads
+            result['locked'] += locked
+
+    def write(conn, student_id, timestamp):
+        if write_queue:
+            futures = [
+                write_queue.submit('INSERT INTO attendance (student_id, timestamp, type) VALUES (?, ?, ?)',
+                                   (student_id, timestamp, 'arrival')),
+                write_queue.submit('INSERT INTO access_logs (student_id, event_type, timestamp) VALUES (?, ?, ?)',
+                                   (student_id, 'arrival', timestamp)),
+                write_queue.submit('UPDATE access_logs SET notified_guardian = 1 WHERE student_id = ? AND notified_guardian = 0',
+                                   (random.randint(1, args.students),)),
+            ]
+            for f in futures:
+                f.result()
+            return
+        conn.execute('INSERT INTO attendance (student_id, timestamp, type) VALUES (?, ?, ?)',
+                     (student_id, timestamp, 'arrival'))
+        conn.execute('INSERT INTO access_logs (student_id, event_type, timestamp) VALUES (?, ?, ?)',
+                     (student_id, 'arrival', timestamp))
+        conn.commit()
+        conn.execute('UPDATE access_logs SET notified_guardian = 1 WHERE student_id = ? AND notified_guardian = 0',
+                     (random.randint(1, args.students),))
+        conn.commit()
+
+    def writer():
+        conn = open_conn()
+        writes = locked = 0
+        latencies = []
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                write(conn, random.randint(1, args.students), time.strftime('%Y-%m-%dT%H:%M:%S'))
+                writes += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+            except sqlite3.OperationalError:
+                locked += 1
+                if conn.in_transaction:
+                    conn.rollback()
+        conn.close()
+        with lock:
+            result['writes'] += writes
+            result['locked'] += locked
+            result['write_ms'].extend(latencies)
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer) for _ in range(args.writers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Disputa de locks: pragmas padrão x WAL x fila de escrita')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--students', type=int, default=1000)
+    parser.add_argument('--modes', default='default,tuned,queue')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    print(f"{'modo':<8} {'leituras/s':>11} {'escritas/s':>11} {'locked':>7} {'p50 ms':>8} {'p95 ms':>8} {'máx ms':>8}")
+    for mode in args.modes.split(','):
+        path = os.path.join(directory, f'{mode}.db')
+        create_database(path, args.students)
+        r = run(mode, path, args)
+        print(f"{mode:<8} {r['reads'] / args.seconds:>11.0f} {r['writes'] / args.seconds:>11.0f} {r['locked']:>7} "
+              f"{percentile(r['write_ms'], 0.5):>8.1f} {percentile(r['write_ms'], 0.95):>8.1f} "
+              f"{max(r['write_ms'], default=0):>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Fotos (alunos, funcionários, selfies do ponto) fora do SQLite: arquivos no disco
+endereçados pelo SHA-256 do conteúdo, com miniaturas geradas na gravação.
+
+As linhas guardam só a URL curta (/api/blobs/<hash>.<ext>); miniatura com
+?size=64 ou ?size=256. Ler exige o token (header ou ?token=) ou uma URL
+assinada (?exp=&sig=, ver routes/blobs.py): as respostas da API trazem
+photo_url já assinado, para uso direto em <img src>. O conteúdo nunca
+muda para a mesma URL, então ela é servida com cache privado de um ano (immutable).
+
+Miniaturas precisam do Pillow; sem ele a foto original é servida em todos os tamanhos.
+"""
+import io
+import os
+import base64
+import hashlib
+import binascii
+
+from database import DB_DIR
+from app_logging import get_logger
+
+log = get_logger('blob_store')
+
+BLOB_DIR = os.environ.get('BLOB_DIR', os.path.join(DB_DIR, 'blobs'))
+BLOB_URL_PREFIX = '/api/blobs/'
+THUMBNAIL_SIZES = (64, 256)  # lado maior, em px
+INLINE_MIN_LENGTH = 256      # abaixo disso photo_url é uma URL, não uma imagem inline
+
+# Assinatura do arquivo -> (extensão, content-type)
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', ('jpg', 'image/jpeg')),
+    (b'\x89PNG\r\n\x1a\n', ('png', 'image/png')),
+    (b'GIF87a', ('gif', 'image/gif')),
+    (b'GIF89a', ('gif', 'image/gif')),
+]
+MIMETYPES = {ext: mimetype for _, (ext, mimetype) in IMAGE_SIGNATURES}
+MIMETYPES['webp'] = 'image/webp'
+
+
+def sniff_image(data):
+    """(extensão, content-type) da imagem, ou None se não for uma imagem conhecida."""
+    for signature, kind in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return kind
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp', 'image/webp'
+    return None
+
+
+def blob_path(digest, suffix):
+    # Dois níveis de diretório para não acumular milhares de arquivos numa pasta só
+    return os.path.join(BLOB_DIR, digest[:2], digest[2:4], f'{digest}{suffix}')
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _write_thumbnails(digest, data):
+    try:
+        from PIL import Image
+    except ImportError:
+        return
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        for size in THUMBNAIL_SIZES:
+            path = blob_path(digest, f'_{size}.jpg')
+            if os.path.exists(path):
+                continue
+            thumb = image.copy()
+            thumb.thumbnail((size, size))
+            out = io.BytesIO()
+            thumb.save(out, 'JPEG', quality=85, optimize=True)
+            _write_atomic(path, out.getvalue())
+    except Exception as e:
+        log.warning('miniatura não gerada', extra={'digest': digest, 'error': str(e)})
+
+
+def put(data):
+    """Grava a imagem (bytes) e retorna a URL de referência. Conteúdo repetido reaproveita o arquivo."""
+    kind = sniff_image(data)
+    if not kind:
+        raise ValueError('Formato de imagem não suportado')
+    ext, _ = kind
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(digest, f'.{ext}')
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+        _write_thumbnails(digest, data)
+    return f'{BLOB_URL_PREFIX}{digest}.{ext}'
+
+
+def decode_inline_image(value):
+    """Bytes da imagem se value for data URI / base64 puro de uma imagem; senão None."""
+    # URLs (inclusive as do próprio blob store) são curtas; base64 puro de JPEG começa com '/9j/'
+    if not isinstance(value, str) or len(value) < INLINE_MIN_LENGTH or value.startswith(('http://', 'https://')):
+        return None
+    if value.startswith('data:'):
+        header, _, payload = value.partition(',')
+        if ';base64' not in header:
+            return None
+    else:
+        payload = value
+    try:
+        data = base64.b64decode(payload, validate=False)
+    except (binascii.Error, ValueError):
+        return None
+    return data if sniff_image(data) else None
+
+
+def store_photo(value):
+    """
+    Valor de photo_url vindo do cliente -> referência curta. Imagens inline
+    (data URI ou base64) vão para o blob store; URLs e vazios passam direto.
+    A URL assinada que o cliente recebeu (e devolve ao editar) volta a ser a referência.
+    """
+    if isinstance(value, str) and value.startswith(BLOB_URL_PREFIX):
+        return value.split('?', 1)[0]
+    data = decode_inline_image(value)
+    return put(data) if data else value
+
+
+def resolve(name, size=None):
+    """
+    Caminho e content-type de /api/blobs/<name>, opcionalmente da miniatura
+    (size em THUMBNAIL_SIZES). None se o blob não existir.
+    """
+    digest, _, ext = name.partition('.')
+    if len(digest) != 64 or ext not in MIMETYPES or any(c not in '0123456789abcdef' for c in digest):
+        return None
+    if size in THUMBNAIL_SIZES:
+        thumb = blob_path(digest, f'_{size}.jpg')
+        if os.path.exists(thumb):
+            return thumb, 'image/jpeg'
+    path = blob_path(digest, f'.{ext}')
+    return (path, MIMETYPES[ext]) if os.path.exists(path) else None
+
+
+def count_inline_photos(conn, table, column='photo_url'):
+    """Quantas linhas de table.column ainda parecem ter a imagem inline (candidatas a move_inline_photos)."""
+    return conn.execute(f'''
+        SELECT COUNT(*) FROM {table}
+        WHERE length({column}) >= ? AND {column} NOT LIKE 'http%'
+    ''', (INLINE_MIN_LENGTH,)).fetchone()[0]
+
+
+def move_inline_photos(conn, table, column='photo_url', batch_size=200):
+    """Migra imagens inline de table.column para o blob store. Retorna quantas linhas mudaram."""
+    moved = 0
+    last_id = 0
+    while True:
+        # Em lotes por id, sem carregar todas as fotos da tabela na memória
+        rows = conn.execute(f'''
+            SELECT id, {column} FROM {table}
+            WHERE id > ? AND length({column}) >= ? AND {column} NOT LIKE 'http%'
+            ORDER BY id LIMIT ?
+        ''', (last_id, INLINE_MIN_LENGTH, batch_size)).fetchall()
+        if not rows:
+            return moved
+        for row_id, value in rows:
+            last_id = row_id
+            data = decode_inline_image(value)
+            if data:
+                conn.execute(f'UPDATE {table} SET {column} = ? WHERE id = ?', (put(data), row_id))
+                moved += 1
@@ -0,0 +1,167 @@
+"""
+Confere com EXPLAIN QUERY PLAN as consultas frequentes das rotas (routes/).
+Falha (código de saída 1) se alguma delas fizer varredura completa de tabela,
+ou seja, se faltar o índice de que ela depende.
+
+Uso:
+    python check_query_plans.py              # bancos temporários, migrados do zero
+    python check_query_plans.py --school 14  # banco real da escola 14 + system.db
+
+Ao criar uma consulta nova em um caminho quente, acrescentá-la em HOT_QUERIES
+(ou em LIST_QUERIES, se for uma listagem de list_response), importando o SQL
+da rota em vez de copiá-lo: cópias ficam para trás quando a rota muda.
+"""
+import os
+import re
+import sys
+import argparse
+import tempfile
+
+from database import (DB_DIR, SYSTEM_DB_PATH, SCHOOL_MIGRATIONS, SYSTEM_MIGRATIONS,
+                      connect, apply_migrations)
+from attendance_rollup import student_days_query, day_events_query
+from routes.list_query import (build_list_query, encode_cursor, STUDENTS_LIST, EMPLOYEES_LIST,
+                               EVENTS_LIST, CHAT_MESSAGES_LIST, SCHOOLS_LIST)
+from routes.attendance import RECENT_ATTENDANCE_SQL
+from routes.affiliates import AFFILIATES_AS_PARENT_SQL, AFFILIATES_AS_AFFILIATE_SQL
+from routes.affiliate_helpers import AFFILIATION_CHECK_SQL
+from routes.guardian import GUARDIAN_CHAT_WHERE, GUARDIAN_NEXT_NOTIFICATION_SQL, GUARDIAN_PENDING_NOTIFICATIONS_SQL
+from routes.school import SCHOOL_CHAT_WHERE, SCHOOL_ATTENDANCE_SQL, EMPLOYEE_ATTENDANCE_SQL, attendance_range_query
+from routes.teacher import CLASS_STUDENTS_WHERE
+
+# (nome, banco, sql, parâmetros)
+HOT_QUERIES = [
+    # routes/guardian.py - notificações do responsável
+    ('guardian_next_notification', 'school', GUARDIAN_NEXT_NOTIFICATION_SQL, (1,)),
+    ('guardian_pending_notifications', 'school', GUARDIAN_PENDING_NOTIFICATIONS_SQL, (1,)),
+    ('guardian_link_check', 'school',
+     'SELECT 1 FROM student_guardians WHERE student_id = ? AND guardian_id = ?', (1, 1)),
+    # routes/school.py
+    ('school_attendance_range', 'school',
+     *attendance_range_query(SCHOOL_ATTENDANCE_SQL, 'a.ts_epoch', 1704067200, 1706745600)),
+    ('employee_attendance_range', 'school',
+     *attendance_range_query(EMPLOYEE_ATTENDANCE_SQL, 'ea.ts_epoch', 1704067200, 1706745600)),
+    # attendance_rollup.py - calendário do responsável e relatório do mês da escola
+    ('guardian_student_month', 'school', *day_events_query('2024-01-01', '2024-01-31', 1)),
+    ('school_attendance_days', 'school', *day_events_query('2024-01-01', '2024-01-31')),
+    ('rollup_student_month', 'school', *student_days_query('2024-01-01', '2024-01-31', 1)),
+    ('rollup_school_days', 'school', *student_days_query('2024-01-01', '2024-01-31')),
+    ('student_guardians_unlink', 'school', 'DELETE FROM student_guardians WHERE student_id = ?', (1,)),
+    # routes/attendance.py
+    ('attendance_debounce', 'school', RECENT_ATTENDANCE_SQL.format(ts_epoch='ts_epoch'),
+     (1, 'arrival', 1700000000)),
+    ('attendance_event_ids', 'school',
+     'SELECT id, event_id, student_id, type, timestamp FROM attendance WHERE event_id IN (?, ?)', ('a', 'b')),
+    # routes/financial.py - webhook de pagamento
+    ('invoice_webhook', 'school',
+     'UPDATE invoices SET status = ?, paid_at = CURRENT_TIMESTAMP WHERE external_id = ?', ('RECEIVED', 'x')),
+    # routes/employee_app.py
+    ('employee_by_guardian', 'school', 'SELECT * FROM employees WHERE guardian_id = ?', (1,)),
+    # routes/support.py
+    ('support_last_message', 'system',
+     'SELECT message FROM support_messages WHERE ticket_id = ? ORDER BY created_at DESC LIMIT 1', (1,)),
+    ('support_message_count', 'system', 'SELECT COUNT(*) as cnt FROM support_messages WHERE ticket_id = ?', (1,)),
+    ('support_ticket_messages', 'system',
+     'SELECT * FROM support_messages WHERE ticket_id = ? ORDER BY created_at ASC', (1,)),
+    # routes/affiliates.py
+    ('affiliates_as_parent', 'system', AFFILIATES_AS_PARENT_SQL, (1,)),
+    ('affiliates_as_affiliate', 'system', AFFILIATES_AS_AFFILIATE_SQL, (1,)),
+    ('affiliation_check', 'system', AFFILIATION_CHECK_SQL, (1, 2, 2, 1)),
+    # guardian_index.py
+    ('guardian_index_student', 'system',
+     'SELECT guardian_id FROM guardian_student_index WHERE school_id = ? AND student_id = ?', (1, 1)),
+    # user_credentials.py (login)
+    ('login_credentials', 'system',
+     'SELECT role, user_table, user_id FROM user_credentials WHERE email = ? ORDER BY rank LIMIT 1', ('a@b.c',)),
+    ('guardian_login', 'system', 'SELECT * FROM guardians WHERE email = ?', ('a@b.c',)),
+]
+
+# Listagens de list_response, com o SQL montado por build_list_query como na rota
+# (nome, banco, ListQuery, where fixo da rota, parâmetros, args da requisição)
+NEXT_PAGE = {'limit': '50', 'cursor': encode_cursor(['2024-01-01', 10])}
+NEXT_PAGE_BY_NAME = {'sort': 'name', 'limit': '50', 'cursor': encode_cursor(['Ana', 10])}
+LIST_QUERIES = [
+    # routes/school.py
+    ('list_students_by_name', 'school', STUDENTS_LIST, '', (), NEXT_PAGE_BY_NAME),
+    ('list_students_of_class', 'school', STUDENTS_LIST, '', (), {'class_name': '1A', 'sort': 'name'}),
+    ('list_events', 'school', EVENTS_LIST, '', (), NEXT_PAGE),
+    ('list_employees', 'school', EMPLOYEES_LIST, '', (), NEXT_PAGE_BY_NAME),
+    ('school_chat', 'school', CHAT_MESSAGES_LIST, SCHOOL_CHAT_WHERE, (1,), {}),
+    ('list_chat_messages', 'school', CHAT_MESSAGES_LIST, SCHOOL_CHAT_WHERE, (1,), NEXT_PAGE),
+    # routes/guardian.py
+    ('guardian_chat', 'school', CHAT_MESSAGES_LIST, GUARDIAN_CHAT_WHERE, (1, 1), {}),
+    # routes/teacher.py
+    ('list_class_students', 'school', STUDENTS_LIST, CLASS_STUDENTS_WHERE, (1,), NEXT_PAGE_BY_NAME),
+    # routes/admin.py
+    ('list_schools', 'system', SCHOOLS_LIST, '', (), NEXT_PAGE_BY_NAME),
+]
+
+# "SCAN tabela" sem índice (versões antigas do SQLite: "SCAN TABLE tabela")
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?\w+( AS \w+)?$')
+
+
+def query_plan(conn, sql, params):
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def hot_queries(conns):
+    """HOT_QUERIES mais as listagens de LIST_QUERIES, com o SQL montado no banco conferido."""
+    queries = list(HOT_QUERIES)
+    for name, database, spec, where, params, args in LIST_QUERIES:
+        sql, sql_params = build_list_query(conns[database], spec, args, where, params)[:2]
+        queries.append((name, database, sql, sql_params))
+    return queries
+
+
+def check(conns, queries=None):
+    """Retorna [(nome, plano, varreduras)] de todas as consultas."""
+    if queries is None:
+        queries = hot_queries(conns)
+    results = []
+    for name, database, sql, params in queries:
+        plan = query_plan(conns[database], sql, params)
+        scans = [step for step in plan if FULL_SCAN.match(step.strip())]
+        results.append((name, plan, scans))
+    return results
+
+
+def open_databases(school_id=None):
+    if school_id is not None:
+        return {'school': connect(os.path.join(DB_DIR, f'school_{school_id}.db')),
+                'system': connect(SYSTEM_DB_PATH)}
+
+    directory = tempfile.mkdtemp()
+    conns = {'school': connect(os.path.join(directory, 'school.db')),
+             'system': connect(os.path.join(directory, 'system.db'))}
+    apply_migrations(conns['school'], SCHOOL_MIGRATIONS, 'school.db')
+    apply_migrations(conns['system'], SYSTEM_MIGRATIONS, 'system.db')
+    return conns
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verifica se as consultas frequentes usam índices')
+    parser.add_argument('--school', type=int, help='checar no banco real desta escola')
+    parser.add_argument('--verbose', '-v', action='store_true', help='mostrar o plano de todas as consultas')
+    args = parser.parse_args()
+
+    conns = open_databases(args.school)
+    results = check(conns)
+    failures = 0
+    for name, plan, scans in results:
+        if scans:
+            failures += 1
+            print(f"❌ {name}: varredura completa -> {'; '.join(scans)}")
+        else:
+            print(f"✅ {name}")
+        if args.verbose or scans:
+            for step in plan:
+                print(f"      {step}")
+    for conn in conns.values():
+        conn.close()
+
+    print(f"\n{len(results)} consultas, {failures} com varredura completa")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
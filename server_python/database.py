@@ -1,39 +1,384 @@
 import sqlite3
 import os
-from flask import g
+import queue
+import calendar
+import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from flask import g, has_app_context
+
+import attendance_rollup
+import user_credentials
+from app_logging import get_logger
+
+log = get_logger('database')
 
 # Caminhos dos bancos de dados
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_DIR = os.path.join(BASE_DIR, 'database')
 SYSTEM_DB_PATH = os.path.join(DB_DIR, 'system.db')
 
+
+# Máximo de conexões ociosas mantidas no pool (somando todas as escolas)
+SCHOOL_DB_POOL_SIZE = int(os.environ.get('SCHOOL_DB_POOL_SIZE', '64'))
+
+
+# Configuração de armazenamento aplicada a toda conexão (system.db e school_{id}.db)
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')  # seguro com WAL
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', '16384'))
+
+# Escritas agrupadas numa transação pela thread escritora de cada banco
+WRITE_QUEUE_BATCH = 100
+# Espera máxima de quem chama execute(wait=True) pela thread escritora (segundos)
+WRITE_QUEUE_TIMEOUT = float(os.environ.get('WRITE_QUEUE_TIMEOUT', '30'))
+
+_journal_ready = set()  # arquivos cujo journal_mode já foi aplicado (é persistente no arquivo)
+_journal_lock = threading.Lock()
+
+
+def configure_connection(conn, db_path):
+    """
+    Aplica os pragmas de armazenamento. journal_mode=WAL fica gravado no
+    arquivo, então só é executado uma vez por banco em cada processo; os
+    demais valem por conexão.
+    """
+    if db_path not in _journal_ready:
+        with _journal_lock:
+            if db_path not in _journal_ready:
+                conn.execute(f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE}')
+                _journal_ready.add(db_path)
+    conn.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+    conn.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}')
+    return conn
+
+
+def connect(db_path, **kwargs):
+    """sqlite3.connect + pragmas de armazenamento. Usar no lugar de sqlite3.connect."""
+    conn = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, **kwargs)
+    return configure_connection(conn, db_path)
+
+
+class WriteQueue:
+    """
+    Fila de escrita de um banco: uma única thread com conexão própria aplica
+    as escritas em sequência, várias por transação (commit em grupo). As
+    threads das requisições não disputam o lock de escrita do SQLite entre
+    si, e com WAL os leitores continuam lendo enquanto ela escreve.
+
+    Cada escrita roda num SAVEPOINT: um comando com erro falha sozinho, sem
+    desfazer os outros do mesmo grupo.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {'writes': 0, 'transactions': 0, 'errors': 0}
+
+    def submit(self, sql, params=(), many=False):
+        """Enfileira um comando (executemany se many=True); retorna um Future com o rowcount."""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((sql, params, many, future))
+        return future
+
+    def execute(self, sql, params=(), many=False, wait=True):
+        future = self.submit(sql, params, many)
+        return future.result(timeout=WRITE_QUEUE_TIMEOUT) if wait else future
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _ensure_started(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            # Também recria a thread se ela tiver morrido (as escritas na fila continuam)
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name=f'write-queue-{os.path.basename(self.db_path)}')
+                self._thread.start()
+
+    def _run(self):
+        conn = None
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_QUEUE_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Qualquer erro aqui (inclusive ao conectar ou no ROLLBACK) falha só este
+            # grupo; a conexão é descartada e reaberta no próximo, e a thread segue viva
+            try:
+                if conn is None:
+                    conn = connect(self.db_path, isolation_level=None, check_same_thread=False)
+                results = self._write_batch(conn, batch)
+            except Exception as e:
+                log.error('falha no grupo da fila de escrita',
+                          extra={'db': os.path.basename(self.db_path), 'error': str(e)})
+                results = [(future, None, e) for _, _, _, future in batch]
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+
+            self.stats['transactions'] += 1
+            for future, rowcount, error in results:
+                if future.done():
+                    continue
+                if error is not None:
+                    self.stats['errors'] += 1
+                    future.set_exception(error)
+                else:
+                    self.stats['writes'] += 1
+                    future.set_result(rowcount)
+
+    def _write_batch(self, conn, batch):
+        """Aplica o grupo numa transação; retorna [(future, rowcount, erro)]. Erro fora dos SAVEPOINTs propaga."""
+        results = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, params, many, future in batch:
+                conn.execute('SAVEPOINT write')
+                try:
+                    cur = conn.executemany(sql, params) if many else conn.execute(sql, params)
+                    conn.execute('RELEASE write')
+                    results.append((future, cur.rowcount, None))
+                except sqlite3.Error as e:
+                    conn.execute('ROLLBACK TO write')
+                    conn.execute('RELEASE write')
+                    results.append((future, None, e))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return results
+
+
+_write_queues = {}
+_write_queues_lock = threading.Lock()
+
+
+def get_write_queue(db_path):
+    with _write_queues_lock:
+        wq = _write_queues.get(db_path)
+        if wq is None:
+            wq = _write_queues[db_path] = WriteQueue(db_path)
+        return wq
+
+
+def school_write(school_id, sql, params=(), many=False, wait=True):
+    """Escrita curta e independente num school_{id}.db, pela fila de escrita do banco."""
+    school_db_pool.ensure_schema(school_id)
+    return get_write_queue(school_db_path(school_id)).execute(sql, params, many, wait)
+
+
+def system_write(sql, params=(), many=False, wait=True):
+    """Escrita curta e independente no system.db, pela fila de escrita do banco."""
+    return get_write_queue(SYSTEM_DB_PATH).execute(sql, params, many, wait)
+
+
+def write_queue_stats():
+    with _write_queues_lock:
+        queues = list(_write_queues.values())
+    return {os.path.basename(wq.db_path): {**wq.stats, 'depth': wq.depth()} for wq in queues}
+
+
+def school_db_path(school_id):
+    return os.path.join(DB_DIR, f'school_{school_id}.db')
+
+
+class PooledConnection(sqlite3.Connection):
+    """Conexão SQLite cujo close() devolve a conexão ao pool em vez de fechá-la."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = None
+        self._db_path = None
+        self._checked_out = False
+        self._checkout = 0  # muda a cada acquire(); identifica quem está com a conexão
+
+    def close(self):
+        if self._pool is not None:
+            # Devolvida pela própria rota: o teardown não deve devolvê-la de novo
+            # (ela pode já estar com outra requisição)
+            if has_app_context():
+                school_dbs = getattr(g, '_school_dbs', None)
+                if school_dbs:
+                    school_dbs[:] = [entry for entry in school_dbs if entry[0] is not self]
+            self._pool.release(self)
+        else:
+            super().close()
+
+    def _close_for_real(self):
+        self._pool = None
+        sqlite3.Connection.close(self)
+
+
+class SchoolConnectionPool:
+    """
+    Pool LRU de conexões para os bancos school_{id}.db.
+
+    - Mantém no máximo `max_idle` conexões ociosas; ao estourar o limite,
+      fecha as conexões da escola usada há mais tempo.
+    - Roda init_school_db uma única vez por arquivo (controlado por
+      PRAGMA user_version), e não a cada get_school_db().
+    """
+
+    def __init__(self, max_idle=SCHOOL_DB_POOL_SIZE):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = OrderedDict()  # {db_path: [conn, ...]} em ordem de uso
+        self._idle_count = 0
+        self._schema_ready = set()  # db_paths já verificados neste processo
+        self._schema_lock = threading.Lock()
+
+    def acquire(self, school_id):
+        db_path = school_db_path(school_id)
+
+        conn = None
+        with self._lock:
+            conns = self._idle.get(db_path)
+            if conns:
+                conn = conns.pop()
+                self._idle_count -= 1
+                if not conns:
+                    del self._idle[db_path]
+
+        if conn is None:
+            conn = connect(db_path, check_same_thread=False, factory=PooledConnection)
+            conn.row_factory = sqlite3.Row
+            conn._db_path = db_path
+            self._ensure_schema(conn, db_path)
+
+        conn._pool = self
+        conn._checked_out = True
+        conn._checkout += 1
+        return conn
+
+    def release(self, conn):
+        if not conn._checked_out:
+            return
+        conn._checked_out = False
+
+        try:
+            # Descartar transação deixada aberta (mesmo efeito de fechar a conexão)
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = sqlite3.Row
+        except sqlite3.Error:
+            conn._close_for_real()
+            return
+
+        to_close = []
+        with self._lock:
+            self._idle.setdefault(conn._db_path, []).append(conn)
+            self._idle.move_to_end(conn._db_path)
+            self._idle_count += 1
+
+            while self._idle_count > self.max_idle:
+                lru_path, lru_conns = next(iter(self._idle.items()))
+                to_close.append(lru_conns.pop())
+                self._idle_count -= 1
+                if not lru_conns:
+                    del self._idle[lru_path]
+
+        for old in to_close:
+            old._close_for_real()
+
+    def clear(self):
+        """Fecha todas as conexões ociosas (ex: após migração ou em testes)."""
+        with self._lock:
+            conns = [c for lst in self._idle.values() for c in lst]
+            self._idle.clear()
+            self._idle_count = 0
+            self._schema_ready.clear()
+        for conn in conns:
+            conn._close_for_real()
+
+    def ensure_schema(self, school_id):
+        """Garante o schema do banco da escola (para quem escreve sem passar pelo pool)."""
+        if school_db_path(school_id) not in self._schema_ready:
+            self.acquire(school_id).close()
+
+    def _ensure_schema(self, conn, db_path):
+        if db_path in self._schema_ready:
+            return
+        with self._schema_lock:
+            if db_path in self._schema_ready:
+                return
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version < SCHOOL_SCHEMA_VERSION:
+                init_school_db(conn)
+            self._schema_ready.add(db_path)
+
+
+school_db_pool = SchoolConnectionPool()
+
+
 def get_system_db():
     db = getattr(g, '_system_db', None)
     if db is None:
         if not os.path.exists(DB_DIR):
             os.makedirs(DB_DIR)
-        print(f"📂 Conectando ao banco: {SYSTEM_DB_PATH}")
-        db = g._system_db = sqlite3.connect(SYSTEM_DB_PATH)
+        log.debug('conectando ao system.db', extra={'path': SYSTEM_DB_PATH})
+        db = g._system_db = connect(SYSTEM_DB_PATH)
         db.row_factory = sqlite3.Row
     return db
 
 def get_school_db(school_id):
-    # Não usamos 'g' aqui para permitir múltiplas conexões diferentes se necessário, 
-    # ou podemos cachear por school_id se performance for crítica.
-    # Por simplicidade, abrimos nova conexão.
-    db_path = os.path.join(DB_DIR, f'school_{school_id}.db')
-    
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    
-    # Sempre inicializar para garantir que todas as tabelas existem
-    init_school_db(conn)
-        
+    # Conexão vem do pool. Chamar close() devolve ao pool; dentro de uma
+    # requisição, conexões não devolvidas são liberadas no teardown.
+    conn = school_db_pool.acquire(school_id)
+
+    if has_app_context():
+        if not hasattr(g, '_school_dbs'):
+            g._school_dbs = []
+        g._school_dbs.append((conn, conn._checkout))
+
+    return conn
+
+def detach_db(conn):
+    """
+    Tira a conexão do teardown da requisição: quem chamou passa a ser
+    responsável por close() (ex: resposta em streaming, que termina depois do teardown).
+    """
+    if has_app_context():
+        if getattr(g, '_system_db', None) is conn:
+            g.pop('_system_db')
+        school_dbs = getattr(g, '_school_dbs', [])
+        school_dbs[:] = [entry for entry in school_dbs if entry[0] is not conn]
     return conn
 
+def close_db(exception=None):
+    """Teardown: fecha o system.db e devolve ao pool as conexões de escola da requisição."""
+    for conn, checkout in g.pop('_school_dbs', []):
+        # Só devolve se ainda for o mesmo empréstimo desta requisição
+        if conn._checked_out and conn._checkout == checkout:
+            conn._pool.release(conn)
 
-def init_system_db():
-    conn = sqlite3.connect(SYSTEM_DB_PATH)
+    db = g.pop('_system_db', None)
+    if db is not None:
+        db.close()
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
+
+
+def create_system_tables(conn):
+    """Migração 1 do system.db: estrutura base."""
     cur = conn.cursor()
     
     # Recriar estrutura baseada no sistema Node.js
@@ -184,16 +529,19 @@ def init_system_db():
         FOREIGN KEY(affiliate_school_id) REFERENCES schools(id)
     )''')
 
-    # Migração: adicionar CNPJ em escolas existentes
-    try:
-        cur.execute("ALTER TABLE schools ADD COLUMN cnpj TEXT")
-    except:
-        pass  # Coluna já existe
-
-    conn.commit()
-    conn.close()
+    # Índice responsável -> escola/aluno (mantido por guardian_index.py)
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS guardian_student_index (
+        guardian_id INTEGER NOT NULL,
+        school_id INTEGER NOT NULL,
+        student_id INTEGER NOT NULL,
+        class_name TEXT,
+        PRIMARY KEY (guardian_id, school_id, student_id)
+    )''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_guardian_index_school_student ON guardian_student_index(school_id, student_id)')
 
-def init_school_db(conn):
+def create_school_tables(conn):
+    """Migração 1 dos bancos de escola: estrutura base."""
     cur = conn.cursor()
     
     cur.execute('''
@@ -357,15 +705,6 @@ def init_school_db(conn):
         updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
     )''')
 
-    # Add columns if they don't exist
-    try:
-        cur.execute("ALTER TABLE financial_config ADD COLUMN client_id TEXT")
-        cur.execute("ALTER TABLE financial_config ADD COLUMN client_secret TEXT")
-        cur.execute("ALTER TABLE financial_config ADD COLUMN pix_key TEXT")
-        cur.execute("ALTER TABLE financial_config ADD COLUMN gateway_provider TEXT DEFAULT 'inter'")
-    except:
-        pass
-
     cur.execute('''
     CREATE TABLE IF NOT EXISTS invoices (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -382,23 +721,6 @@ def init_school_db(conn):
         FOREIGN KEY(student_id) REFERENCES students(id)
     )''')
     
-    # Migrações automáticas para garantir colunas em bancos existentes
-    updates = [
-        "ALTER TABLE events ADD COLUMN event_date DATE",
-        "ALTER TABLE events ADD COLUMN cost REAL",
-        "ALTER TABLE events ADD COLUMN class_name TEXT",
-        "ALTER TABLE events ADD COLUMN pix_key TEXT",
-        "ALTER TABLE events ADD COLUMN payment_deadline DATE",
-        "ALTER TABLE events ADD COLUMN type TEXT",
-        "ALTER TABLE students ADD COLUMN face_descriptor TEXT",
-        "ALTER TABLE event_participations ADD COLUMN receipt_url TEXT"
-    ]
-    for cmd in updates:
-        try:
-            cur.execute(cmd)
-        except:
-            pass
-            
     # Garantir compatibilidade com versões antigas (se existirem colunas antigas target_type, target_id)
     # Não removemos colunas no SQLite facilmente, então deixamos lá se existirem.
 
@@ -428,9 +750,315 @@ def init_school_db(conn):
         FOREIGN KEY(student_id) REFERENCES students(id)
     )''')
 
-    # Migração para garantir que a tabela exista em bancos antigos que tinham a tabela 'messages' simples
+
+
+# ========== MIGRAÇÕES ==========
+#
+# Cada banco guarda em PRAGMA user_version a última migração aplicada.
+# Migrações são (número, descrição, fn(conn)), em ordem crescente, e nunca
+# mudam depois de publicadas: alteração nova = migração nova no fim da lista.
+# Cada uma roda numa transação junto com a atualização do user_version.
+#
+# Aplicar em todos os bancos (em paralelo): python migrate.py
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+def add_column(conn, table, column, definition):
+    """ALTER TABLE ADD COLUMN apenas se a coluna ainda não existir."""
+    if column not in table_columns(conn, table):
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def apply_migrations(conn, migrations, name=''):
+    """Aplica as migrações pendentes; retorna a lista de números aplicados."""
+    if conn.in_transaction:
+        conn.commit()
+    applied = []
+    for number, description, migrate in migrations:
+        if number <= conn.execute('PRAGMA user_version').fetchone()[0]:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Outro processo pode ter aplicado enquanto esperávamos o lock
+            if number <= conn.execute('PRAGMA user_version').fetchone()[0]:
+                conn.rollback()
+                continue
+            migrate(conn)
+            conn.execute(f'PRAGMA user_version = {int(number)}')
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise RuntimeError(f'Migração {number} ({description}) falhou em {name}: {e}') from e
+        applied.append(number)
+    return applied
+
+
+def school_legacy_columns(conn):
+    """Colunas que eram adicionadas com try/except ou por scripts avulsos (update_employee_table.py)."""
+    for column, definition in [('event_date', 'DATE'), ('cost', 'REAL'), ('class_name', 'TEXT'),
+                               ('pix_key', 'TEXT'), ('payment_deadline', 'DATE'), ('type', 'TEXT')]:
+        add_column(conn, 'events', column, definition)
+    add_column(conn, 'students', 'face_descriptor', 'TEXT')
+    add_column(conn, 'event_participations', 'receipt_url', 'TEXT')
+    add_column(conn, 'chat_messages', 'read', 'INTEGER DEFAULT 0')
+    for column, definition in [('client_id', 'TEXT'), ('client_secret', 'TEXT'), ('pix_key', 'TEXT'),
+                               ('gateway_provider', "TEXT DEFAULT 'inter'")]:
+        add_column(conn, 'financial_config', column, definition)
+    for column, definition in [('email', 'TEXT'), ('phone', 'TEXT'), ('employee_id', 'TEXT'),
+                               ('work_start_time', 'TEXT'), ('work_end_time', 'TEXT'), ('guardian_id', 'INTEGER')]:
+        add_column(conn, 'employees', column, definition)
+    for column, definition in [('type', 'TEXT'), ('latitude', 'REAL'), ('longitude', 'REAL'),
+                               ('photo_url', 'TEXT'), ('verified', 'INTEGER DEFAULT 0')]:
+        add_column(conn, 'employee_attendance', column, definition)
+
+def school_attendance_event_id(conn):
+    # Id do evento enviado pelo cliente (catraca/reconhecimento): torna /api/attendance/batch idempotente
+    add_column(conn, 'attendance', 'event_id', 'TEXT')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_event_id ON attendance(event_id) WHERE event_id IS NOT NULL')
+
+def school_hot_indexes(conn):
+    for sql in [
+        # Rotas do responsável: alunos vinculados e notificações pendentes
+        'CREATE INDEX IF NOT EXISTS idx_student_guardians_guardian ON student_guardians(guardian_id, student_id)',
+        'CREATE INDEX IF NOT EXISTS idx_student_guardians_student ON student_guardians(student_id)',
+        'CREATE INDEX IF NOT EXISTS idx_access_logs_notified_student ON access_logs(notified_guardian, student_id)',
+        # Listagens de presença por período
+        'CREATE INDEX IF NOT EXISTS idx_attendance_timestamp ON attendance(timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_chat_messages_student_school_timestamp ON chat_messages(student_id, school_id, timestamp)',
+        # Webhooks de pagamento
+        'CREATE INDEX IF NOT EXISTS idx_invoices_external_id ON invoices(external_id)',
+        # App do funcionário (login pelo cadastro de responsável)
+        'CREATE INDEX IF NOT EXISTS idx_employees_guardian ON employees(guardian_id)',
+    ]:
+        conn.execute(sql)
+
+# Horário normalizado (coluna ts_epoch): segundos do horário de parede como
+# foi escrito em timestamp (fuso ignorado), ou seja, o mesmo que as antigas
+# comparações de texto / LIKE 'AAAA-MM-DD%'. Inteiro indexado -> consultas
+# por período viram buscas por faixa no índice.
+TS_EPOCH_SQL = "CAST(strftime('%s', substr({column}, 1, 19)) AS INTEGER)"
+TS_EPOCH_TABLES = ['attendance', 'access_logs', 'employee_attendance']
+
+def wall_clock_epoch(value):
+    """datetime ou texto ISO ('2026-10-18T07:31:02.123', '2026-10-18 07:31:02', '2026-10-18') -> ts_epoch"""
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.fromisoformat(str(value)[:19])
+    return calendar.timegm(value.replace(tzinfo=None).timetuple())
+
+def day_range_epoch(start_date, end_date=None):
+    """
+    Período [início, fim) em ts_epoch. Datas 'AAAA-MM-DD' incluem o dia
+    inteiro; com horário, end_date é inclusivo até aquele segundo.
+    """
+    start = wall_clock_epoch(start_date) if start_date else None
+    end = None
+    if end_date:
+        end = wall_clock_epoch(end_date) + (86400 if len(str(end_date)) <= 10 else 1)
+    return start, end
+
+def month_range_epoch(year, month):
+    start = datetime.datetime(year, month, 1)
+    end = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+    return wall_clock_epoch(start), wall_clock_epoch(end)
+
+# Backfills de dados (ts_epoch, resumo de presença) rodam na migração, ou seja,
+# no primeiro acesso à escola e sob o lock de schema do pool. Acima deste número
+# de linhas ficam registrados em pending_backfills para o migrate.py --backfill,
+# e os leitores seguem pelo caminho antigo (ver ts_epoch_sql, attendance_rollup.ready).
+BACKFILL_REQUEST_LIMIT = int(os.environ.get('BACKFILL_REQUEST_LIMIT', '20000'))
+# (banco, backfill) já concluídos: não voltam a ficar pendentes
+_backfills_done = set()
+
+def defer_backfill(conn, name, rows):
+    """Registra o backfill como pendente se rows passar do limite. Retorna True se adiou."""
+    if rows <= BACKFILL_REQUEST_LIMIT:
+        return False
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pending_backfills (
+            name TEXT PRIMARY KEY,
+            rows INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )''')
+    conn.execute('INSERT OR REPLACE INTO pending_backfills (name, rows) VALUES (?, ?)', (name, rows))
+    log.warning('backfill grande demais para o primeiro acesso; rode python migrate.py --backfill',
+                extra={'db': getattr(conn, '_db_path', None), 'backfill': name, 'rows': rows})
+    return True
+
+def backfill_pending(conn, name):
+    key = (getattr(conn, '_db_path', None), name)
+    if key in _backfills_done:
+        return False
+    try:
+        pending = conn.execute('SELECT 1 FROM pending_backfills WHERE name = ?', (name,)).fetchone() is not None
+    except sqlite3.OperationalError:
+        pending = False  # A tabela só existe se algum backfill já foi adiado
+    if not pending and key[0]:
+        _backfills_done.add(key)
+    return pending
+
+def ts_epoch_sql(conn, prefix=''):
+    """
+    Expressão de ts_epoch para WHERE / ORDER BY. Com o backfill pendente, as
+    linhas ainda sem valor são calculadas a partir de timestamp (sem o índice).
+    """
+    column = f'{prefix}ts_epoch'
+    if not backfill_pending(conn, 'ts_epoch'):
+        return column
+    return f"COALESCE({column}, {TS_EPOCH_SQL.format(column=prefix + 'timestamp')})"
+
+def backfill_timestamp_epoch(conn):
+    expression = TS_EPOCH_SQL.format(column='timestamp')
+    for table in TS_EPOCH_TABLES:
+        conn.execute(f'UPDATE {table} SET ts_epoch = {expression} WHERE ts_epoch IS NULL')
+
+def school_timestamp_epoch(conn):
+    for table in TS_EPOCH_TABLES:
+        add_column(conn, table, 'ts_epoch', 'INTEGER')
+        # Quem grava sem ts_epoch (scripts, rotas antigas, DEFAULT CURRENT_TIMESTAMP) é normalizado aqui
+        new_expression = TS_EPOCH_SQL.format(column='NEW.timestamp')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_ts_epoch_insert AFTER INSERT ON {table}
+            WHEN NEW.ts_epoch IS NULL AND NEW.timestamp IS NOT NULL
+            BEGIN UPDATE {table} SET ts_epoch = {new_expression} WHERE id = NEW.id; END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_ts_epoch_update AFTER UPDATE OF timestamp ON {table}
+            BEGIN UPDATE {table} SET ts_epoch = {new_expression} WHERE id = NEW.id; END
+        ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_ts_epoch ON attendance(ts_epoch)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_access_logs_student_ts_epoch ON access_logs(student_id, ts_epoch)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_employee_attendance_ts_epoch ON employee_attendance(ts_epoch)')
+
+    # Backfill das linhas existentes (escolas grandes: migrate.py --backfill)
+    rows = sum(conn.execute(f'SELECT COUNT(*) FROM {table} WHERE ts_epoch IS NULL').fetchone()[0]
+               for table in TS_EPOCH_TABLES)
+    if not defer_backfill(conn, 'ts_epoch', rows):
+        backfill_timestamp_epoch(conn)
+
+# Backfills adiáveis, na ordem em que o migrate.py --backfill os executa
+BACKFILLS = [
+    ('ts_epoch', backfill_timestamp_epoch),
+    ('attendance_rollups', attendance_rollup.rebuild),
+]
+
+def run_pending_backfills(conn):
+    """Executa os backfills adiados pela migração. Retorna os nomes concluídos."""
+    done = []
+    for name, backfill in BACKFILLS:
+        if not backfill_pending(conn, name):
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            backfill(conn)
+            conn.execute('DELETE FROM pending_backfills WHERE name = ?', (name,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        done.append(name)
+    return done
+
+def school_attendance_rollups(conn):
+    attendance_rollup.create_tables(conn)
+    # Enquanto adiado, os leitores do resumo leem de attendance (raw=backfill_pending(...))
+    rows = conn.execute('SELECT COUNT(*) FROM attendance').fetchone()[0]
+    if not defer_backfill(conn, 'attendance_rollups', rows):
+        attendance_rollup.rebuild(conn)
+
+PHOTO_TABLES = ('students', 'employees', 'employee_attendance')
+# A migração roda no primeiro acesso à escola, sob o lock de schema: acima deste
+# número de fotos inline ela não move nada e a escola fica para o migrate.py --photos
+PHOTO_MIGRATION_REQUEST_LIMIT = int(os.environ.get('PHOTO_MIGRATION_REQUEST_LIMIT', '200'))
+
+def move_school_photos(conn, limit=None):
+    """Move as fotos inline da escola para o blob store. Com limit, não move nada se houver mais que isso."""
+    # Import local: blob_store depende de database (DB_DIR)
+    import blob_store
+    if limit is not None:
+        pending = sum(blob_store.count_inline_photos(conn, table) for table in PHOTO_TABLES)
+        if pending > limit:
+            log.warning('fotos inline demais para mover agora; rode python migrate.py --photos',
+                        extra={'db': getattr(conn, '_db_path', None), 'pending': pending})
+            return 0
+    total = 0
+    for table in PHOTO_TABLES:
+        moved = blob_store.move_inline_photos(conn, table)
+        if moved:
+            log.info('fotos movidas para o blob store', extra={'table': table, 'moved': moved})
+        total += moved
+    return total
+
+def school_photos_to_blobs(conn):
+    move_school_photos(conn, limit=PHOTO_MIGRATION_REQUEST_LIMIT)
+
+def school_list_indexes(conn):
+    # Ordenações e filtros de routes/list_query.py (o id vem junto em todo índice)
+    for sql in [
+        'CREATE INDEX IF NOT EXISTS idx_students_name ON students(name)',
+        'CREATE INDEX IF NOT EXISTS idx_students_class_name_name ON students(class_name, name)',
+        'CREATE INDEX IF NOT EXISTS idx_employees_name ON employees(name)',
+        'CREATE INDEX IF NOT EXISTS idx_employees_role_name ON employees(role, name)',
+        'CREATE INDEX IF NOT EXISTS idx_events_event_date ON events(event_date)',
+        'CREATE INDEX IF NOT EXISTS idx_chat_messages_student_timestamp ON chat_messages(student_id, timestamp)',
+    ]:
+        conn.execute(sql)
+
+SCHOOL_MIGRATIONS = [
+    (1, 'estrutura base', create_school_tables),
+    # Último registro do aluno por tipo (debounce de chegada/saída em routes/attendance.py)
+    (2, 'índice de debounce de presença', lambda conn: conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_attendance_student_type_timestamp ON attendance(student_id, type, timestamp)')),
+    (3, 'event_id em attendance', school_attendance_event_id),
+    (4, 'colunas legadas', school_legacy_columns),
+    (5, 'índices das consultas frequentes', school_hot_indexes),
+    (6, 'horário normalizado (ts_epoch)', school_timestamp_epoch),
+    (7, 'resumo diário de presença', school_attendance_rollups),
+    (8, 'fotos para o blob store', school_photos_to_blobs),
+    (9, 'índices das listagens', school_list_indexes),
+    # Debounce por ts_epoch (o texto de timestamp mistura 'T' e espaço)
+    (10, 'índice de debounce por ts_epoch', lambda conn: conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_attendance_student_type_ts_epoch ON attendance(student_id, type, ts_epoch)')),
+]
+
+# Versão atual do schema das escolas (PRAGMA user_version)
+SCHOOL_SCHEMA_VERSION = SCHOOL_MIGRATIONS[-1][0]
+
+
+def system_legacy_columns(conn):
+    add_column(conn, 'schools', 'cnpj', 'TEXT')
+    add_column(conn, 'guardians', 'role', "TEXT DEFAULT 'guardian'")
+
+def system_hot_indexes(conn):
+    for sql in [
+        'CREATE INDEX IF NOT EXISTS idx_support_messages_ticket_created ON support_messages(ticket_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_school_affiliates_parent ON school_affiliates(parent_school_id, affiliate_school_id, status)',
+        # Escolas onde a escola atual é filial (routes/affiliates.py)
+        'CREATE INDEX IF NOT EXISTS idx_school_affiliates_affiliate ON school_affiliates(affiliate_school_id, status)',
+    ]:
+        conn.execute(sql)
+
+def system_user_credentials(conn):
+    user_credentials.create_table(conn)
+    user_credentials.rebuild(conn)
+
+SYSTEM_MIGRATIONS = [
+    (1, 'estrutura base', create_system_tables),
+    (2, 'colunas legadas', system_legacy_columns),
+    (3, 'índices das consultas frequentes', system_hot_indexes),
+    (4, 'índices das listagens', lambda conn: conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_schools_name ON schools(name)')),
+    (5, 'índice de login (email -> papel)', system_user_credentials),
+]
+
+
+def init_system_db():
+    if not os.path.exists(DB_DIR):
+        os.makedirs(DB_DIR)
+    conn = connect(SYSTEM_DB_PATH)
     try:
-        cur.execute("ALTER TABLE chat_messages ADD COLUMN read INTEGER DEFAULT 0")
-    except: pass
+        apply_migrations(conn, SYSTEM_MIGRATIONS, 'system.db')
+    finally:
+        conn.close()
 
-    conn.commit()
+def init_school_db(conn):
+    return apply_migrations(conn, SCHOOL_MIGRATIONS, getattr(conn, '_db_path', None) or 'school')
@@ -0,0 +1,53 @@
+"""
+Sincronização incremental com o serviço de reconhecimento facial.
+
+Quando a biometria de um aluno muda (ou o aluno é removido), avisa o serviço
+(facial-recognition/app.py, rota /embeddings/<school_id>/students/<id>) para
+atualizar só aquele vetor no índice, em vez de recarregar a escola inteira.
+
+Opcional: só roda com FACIAL_RECOGNITION_URL configurada. O envio acontece
+numa thread separada para não atrasar a resposta da rota; se o serviço
+estiver fora do ar, a próxima recarga completa corrige o índice.
+"""
+import os
+import json
+import threading
+import requests
+
+FACIAL_RECOGNITION_URL = os.environ.get('FACIAL_RECOGNITION_URL')
+SYNC_TIMEOUT_SECONDS = 5
+
+
+def _send(method, school_id, student_id, payload=None):
+    url = f"{FACIAL_RECOGNITION_URL}/embeddings/{int(school_id)}/students/{int(student_id)}"
+    try:
+        response = requests.request(method, url, json=payload, timeout=SYNC_TIMEOUT_SECONDS)
+        if response.status_code != 200:
+            print(f"Erro ao sincronizar biometria do aluno {student_id}: {response.status_code}")
+    except Exception as e:
+        print(f"Erro ao sincronizar biometria do aluno {student_id}: {e}")
+
+
+def _dispatch(*args):
+    if not FACIAL_RECOGNITION_URL:
+        return
+    threading.Thread(target=_send, args=args, daemon=True).start()
+
+
+def push_student_face(school_id, student_id, descriptor, student=None):
+    """Envia o novo descritor (lista ou JSON) junto com os dados exibidos no reconhecimento."""
+    if not descriptor:
+        return
+    if isinstance(descriptor, str):
+        descriptor = json.loads(descriptor)
+    student = student or {}
+    _dispatch('PUT', school_id, student_id, {
+        'face_descriptor': descriptor,
+        'name': student.get('name') or '',
+        'guardian_phone': student.get('phone') or '',
+        'class_name': student.get('class_name') or ''
+    })
+
+
+def remove_student_face(school_id, student_id):
+    _dispatch('DELETE', school_id, student_id)
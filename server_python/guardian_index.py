@@ -0,0 +1,138 @@
+"""
+Índice global responsável -> escola/aluno (tabela guardian_student_index no system.db).
+
+Os vínculos reais continuam em student_guardians de cada school_{id}.db.
+Este índice existe para que as rotas do responsável abram apenas os bancos
+das escolas onde ele tem filhos, em vez de varrer todas as escolas.
+
+Reconstrução manual (ex: após restaurar backups):
+    python guardian_index.py
+"""
+import sqlite3
+from database import SYSTEM_DB_PATH, connect, get_school_db
+
+
+def index_link(sys_db, guardian_id, school_id, student_id, class_name=None):
+    """Registra (ou atualiza) um vínculo responsável/aluno no índice."""
+    sys_db.execute('''
+        INSERT OR REPLACE INTO guardian_student_index (guardian_id, school_id, student_id, class_name)
+        VALUES (?, ?, ?, ?)
+    ''', (guardian_id, int(school_id), student_id, class_name))
+    sys_db.commit()
+
+
+def index_unlink(sys_db, school_id, student_id, guardian_id=None):
+    """Remove do índice os vínculos de um aluno (ou apenas de um responsável)."""
+    if guardian_id is None:
+        sys_db.execute('DELETE FROM guardian_student_index WHERE school_id = ? AND student_id = ?',
+                       (int(school_id), student_id))
+    else:
+        sys_db.execute('DELETE FROM guardian_student_index WHERE school_id = ? AND student_id = ? AND guardian_id = ?',
+                       (int(school_id), student_id, guardian_id))
+    sys_db.commit()
+
+
+def index_update_class(sys_db, school_id, student_id, class_name):
+    """Mantém a turma do aluno sincronizada no índice."""
+    sys_db.execute('UPDATE guardian_student_index SET class_name = ? WHERE school_id = ? AND student_id = ?',
+                   (class_name, int(school_id), student_id))
+    sys_db.commit()
+
+
+def index_remove_school(sys_db, school_id):
+    sys_db.execute('DELETE FROM guardian_student_index WHERE school_id = ?', (int(school_id),))
+    sys_db.commit()
+
+
+def get_guardian_schools(sys_db, guardian_id):
+    """Escolas (id, name, latitude, longitude) onde o responsável tem alunos vinculados."""
+    return sys_db.execute('''
+        SELECT s.id, s.name, s.latitude, s.longitude
+        FROM schools s
+        WHERE s.id IN (SELECT school_id FROM guardian_student_index WHERE guardian_id = ?)
+        ORDER BY s.id
+    ''', (guardian_id,)).fetchall()
+
+
+def get_guardian_students(sys_db, guardian_id):
+    """Alunos vinculados ao responsável: [(school_id, student_id, class_name), ...]."""
+    return sys_db.execute('''
+        SELECT school_id, student_id, class_name
+        FROM guardian_student_index
+        WHERE guardian_id = ?
+        ORDER BY school_id, student_id
+    ''', (guardian_id,)).fetchall()
+
+
+def get_student_guardian_ids(sys_db, school_id, student_id):
+    rows = sys_db.execute('SELECT guardian_id FROM guardian_student_index WHERE school_id = ? AND student_id = ?',
+                          (int(school_id), student_id)).fetchall()
+    return [r[0] for r in rows]
+
+
+def get_school_guardian_ids(sys_db, school_id, class_name=None):
+    """Responsáveis com alunos na escola; com class_name, apenas os daquela turma."""
+    if class_name:
+        rows = sys_db.execute('SELECT DISTINCT guardian_id FROM guardian_student_index WHERE school_id = ? AND class_name = ?',
+                              (int(school_id), class_name)).fetchall()
+    else:
+        rows = sys_db.execute('SELECT DISTINCT guardian_id FROM guardian_student_index WHERE school_id = ?',
+                              (int(school_id),)).fetchall()
+    return [r[0] for r in rows]
+
+
+def rebuild_guardian_index(sys_db=None):
+    """Reconstrói o índice inteiro a partir de student_guardians de todas as escolas."""
+    own_conn = sys_db is None
+    if own_conn:
+        sys_db = connect(SYSTEM_DB_PATH)
+        sys_db.row_factory = sqlite3.Row
+
+    entries = []
+    schools = sys_db.execute('SELECT id FROM schools').fetchall()
+    for school in schools:
+        school_db = None
+        try:
+            school_db = get_school_db(school['id'])
+            rows = school_db.execute('''
+                SELECT sg.guardian_id, s.id as student_id, s.class_name
+                FROM student_guardians sg
+                JOIN students s ON s.id = sg.student_id
+                WHERE sg.guardian_id IS NOT NULL
+            ''').fetchall()
+            entries.extend((r['guardian_id'], school['id'], r['student_id'], r['class_name']) for r in rows)
+        except Exception as e:
+            print(f"Erro ao indexar escola {school['id']}: {e}")
+            continue
+        finally:
+            if school_db: school_db.close()
+
+    sys_db.execute('DELETE FROM guardian_student_index')
+    sys_db.executemany('''
+        INSERT OR REPLACE INTO guardian_student_index (guardian_id, school_id, student_id, class_name)
+        VALUES (?, ?, ?, ?)
+    ''', entries)
+    sys_db.commit()
+
+    if own_conn:
+        sys_db.close()
+    return len(entries)
+
+
+def ensure_guardian_index():
+    """Na subida do servidor: popula o índice se ele ainda estiver vazio."""
+    sys_db = connect(SYSTEM_DB_PATH)
+    sys_db.row_factory = sqlite3.Row
+    try:
+        if not sys_db.execute('SELECT 1 FROM guardian_student_index LIMIT 1').fetchone():
+            count = rebuild_guardian_index(sys_db)
+            print(f"🔗 Índice de responsáveis populado: {count} vínculos")
+    finally:
+        sys_db.close()
+
+
+if __name__ == '__main__':
+    from database import init_system_db
+    init_system_db()
+    total = rebuild_guardian_index()
+    print(f"✅ Índice de responsáveis reconstruído: {total} vínculos")
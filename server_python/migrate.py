@@ -0,0 +1,97 @@
+"""
+Aplica as migrações pendentes (database.SYSTEM_MIGRATIONS / SCHOOL_MIGRATIONS)
+no system.db e em todos os school_{id}.db, vários bancos em paralelo.
+
+Uso:
+    python migrate.py                # aplica em todos os bancos
+    python migrate.py --workers 8
+    python migrate.py --status       # só mostra a versão de cada banco
+    python migrate.py --photos       # move para o blob store as fotos inline que a
+                                     # migração 8 deixou (escolas grandes não migram na requisição)
+    python migrate.py --backfill     # conclui os backfills que a migração adiou em escolas
+                                     # grandes (database.BACKFILLS, tabela pending_backfills)
+    python migrate.py --vacuum       # depois das migrações, VACUUM para devolver o espaço
+                                     # liberado (ex: fotos movidas para o blob store)
+"""
+import os
+import sys
+import glob
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from database import (DB_DIR, SYSTEM_DB_PATH, SCHOOL_MIGRATIONS, SYSTEM_MIGRATIONS,
+                      connect, apply_migrations, move_school_photos, run_pending_backfills)
+
+
+def vacuum(conn, path):
+    """VACUUM + checkpoint do WAL. Retorna (tamanho antes, depois) em bytes."""
+    before = os.path.getsize(path)
+    conn.execute('VACUUM')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return before, os.path.getsize(path)
+
+
+def migrate_database(path, migrations, status_only=False, compact=False, photos=False, backfill=False):
+    """Retorna (arquivo, versão antes, migrações aplicadas, erro)."""
+    name = os.path.basename(path)
+    conn = None
+    try:
+        conn = connect(path)
+        before = conn.execute('PRAGMA user_version').fetchone()[0]
+        if status_only:
+            return name, before, [], None
+        applied = apply_migrations(conn, migrations, name)
+        if backfill:
+            for done in run_pending_backfills(conn):
+                print(f"🔁 {name}: backfill {done} concluído")
+        if photos:
+            moved = move_school_photos(conn)
+            conn.commit()
+            if moved:
+                print(f"🖼️ {name}: {moved} fotos movidas para o blob store")
+        if compact:
+            size_before, size_after = vacuum(conn, path)
+            print(f"🧹 {name}: {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB")
+        return name, before, applied, None
+    except Exception as e:
+        return name, None, [], str(e)
+    finally:
+        if conn: conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrações versionadas dos bancos SQLite')
+    parser.add_argument('--workers', type=int, default=min(8, (os.cpu_count() or 2) * 2))
+    parser.add_argument('--status', action='store_true', help='apenas listar a versão de cada banco')
+    parser.add_argument('--photos', action='store_true', help='mover as fotos inline das escolas para o blob store')
+    parser.add_argument('--backfill', action='store_true', help='concluir os backfills adiados pela migração')
+    parser.add_argument('--vacuum', action='store_true', help='compactar cada banco depois das migrações')
+    args = parser.parse_args()
+
+    # system.db primeiro: as escolas dependem dele estar atualizado
+    results = [migrate_database(SYSTEM_DB_PATH, SYSTEM_MIGRATIONS, args.status, args.vacuum)]
+
+    school_dbs = sorted(glob.glob(os.path.join(DB_DIR, 'school_*.db')))
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results += pool.map(lambda path: migrate_database(path, SCHOOL_MIGRATIONS, args.status, args.vacuum,
+                                                          args.photos, args.backfill),
+                            school_dbs)
+
+    latest = {'system.db': SYSTEM_MIGRATIONS[-1][0]}
+    failures = 0
+    for name, before, applied, error in results:
+        target = latest.get(name, SCHOOL_MIGRATIONS[-1][0])
+        if error:
+            failures += 1
+            print(f"❌ {name}: {error}")
+        elif applied:
+            print(f"✅ {name}: v{before} -> v{applied[-1]} (migrações {', '.join(map(str, applied))})")
+        else:
+            print(f"{'⚠️ ' if before < target else '✔️ '} {name}: v{before} (atual: v{target})")
+
+    print(f"\n{len(results)} bancos, {failures} com erro")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Barramento publish/subscribe de notificações para os responsáveis.
+
+As rotas que geram eventos (chegada/saída, eventos escolares, chat) publicam
+no canal do responsável; os endpoints SSE ficam bloqueados na fila da
+assinatura em vez de reabrir os bancos a cada poucos segundos.
+
+Backends (variável NOTIFICATION_BUS_BACKEND):
+    memory  - padrão; entrega dentro do próprio processo.
+    sqlite  - substituto local do pub/sub do Redis: as mensagens passam por um
+              arquivo SQLite compartilhado, permitindo vários workers do
+              gunicorn. Cada processo tem uma única thread leitora.
+"""
+import os
+import json
+import time
+import queue
+import threading
+from database import DB_DIR, connect
+from guardian_index import get_student_guardian_ids, get_school_guardian_ids
+from app_logging import get_logger
+
+log = get_logger('notification_bus')
+
+NOTIFICATION_BUS_BACKEND = os.environ.get('NOTIFICATION_BUS_BACKEND', 'memory')
+NOTIFICATION_BUS_DB = os.environ.get('NOTIFICATION_BUS_DB', os.path.join(DB_DIR, 'notification_bus.db'))
+
+# Mensagens acumuladas por assinatura antes de descartar as mais antigas
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class MemoryBackend:
+    """Entrega direta, apenas dentro do processo atual."""
+
+    def start(self, deliver):
+        self._deliver = deliver
+
+    def publish(self, channel, payload):
+        self._deliver(channel, payload)
+
+
+class SQLiteBackend:
+    """
+    Pub/sub entre processos usando uma tabela append-only num arquivo SQLite.
+    Mesma semântica do PUBLISH/SUBSCRIBE do Redis: quem não estava
+    escutando no momento da publicação não recebe a mensagem.
+    """
+
+    POLL_INTERVAL = 0.25
+    RETENTION_SECONDS = 60
+
+    def __init__(self, path=NOTIFICATION_BUS_DB):
+        self.path = path
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS bus_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel TEXT,
+            payload TEXT,
+            created_at REAL
+        )''')
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        return connect(self.path)
+
+    def start(self, deliver):
+        self._deliver = deliver
+        thread = threading.Thread(target=self._listen, daemon=True, name='notification-bus-listener')
+        thread.start()
+
+    def publish(self, channel, payload):
+        conn = self._connect()
+        try:
+            conn.execute('INSERT INTO bus_messages (channel, payload, created_at) VALUES (?, ?, ?)',
+                         (channel, payload, time.time()))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _listen(self):
+        conn = self._connect()
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM bus_messages').fetchone()[0]
+        last_prune = 0
+
+        while True:
+            try:
+                rows = conn.execute('SELECT id, channel, payload FROM bus_messages WHERE id > ? ORDER BY id',
+                                    (last_id,)).fetchall()
+                for msg_id, channel, payload in rows:
+                    last_id = msg_id
+                    self._deliver(channel, payload)
+
+                now = time.time()
+                if now - last_prune > self.RETENTION_SECONDS:
+                    conn.execute('DELETE FROM bus_messages WHERE created_at < ?', (now - self.RETENTION_SECONDS,))
+                    conn.commit()
+                    last_prune = now
+            except Exception as e:
+                log.error('erro no barramento de notificações', extra={'error': str(e)})
+
+            time.sleep(self.POLL_INTERVAL)
+
+
+class Subscription:
+    """Fila de mensagens de um responsável conectado (uma por conexão SSE)."""
+
+    def __init__(self, bus, channel):
+        self._bus = bus
+        self.channel = channel
+        self._queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def get(self, timeout=None):
+        """Bloqueia até chegar uma mensagem; retorna None se o timeout expirar."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _put(self, message):
+        # Cliente lento: descartar a mensagem mais antiga em vez de bloquear o publicador
+        while True:
+            try:
+                self._queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        self._bus.detach(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class NotificationBus:
+    def __init__(self, backend):
+        self.backend = backend
+        self._subscribers = {}  # {channel: set(Subscription)}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._lock:
+            if not self._started:
+                self.backend.start(self._deliver)
+                self._started = True
+
+    def publish(self, guardian_id, message):
+        self._ensure_started()
+        self.backend.publish(str(guardian_id), json.dumps(message))
+
+    def subscribe(self, guardian_id):
+        return self.attach(Subscription(self, str(guardian_id)))
+
+    def attach(self, sub):
+        """Registra um assinante próprio: qualquer objeto com .channel e ._put(message)."""
+        self._ensure_started()
+        with self._lock:
+            self._subscribers.setdefault(sub.channel, set()).add(sub)
+        return sub
+
+    def detach(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.channel)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.channel]
+
+    def _deliver(self, channel, payload):
+        with self._lock:
+            subs = list(self._subscribers.get(channel, ()))
+        if not subs:
+            return
+        message = json.loads(payload)
+        for sub in subs:
+            sub._put(message)
+
+
+def _create_backend(name):
+    if name == 'sqlite':
+        return SQLiteBackend()
+    return MemoryBackend()
+
+
+notification_bus = NotificationBus(_create_backend(NOTIFICATION_BUS_BACKEND))
+
+
+def notify_student_guardians(sys_db, school_id, student_id, message):
+    """Publica a mensagem para todos os responsáveis vinculados ao aluno."""
+    try:
+        for guardian_id in get_student_guardian_ids(sys_db, school_id, student_id):
+            notification_bus.publish(guardian_id, message)
+    except Exception as e:
+        log.error('erro ao publicar notificação', extra={'school_id': school_id, 'student_id': student_id,
+                                                        'error': str(e)})
+
+
+def notify_school_guardians(sys_db, school_id, message, class_name=None):
+    """Publica a mensagem para os responsáveis da escola (opcionalmente só de uma turma)."""
+    try:
+        for guardian_id in get_school_guardian_ids(sys_db, school_id, class_name):
+            notification_bus.publish(guardian_id, message)
+    except Exception as e:
+        log.error('erro ao publicar notificação', extra={'school_id': school_id, 'class_name': class_name,
+                                                        'error': str(e)})
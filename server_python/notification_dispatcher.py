@@ -0,0 +1,400 @@
+"""
+Despachante único das notificações para os responsáveis.
+
+As rotas entregam uma intenção de notificação (aluno + evento) e o
+despachante cuida dos canais:
+
+    SSE       - publicado na hora no notification_bus, para cada responsável.
+    WhatsApp  - eventos do mesmo responsável dentro de MERGE_WINDOW_SECONDS
+                viram uma única mensagem (ex: irmãos chegando juntos, ou
+                chegada + saída em sequência). O envio roda num pool limitado
+                (DISPATCH_CONCURRENCY) usando sessões HTTP reaproveitadas.
+    Registro  - o resultado de cada envio vai para whatsapp_notifications
+                (system.db) em inserts agrupados, pela fila de escrita do banco.
+
+Falha do provedor: nova tentativa com backoff exponencial (SEND_RETRY_BASE_SECONDS)
+até SEND_MAX_ATTEMPTS; só então o registro fica 'failed'. Registros que não
+conseguem ser gravados em RECORD_FLUSH_MAX_FAILURES tentativas seguidas são
+descartados (com log), para a lista em memória não crescer sem limite.
+
+Provedores de WhatsApp (variável NOTIFICATION_PROVIDER):
+    none    - padrão; só SSE.
+    whapi   - API do whapi.cloud (WHAPI_TOKEN, WHAPI_URL).
+    bridge  - ponte PyWhatKit (server/python_services/whatsapp_server.py,
+              WHATSAPP_BRIDGE_URL), que enfileira e devolve na hora.
+    fake    - simulação local para teste de carga (FAKE_PROVIDER_LATENCY,
+              FAKE_PROVIDER_FAILURE_RATE).
+
+Teste de carga com o provedor falso:
+    python notification_dispatcher.py --intents 5000 --guardians 800
+"""
+import os
+import time
+import random
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from database import SYSTEM_DB_PATH, get_write_queue
+from guardian_index import get_student_guardian_ids
+from notification_bus import notification_bus
+from app_logging import get_logger
+
+log = get_logger('notification_dispatcher')
+
+NOTIFICATION_PROVIDER = os.environ.get('NOTIFICATION_PROVIDER', 'none')
+MERGE_WINDOW_SECONDS = float(os.environ.get('NOTIFICATION_MERGE_WINDOW', '10'))
+DISPATCH_CONCURRENCY = int(os.environ.get('DISPATCH_CONCURRENCY', '8'))
+WHAPI_TOKEN = os.environ.get('WHAPI_TOKEN', '')
+WHAPI_URL = os.environ.get('WHAPI_URL', 'https://gate.whapi.cloud')
+WHATSAPP_BRIDGE_URL = os.environ.get('WHATSAPP_BRIDGE_URL', 'http://localhost:5002')
+FAKE_PROVIDER_LATENCY = float(os.environ.get('FAKE_PROVIDER_LATENCY', '0.2'))
+FAKE_PROVIDER_FAILURE_RATE = float(os.environ.get('FAKE_PROVIDER_FAILURE_RATE', '0'))
+
+SEND_TIMEOUT_SECONDS = 10
+SEND_MAX_ATTEMPTS = int(os.environ.get('NOTIFICATION_SEND_MAX_ATTEMPTS', '3'))
+SEND_RETRY_BASE_SECONDS = float(os.environ.get('NOTIFICATION_RETRY_BASE_SECONDS', '5'))
+FLUSH_INTERVAL = 0.5
+RECORD_BATCH_SIZE = 200
+RECORD_FLUSH_MAX_FAILURES = 20  # ~10s de banco indisponível (FLUSH_INTERVAL)
+
+EVENT_LABELS = {'arrival': 'chegou à escola', 'departure': 'saiu da escola'}
+
+
+def pooled_session(pool_size=DISPATCH_CONCURRENCY):
+    """Sessão com um pool de conexões do tamanho da concorrência de envio."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def normalize_phone(phone):
+    digits = ''.join(filter(str.isdigit, phone or ''))
+    if digits and not digits.startswith('55'):
+        digits = '55' + digits
+    return digits
+
+
+class WhapiProvider:
+    name = 'whapi'
+
+    def __init__(self, token=WHAPI_TOKEN, url=WHAPI_URL):
+        self.url = f'{url}/messages/text'
+        self.session = pooled_session()
+        self.session.headers.update({'Authorization': f'Bearer {token}'})
+
+    def send(self, phone, message):
+        response = self.session.post(self.url, json={'to': phone, 'body': message}, timeout=SEND_TIMEOUT_SECONDS)
+        return response.status_code == 200, f'{response.status_code}'
+
+
+class BridgeProvider:
+    """Ponte PyWhatKit: a mensagem fica na fila dela, então 'sent' aqui significa enfileirada."""
+    name = 'bridge'
+
+    def __init__(self, url=WHATSAPP_BRIDGE_URL):
+        self.url = f'{url}/send'
+        self.session = pooled_session()
+
+    def send(self, phone, message):
+        response = self.session.post(self.url, json={'phone': phone, 'message': message}, timeout=SEND_TIMEOUT_SECONDS)
+        if response.status_code in (200, 202):
+            return True, response.json().get('id')
+        return False, f'{response.status_code}'
+
+
+class FakeProvider:
+    """Não envia nada: simula a latência e a taxa de falha de um provedor real."""
+    name = 'fake'
+
+    def __init__(self, latency=FAKE_PROVIDER_LATENCY, failure_rate=FAKE_PROVIDER_FAILURE_RATE):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, phone, message):
+        time.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if random.random() < self.failure_rate:
+            return False, 'falha simulada'
+        with self._lock:
+            self.sent.append((phone, message))
+        return True, None
+
+
+def create_provider(name=NOTIFICATION_PROVIDER):
+    if name == 'whapi':
+        return WhapiProvider() if WHAPI_TOKEN else None
+    if name == 'bridge':
+        return BridgeProvider()
+    if name == 'fake':
+        return FakeProvider()
+    return None
+
+
+def format_message(school_name, events):
+    """Uma mensagem com todos os eventos agrupados do responsável."""
+    if len(events) == 1:
+        e = events[0]
+        return (
+            f"🎓 *EduFocus - Notificação*\n\n"
+            f"✅ O aluno *{e['student_name']}* {EVENT_LABELS.get(e['event_type'], e['event_type'])}!\n\n"
+            f"🏫 Escola: {school_name}\n"
+            f"🕐 Horário: {e['time_display']}\n\n"
+            f"_Mensagem automática do sistema EduFocus_"
+        )
+    lines = '\n'.join(
+        f"• *{e['student_name']}* {EVENT_LABELS.get(e['event_type'], e['event_type'])} às {e['time_display']}"
+        for e in events
+    )
+    return (
+        f"🎓 *EduFocus - Notificações*\n\n"
+        f"{lines}\n\n"
+        f"🏫 Escola: {school_name}\n\n"
+        f"_Mensagem automática do sistema EduFocus_"
+    )
+
+
+class NotificationDispatcher:
+    def __init__(self, provider, db_path=SYSTEM_DB_PATH, window=MERGE_WINDOW_SECONDS,
+                 concurrency=DISPATCH_CONCURRENCY):
+        self.provider = provider
+        self.db_path = db_path
+        self.window = window
+        self.concurrency = concurrency
+        self._pending = {}   # {(phone, school_id): {'due': float, 'school_name', 'events': [...]}}
+        self._retries = []   # [(due, phone, school_id, group)] que falharam no provedor
+        self._records = []   # linhas para whatsapp_notifications
+        self._flush_failures = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._executor = None
+        self._started = False
+        self.counters = {'intents': 0, 'messages': 0, 'sent': 0, 'failed': 0, 'retries': 0, 'in_flight': 0,
+                         'dropped_records': 0}
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='notification-send')
+            threading.Thread(target=self._run, daemon=True, name='notification-dispatcher').start()
+            self._started = True
+
+    # ----- entrada -----
+
+    def notify_student_event(self, sys_db, school_id, student, event_type, timestamp, log_id=None, school_name=None):
+        """
+        Intenção de notificação de um evento do aluno (chegada/saída): SSE para
+        todos os responsáveis vinculados e WhatsApp agrupado por responsável.
+        """
+        try:
+            guardian_ids = get_student_guardian_ids(sys_db, school_id, student['id'])
+            for guardian_id in guardian_ids:
+                notification_bus.publish(guardian_id, {
+                    'type': 'notification',
+                    'data': {
+                        'id': log_id,
+                        'student_id': student['id'],
+                        'student_name': student['name'],
+                        'event_type': event_type,
+                        'timestamp': timestamp,
+                        'school_id': school_id,
+                        'school_name': school_name
+                    }
+                })
+
+            if not self.provider or not guardian_ids:
+                return
+            placeholders = ','.join('?' * len(guardian_ids))
+            phones = sys_db.execute(
+                f'SELECT phone FROM guardians WHERE id IN ({placeholders})', guardian_ids
+            ).fetchall()
+            for row in phones:
+                self.enqueue(normalize_phone(row['phone']), school_id, school_name, {
+                    'student_id': student['id'],
+                    'student_name': student['name'],
+                    'event_type': event_type,
+                    'time_display': timestamp[11:16] if len(timestamp) >= 16 else timestamp
+                })
+        except Exception as e:
+            log.error('erro ao despachar notificação', extra={'school_id': school_id, 'error': str(e)})
+
+    def enqueue(self, phone, school_id, school_name, event):
+        """Adiciona o evento à mensagem pendente do telefone (abre a janela se for o primeiro)."""
+        if not phone:
+            return
+        self._ensure_started()
+        with self._lock:
+            self.counters['intents'] += 1
+            group = self._pending.get((phone, school_id))
+            if group is None:
+                group = self._pending[(phone, school_id)] = {
+                    'due': time.monotonic() + self.window,
+                    'school_name': school_name or f'Escola ID {school_id}',
+                    'events': []
+                }
+            group['events'].append(event)
+
+    # ----- envio -----
+
+    def _run(self):
+        while True:
+            try:
+                self._dispatch_due()
+                self._flush_records()
+            except Exception as e:
+                log.error('erro no despachante de notificações', extra={'error': str(e)})
+            self._wakeup.wait(FLUSH_INTERVAL)
+            self._wakeup.clear()
+
+    def _dispatch_due(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            due = [key for key, group in self._pending.items() if force or group['due'] <= now]
+            groups = [(key, self._pending.pop(key)) for key in due]
+            self.counters['messages'] += len(groups)
+            retries = [r for r in self._retries if force or r[0] <= now]
+            if retries:
+                self._retries = [r for r in self._retries if not (force or r[0] <= now)]
+                groups += [((phone, school_id), group) for _, phone, school_id, group in retries]
+            self.counters['in_flight'] += len(groups)
+        for (phone, school_id), group in groups:
+            self._executor.submit(self._send, phone, school_id, group)
+
+    def _send(self, phone, school_id, group):
+        try:
+            ok, detail = self.provider.send(phone, format_message(group['school_name'], group['events']))
+        except Exception as e:
+            ok, detail = False, str(e)
+
+        attempts = group.get('attempts', 0) + 1
+        if not ok and attempts < SEND_MAX_ATTEMPTS:
+            # Nova tentativa com backoff exponencial (pelo laço de _run)
+            group['attempts'] = attempts
+            due = time.monotonic() + SEND_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+            with self._lock:
+                self.counters['in_flight'] -= 1
+                self.counters['retries'] += 1
+                self._retries.append((due, phone, school_id, group))
+            log.warning('falha ao enviar WhatsApp; nova tentativa',
+                        extra={'phone': phone, 'attempts': attempts, 'detail': detail})
+            return
+
+        sent_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        status = 'sent' if ok else 'failed'
+        with self._lock:
+            self.counters['in_flight'] -= 1
+            self.counters['sent' if ok else 'failed'] += 1
+            for event in group['events']:
+                self._records.append((school_id, event['student_id'], phone, event['event_type'], sent_at, status))
+            if len(self._records) >= RECORD_BATCH_SIZE:
+                self._wakeup.set()
+        if not ok:
+            log.error('WhatsApp não enviado após as tentativas',
+                      extra={'phone': phone, 'attempts': attempts, 'detail': detail})
+
+    def _flush_records(self):
+        with self._lock:
+            records, self._records = self._records, []
+        if not records:
+            return
+        try:
+            get_write_queue(self.db_path).execute('''
+                INSERT INTO whatsapp_notifications (school_id, student_id, phone, message_type, sent_at, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', records, many=True)
+            self._flush_failures = 0
+        except Exception as e:
+            self._flush_failures += 1
+            if self._flush_failures >= RECORD_FLUSH_MAX_FAILURES:
+                # Banco indisponível há várias tentativas: descarta em vez de acumular
+                log.error('registros de WhatsApp descartados',
+                          extra={'records': len(records), 'failures': self._flush_failures, 'error': str(e)})
+                with self._lock:
+                    self.counters['dropped_records'] += len(records)
+                self._flush_failures = 0
+                return
+            log.warning('falha ao gravar registros de WhatsApp; nova tentativa',
+                        extra={'records': len(records), 'failures': self._flush_failures, 'error': str(e)})
+            with self._lock:
+                self._records[:0] = records
+
+    def drain(self, timeout=60):
+        """Envia tudo que está pendente, espera os envios e grava os registros (testes/desligamento)."""
+        if not self._started:
+            return
+        deadline = time.monotonic() + timeout
+        # Novas tentativas saem na hora, sem esperar o backoff
+        while time.monotonic() < deadline:
+            self._dispatch_due(force=True)
+            while self.counters['in_flight'] and time.monotonic() < deadline:
+                time.sleep(0.05)
+            if not self._retries:
+                break
+        self._flush_records()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'provider': self.provider.name if self.provider else None,
+                'pending_groups': len(self._pending),
+                'pending_retries': len(self._retries),
+                'pending_records': len(self._records),
+                **self.counters
+            }
+
+
+dispatcher = NotificationDispatcher(create_provider())
+
+
+def _load_test():
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Teste de carga do despachante com o provedor falso')
+    parser.add_argument('--intents', type=int, default=5000)
+    parser.add_argument('--guardians', type=int, default=800)
+    parser.add_argument('--window', type=float, default=2.0)
+    parser.add_argument('--concurrency', type=int, default=DISPATCH_CONCURRENCY)
+    parser.add_argument('--latency', type=float, default=FAKE_PROVIDER_LATENCY)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'load_test.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('''CREATE TABLE whatsapp_notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, school_id INTEGER, student_id INTEGER,
+        phone TEXT, message_type TEXT, sent_at DATETIME, status TEXT)''')
+    conn.commit()
+
+    provider = FakeProvider(latency=args.latency)
+    test_dispatcher = NotificationDispatcher(provider, db_path, window=args.window, concurrency=args.concurrency)
+
+    started = time.perf_counter()
+    for i in range(args.intents):
+        guardian = random.randrange(args.guardians)
+        test_dispatcher.enqueue(f'55119{guardian:08d}', 1, 'Escola Teste', {
+            'student_id': i, 'student_name': f'Aluno {i}',
+            'event_type': random.choice(['arrival', 'departure']), 'time_display': '07:30'
+        })
+    enqueue_seconds = time.perf_counter() - started
+    test_dispatcher.drain(timeout=600)
+    total_seconds = time.perf_counter() - started
+
+    recorded = conn.execute('SELECT COUNT(*) FROM whatsapp_notifications').fetchone()[0]
+    stats = test_dispatcher.stats()
+    print(f"Intenções: {stats['intents']} ({args.intents / enqueue_seconds:.0f}/s para enfileirar)")
+    print(f"Mensagens: {stats['messages']} (agrupamento {stats['intents'] / max(stats['messages'], 1):.1f} eventos/mensagem)")
+    print(f"Enviadas: {stats['sent']} | Falhas: {stats['failed']} | Registros gravados: {recorded}")
+    print(f"Tempo total: {total_seconds:.2f}s ({stats['messages'] / total_seconds:.0f} mensagens/s)")
+
+
+if __name__ == '__main__':
+    _load_test()
@@ -0,0 +1,217 @@
+"""
+bcrypt fora das threads de requisição.
+
+Cada verificação custa ~250 ms de CPU; na abertura da escola centenas de
+responsáveis fazem login ao mesmo tempo e, rodando na thread da requisição,
+o resto da API ficava parado atrás deles. Agora:
+
+    Pool      - hash/verificação num pool de PASSWORD_HASH_WORKERS processos.
+                Com mais de PASSWORD_HASH_MAX_QUEUE pedidos esperando, o login
+                responde 503 (Retry-After) em vez de acumular threads presas.
+    Limites   - no máximo LOGIN_MAX_PER_IP logins simultâneos por IP e
+                LOGIN_MAX_PER_EMAIL por email (acima disso, 429).
+    Rehash    - com BCRYPT_REHASH=1, senhas com custo diferente de BCRYPT_ROUNDS
+                (ou ainda em texto plano) são re-hasheadas depois de um login
+                correto, em segundo plano e só quando o pool está ocioso.
+
+Métricas em stats() (também em /api/health). PASSWORD_HASH_WORKERS=0 roda
+o bcrypt na própria thread (scripts, testes).
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import bcrypt
+
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', '32'))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', '10'))
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+BCRYPT_REHASH = os.environ.get('BCRYPT_REHASH', '0').lower() in ('1', 'true', 'yes')
+LOGIN_MAX_PER_IP = int(os.environ.get('LOGIN_MAX_PER_IP', '8'))
+LOGIN_MAX_PER_EMAIL = int(os.environ.get('LOGIN_MAX_PER_EMAIL', '2'))
+
+
+class PasswordHasherBusy(Exception):
+    """Fila do pool cheia (ou pedido demorou mais que PASSWORD_HASH_TIMEOUT): 503."""
+
+
+class LoginBusy(Exception):
+    """Logins simultâneos demais do mesmo IP ou email: 429."""
+
+
+# Funções executadas nos processos do pool (precisam ser importáveis pelo nome)
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+class PasswordHasher:
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, max_queue=PASSWORD_HASH_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.counters = {'verified': 0, 'hashed': 0, 'rehashed': 0, 'rejected': 0,
+                         'max_queue_depth': 0, 'compute_ms': 0.0}
+
+    def _get_executor(self):
+        # Criado no primeiro uso: quem só importa o módulo não sobe processos.
+        # 'spawn' porque o servidor tem threads (fork copiaria locks presos)
+        if self._executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            import multiprocessing
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def queue_depth(self):
+        return max(0, self._in_flight - self.workers)
+
+    def _run(self, fn, *args, counter, background=False):
+        with self._lock:
+            if self.workers and self._in_flight - self.workers >= self.max_queue:
+                self.counters['rejected'] += 1
+                raise PasswordHasherBusy('Muitos logins ao mesmo tempo, tente novamente')
+            self._in_flight += 1
+            self.counters['max_queue_depth'] = max(self.counters['max_queue_depth'], self.queue_depth())
+            if self.workers and self._executor is None:
+                self._get_executor()
+        started = time.perf_counter()
+
+        def finished():
+            with self._lock:
+                self._in_flight -= 1
+                self.counters[counter] += 1
+                self.counters['compute_ms'] += (time.perf_counter() - started) * 1000
+
+        if not self.workers:
+            try:
+                return fn(*args)
+            finally:
+                finished()
+
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: finished())
+        if background:
+            return future
+        try:
+            return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+        except FutureTimeoutError:
+            raise PasswordHasherBusy('Verificação de senha demorou demais, tente novamente')
+
+    def check(self, password, stored):
+        """Senha confere com o hash bcrypt (ou com a senha em texto plano dos cadastros antigos)?"""
+        if not password or not stored:
+            return False
+        if not stored.startswith('$2'):
+            return password == stored
+        return self._run(_checkpw, password.encode('utf-8'), stored.encode('utf-8'), counter='verified')
+
+    def hash(self, password, rounds=None):
+        hashed = self._run(_hashpw, password.encode('utf-8'), rounds or BCRYPT_ROUNDS, counter='hashed')
+        return hashed.decode('utf-8')
+
+    def rehash_later(self, password, table, user_id, stored):
+        """
+        Após login correto: grava a senha com BCRYPT_ROUNDS se BCRYPT_REHASH estiver
+        ligado e o hash atual precisar. Não bloqueia a resposta; pulado com fila no pool.
+        """
+        if not BCRYPT_REHASH or not needs_rehash(stored):
+            return
+        with self._lock:
+            if self._in_flight >= max(self.workers, 1):
+                return  # Pool ocupado: fica para um próximo login
+        try:
+            future = self._run(_hashpw, password.encode('utf-8'), BCRYPT_ROUNDS,
+                               counter='rehashed', background=True)
+        except PasswordHasherBusy:
+            return
+
+        def save(hashed):
+            from database import system_write
+            # "AND password = ?": não sobrescreve troca de senha feita nesse meio tempo
+            system_write(f'UPDATE {table} SET password = ? WHERE id = ? AND password = ?',
+                         (hashed.decode('utf-8'), user_id, stored), wait=False)
+
+        def on_done(f):
+            if f.exception() is None:
+                save(f.result())
+
+        if self.workers:
+            future.add_done_callback(on_done)
+        else:
+            save(future)  # Sem pool, _run já devolveu o hash
+
+    def stats(self):
+        with self._lock:
+            done = self.counters['verified'] + self.counters['hashed'] + self.counters['rehashed']
+            return {
+                'workers': self.workers,
+                'in_flight': self._in_flight,
+                'queue_depth': self.queue_depth(),
+                'avg_ms': round(self.counters['compute_ms'] / done, 1) if done else None,
+                **{k: v for k, v in self.counters.items() if k != 'compute_ms'},
+                'logins': login_limiter.stats(),
+            }
+
+
+def needs_rehash(stored):
+    """Texto plano ou bcrypt com custo diferente de BCRYPT_ROUNDS ('$2b$12$...')."""
+    if not stored or not stored.startswith('$2'):
+        return True
+    parts = stored.split('$')
+    return len(parts) < 4 or not parts[2].isdigit() or int(parts[2]) != BCRYPT_ROUNDS
+
+
+class LoginLimiter:
+    """Logins em andamento por IP e por email."""
+
+    def __init__(self, max_per_ip=LOGIN_MAX_PER_IP, max_per_email=LOGIN_MAX_PER_EMAIL):
+        self.max_per_ip = max_per_ip
+        self.max_per_email = max_per_email
+        self._lock = threading.Lock()
+        self._active = {}  # ('ip', x) / ('email', x) -> logins em andamento
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self, ip, email):
+        keys = [('ip', ip), ('email', (email or '').strip().lower())]
+        limits = [self.max_per_ip, self.max_per_email]
+        with self._lock:
+            if any(self._active.get(key, 0) >= limit for key, limit in zip(keys, limits)):
+                self.rejected += 1
+                raise LoginBusy('Muitas tentativas de login simultâneas, aguarde')
+            for key in keys:
+                self._active[key] = self._active.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for key in keys:
+                    self._active[key] -= 1
+                    if not self._active[key]:
+                        del self._active[key]
+
+    def stats(self):
+        with self._lock:
+            return {'active': sum(n for (kind, _), n in self._active.items() if kind == 'ip'),
+                    'rejected': self.rejected}
+
+
+password_hasher = PasswordHasher()
+login_limiter = LoginLimiter()
+
+
+def check_password(password, stored):
+    return password_hasher.check(password, stored)
+
+
+def hash_password(password, rounds=None):
+    return password_hasher.hash(password, rounds)
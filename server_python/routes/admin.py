@@ -1,5 +1,7 @@
 from flask import Blueprint, jsonify, request
 from database import get_system_db
+from guardian_index import index_remove_school
+from .list_query import list_response, SCHOOLS_LIST
 import sqlite3
 import random
 
@@ -23,20 +25,14 @@ def dashboard_stats():
 @admin_bp.route('/api/admin/schools', methods=['GET'])
 def get_schools():
     db = get_system_db()
-    rows = db.execute('SELECT * FROM schools').fetchall()
-    # Safely convert rows to dicts
-    result = []
-    for r in rows:
-        d = dict(r)
-        if 'password' in d: del d['password']
-        result.append(d)
-    return jsonify(result)
+    return list_response(db, SCHOOLS_LIST)
 
 @admin_bp.route('/api/admin/schools/<int:id>', methods=['DELETE'])
 def delete_school(id):
     db = get_system_db()
     db.execute('DELETE FROM schools WHERE id = ?', (id,))
     db.commit()
+    index_remove_school(db, id)
     return jsonify({'success': True})
 
 @admin_bp.route('/api/admin/representatives', methods=['GET'])
@@ -3,6 +3,18 @@ Helper functions for affiliate school access control
 """
 from flask import g, request
 from database import get_system_db
+from app_logging import get_logger
+
+log = get_logger('affiliates')
+
+# Vínculo ativo entre duas escolas, nos dois sentidos (também conferido por check_query_plans.py)
+# Parâmetros: (escola_a, escola_b, escola_b, escola_a)
+AFFILIATION_CHECK_SQL = '''
+    SELECT id FROM school_affiliates
+    WHERE ((parent_school_id = ? AND affiliate_school_id = ?)
+       OR (parent_school_id = ? AND affiliate_school_id = ?))
+       AND status = 'active'
+'''
 
 def get_accessible_school_id():
     """
@@ -16,7 +28,7 @@ def get_accessible_school_id():
     # Check if a different school_id is requested
     requested_school_id = request.args.get('school_id', type=int)
     
-    print(f"DEBUG ACCESS: UserSchool={user_school_id}, Requested={requested_school_id}")
+    log.debug('acesso a escola', extra={'user_school_id': user_school_id, 'requested_school_id': requested_school_id})
     
     if not requested_school_id or requested_school_id == user_school_id:
         return user_school_id
@@ -25,17 +37,12 @@ def get_accessible_school_id():
     db = get_system_db()
     cur = db.cursor()
     
-    cur.execute('''
-        SELECT id FROM school_affiliates
-        WHERE ((parent_school_id = ? AND affiliate_school_id = ?)
-           OR (parent_school_id = ? AND affiliate_school_id = ?))
-           AND status = 'active'
-    ''', (user_school_id, requested_school_id, requested_school_id, user_school_id))
+    cur.execute(AFFILIATION_CHECK_SQL, (user_school_id, requested_school_id, requested_school_id, user_school_id))
     
     if cur.fetchone():
         return requested_school_id
     
     # Raise error to prevent showing wrong data
-    print(f"DEBUG ACCESS DENIED: User {user_school_id} tried to access {requested_school_id}")
+    log.warning('acesso a escola negado', extra={'user_school_id': user_school_id, 'requested_school_id': requested_school_id})
     from werkzeug.exceptions import Forbidden
     raise Forbidden(f"School {user_school_id} does not have access to School {requested_school_id}")
@@ -1,11 +1,28 @@
 from flask import Blueprint, request, jsonify, g
 from database import get_system_db
 from routes.auth import token_required
+from routes.affiliate_helpers import AFFILIATION_CHECK_SQL
 import secrets
 import string
 
 affiliates_bp = Blueprint('affiliates', __name__, url_prefix='/api/school/affiliates')
 
+# Filiais e matrizes da escola (também conferidas por check_query_plans.py)
+AFFILIATES_AS_PARENT_SQL = '''
+    SELECT sa.id, sa.affiliate_school_id as school_id, s.name, s.email, s.address,
+           'filial' as relationship, sa.created_at
+    FROM school_affiliates sa
+    JOIN schools s ON s.id = sa.affiliate_school_id
+    WHERE sa.parent_school_id = ? AND sa.status = 'active'
+'''
+AFFILIATES_AS_AFFILIATE_SQL = '''
+    SELECT sa.id, sa.parent_school_id as school_id, s.name, s.email, s.address,
+           'matriz' as relationship, sa.created_at
+    FROM school_affiliates sa
+    JOIN schools s ON s.id = sa.parent_school_id
+    WHERE sa.affiliate_school_id = ? AND sa.status = 'active'
+'''
+
 def generate_token(length=12):
     """Generate a secure random token for school affiliation"""
     # Updated: 2026-01-10 13:28
@@ -85,12 +102,8 @@ def join_as_affiliate():
             }), 400
         
         # Check if already affiliated
-        cur.execute('''
-            SELECT id FROM school_affiliates
-            WHERE ((parent_school_id = ? AND affiliate_school_id = ?)
-               OR (parent_school_id = ? AND affiliate_school_id = ?))
-               AND status = 'active'
-        ''', (school_id, affiliate['parent_school_id'], affiliate['parent_school_id'], school_id))
+        cur.execute(AFFILIATION_CHECK_SQL,
+                    (school_id, affiliate['parent_school_id'], affiliate['parent_school_id'], school_id))
         
         existing = cur.fetchone()
         if existing:
@@ -133,36 +146,12 @@ def list_affiliates():
         cur = db.cursor()
         
         # Get schools where current school is parent
-        cur.execute('''
-            SELECT 
-                sa.id,
-                sa.affiliate_school_id as school_id,
-                s.name,
-                s.email,
-                s.address,
-                'filial' as relationship,
-                sa.created_at
-            FROM school_affiliates sa
-            JOIN schools s ON s.id = sa.affiliate_school_id
-            WHERE sa.parent_school_id = ? AND sa.status = 'active'
-        ''', (school_id,))
+        cur.execute(AFFILIATES_AS_PARENT_SQL, (school_id,))
         
         as_parent = [dict(row) for row in cur.fetchall()]
         
         # Get schools where current school is affiliate
-        cur.execute('''
-            SELECT 
-                sa.id,
-                sa.parent_school_id as school_id,
-                s.name,
-                s.email,
-                s.address,
-                'matriz' as relationship,
-                sa.created_at
-            FROM school_affiliates sa
-            JOIN schools s ON s.id = sa.parent_school_id
-            WHERE sa.affiliate_school_id = ? AND sa.status = 'active'
-        ''', (school_id,))
+        cur.execute(AFFILIATES_AS_AFFILIATE_SQL, (school_id,))
         
         as_affiliate = [dict(row) for row in cur.fetchall()]
         
@@ -219,12 +208,7 @@ def switch_school_context(school_id):
         cur = db.cursor()
         
         # Verify affiliation
-        cur.execute('''
-            SELECT id FROM school_affiliates
-            WHERE ((parent_school_id = ? AND affiliate_school_id = ?)
-               OR (parent_school_id = ? AND affiliate_school_id = ?))
-               AND status = 'active'
-        ''', (current_school_id, school_id, school_id, current_school_id))
+        cur.execute(AFFILIATION_CHECK_SQL, (current_school_id, school_id, school_id, current_school_id))
         
         if not cur.fetchone() and current_school_id != school_id:
             return jsonify({'success': False, 'message': 'Acesso negado'}), 403
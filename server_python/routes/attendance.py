@@ -1,10 +1,88 @@
 from flask import Blueprint, request, jsonify, g
 from .auth import token_required
-from database import get_system_db, get_school_db
+from database import get_system_db, get_school_db, wall_clock_epoch, ts_epoch_sql
+from notification_dispatcher import dispatcher
+import attendance_rollup
+import os
 import datetime
 
 attendance_bp = Blueprint('attendance', __name__)
 
+# Janela em que um novo registro do mesmo tipo para o aluno é ignorado
+# (câmera reconhecendo o mesmo aluno em vários frames). 0 desativa.
+ATTENDANCE_DEBOUNCE_MINUTES = float(os.environ.get('ATTENDANCE_DEBOUNCE_MINUTES', '5'))
+
+# Máximo de registros por chamada de /api/attendance/batch
+ATTENDANCE_BATCH_MAX = int(os.environ.get('ATTENDANCE_BATCH_MAX', '500'))
+ATTENDANCE_TYPES = ('arrival', 'departure')
+
+# {ts_epoch}: database.ts_epoch_sql (a coluna, ou COALESCE enquanto o backfill está pendente)
+RECENT_ATTENDANCE_SQL = '''
+    SELECT timestamp FROM attendance
+    WHERE student_id = ? AND type = ? AND {ts_epoch} >= ?
+    ORDER BY {ts_epoch} DESC LIMIT 1
+'''
+
+def find_recent_attendance(cur, student_id, event_type, now):
+    """
+    Registro do mesmo tipo dentro da janela de debounce (usa idx_attendance_student_type_ts_epoch).
+    Por ts_epoch: timestamp em texto mistura 'T' e espaço entre data e hora.
+    """
+    if ATTENDANCE_DEBOUNCE_MINUTES <= 0:
+        return None
+    cutoff = wall_clock_epoch(now) - int(ATTENDANCE_DEBOUNCE_MINUTES * 60)
+    cur.execute(RECENT_ATTENDANCE_SQL.format(ts_epoch=ts_epoch_sql(cur.connection)),
+                (student_id, event_type, cutoff))
+    return cur.fetchone()
+
+def record_attendance(db, student, event_type, now):
+    """
+    Checagem de debounce e inserts numa só transação (BEGIN IMMEDIATE): duas
+    requisições simultâneas do mesmo aluno não passam as duas pela checagem.
+    Retorna (registro recente, None) se duplicado, senão (None, id do access_log).
+    """
+    cur = db.cursor()
+    cur.execute('BEGIN IMMEDIATE')
+    try:
+        recent = find_recent_attendance(cur, student['id'], event_type, now)
+        if recent:
+            db.rollback()
+            return recent, None
+
+        timestamp = now.isoformat()
+        cur.execute('''
+            INSERT INTO attendance (student_id, timestamp, type, ts_epoch)
+            VALUES (?, ?, ?, ?)
+        ''', (student['id'], timestamp, event_type, wall_clock_epoch(now)))
+        attendance_rollup.record_event(cur, student['id'], student['class_name'], event_type, timestamp)
+
+        # Log de acesso (para notificações do app do responsável)
+        cur.execute('''
+            INSERT INTO access_logs (student_id, event_type, timestamp, notified_guardian, ts_epoch)
+            VALUES (?, ?, ?, 0, ?)
+        ''', (student['id'], event_type, timestamp, wall_clock_epoch(now)))
+        log_id = cur.lastrowid
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return None, log_id
+
+def inserted_ids(cur, table, count):
+    """
+    Ids das últimas count linhas inseridas em table, na ordem de inserção. Só vale
+    dentro de BEGIN IMMEDIATE: com a trava de escrita, os maiores ids são os do lote.
+    """
+    cur.execute(f'SELECT id FROM {table} ORDER BY id DESC LIMIT ?', (count,))
+    return [row[0] for row in reversed(cur.fetchall())]
+
+def publish_access_log(school_id, student, log_id, event_type, timestamp):
+    """Avisa os responsáveis sobre um novo registro em access_logs (SSE na hora, WhatsApp agrupado)."""
+    sys_db = get_system_db()
+    school = sys_db.execute('SELECT name FROM schools WHERE id = ?', (school_id,)).fetchone()
+    dispatcher.notify_student_event(sys_db, school_id, student, event_type, timestamp,
+                                    log_id=log_id, school_name=school['name'] if school else None)
+
 @attendance_bp.route('/api/attendance/arrival', methods=['POST'])
 @token_required
 def register_arrival():
@@ -25,20 +103,20 @@ def register_arrival():
     if not student:
         return jsonify({'message': 'Aluno não encontrado'}), 404
         
-    # 2. Registrar presença
-    timestamp = datetime.datetime.now().isoformat()
-    cur.execute('''
-        INSERT INTO attendance (student_id, timestamp, type)
-        VALUES (?, ?, 'arrival')
-    ''', (student_id, timestamp))
-    
-    # 3. Registrar Log de Acesso (para notificações do app do responsável)
-    cur.execute('''
-        INSERT INTO access_logs (student_id, event_type, timestamp, notified_guardian)
-        VALUES (?, 'arrival', ?, 0)
-    ''', (student_id, timestamp))
-    
-    db.commit()
+    # 2. Registrar presença (ignorando repetição dentro da janela de debounce)
+    now = datetime.datetime.now()
+    recent, log_id = record_attendance(db, student, 'arrival', now)
+    if recent:
+        return jsonify({
+            'success': True,
+            'duplicate': True,
+            'message': 'Presença já registrada',
+            'student': student['name'],
+            'timestamp': recent['timestamp']
+        })
+
+    timestamp = now.isoformat()
+    publish_access_log(school_id, student, log_id, 'arrival', timestamp)
     
     return jsonify({
         'success': True,
@@ -66,18 +144,19 @@ def register_departure():
     if not student:
         return jsonify({'message': 'Aluno não encontrado'}), 404
         
-    timestamp = datetime.datetime.now().isoformat()
-    cur.execute('''
-        INSERT INTO attendance (student_id, timestamp, type)
-        VALUES (?, ?, 'departure')
-    ''', (student_id, timestamp))
-    
-    cur.execute('''
-        INSERT INTO access_logs (student_id, event_type, timestamp, notified_guardian)
-        VALUES (?, 'departure', ?, 0)
-    ''', (student_id, timestamp))
-    
-    db.commit()
+    now = datetime.datetime.now()
+    recent, log_id = record_attendance(db, student, 'departure', now)
+    if recent:
+        return jsonify({
+            'success': True,
+            'duplicate': True,
+            'message': 'Saída já registrada',
+            'student': student['name'],
+            'timestamp': recent['timestamp']
+        })
+
+    timestamp = now.isoformat()
+    publish_access_log(school_id, student, log_id, 'departure', timestamp)
 
     return jsonify({
         'success': True,
@@ -99,3 +178,174 @@ def register_attendance_generic():
         return register_departure()
     
     return jsonify({'message': 'Evento inválido'}), 400
+
+def parse_batch_record(record, now):
+    """Valida um item do lote -> (event_id, student_id, type, timestamp) ou levanta ValueError."""
+    if not isinstance(record, dict):
+        raise ValueError('Registro inválido')
+    event_type = record.get('type') or record.get('event_type')
+    if event_type not in ATTENDANCE_TYPES:
+        raise ValueError('Tipo inválido (arrival ou departure)')
+    try:
+        student_id = int(record.get('student_id'))
+    except (TypeError, ValueError):
+        raise ValueError('student_id inválido')
+
+    timestamp = now
+    if record.get('timestamp'):
+        try:
+            timestamp = datetime.datetime.fromisoformat(str(record['timestamp']).replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError('timestamp inválido')
+        if timestamp.tzinfo:
+            # Banco guarda horário local sem fuso, como datetime.now().isoformat()
+            timestamp = timestamp.astimezone().replace(tzinfo=None)
+
+    event_id = record.get('event_id')
+    return (str(event_id) if event_id else None), student_id, event_type, timestamp
+
+@attendance_bp.route('/api/attendance/batch', methods=['POST'])
+@token_required
+def register_attendance_batch():
+    """
+    Vários registros de chegada/saída numa única transação.
+    Body: {"records": [{"event_id", "student_id", "type", "timestamp"}, ...]}
+    event_id (opcional, gerado pelo cliente) torna o reenvio idempotente: um
+    evento já gravado volta como 'duplicate' com o registro original.
+    """
+    school_id = g.user.get('school_id') or g.user.get('id')
+    if not school_id:
+        return jsonify({'message': 'Escola não identificada'}), 400
+
+    records = (request.json or {}).get('records')
+    if not isinstance(records, list) or not records:
+        return jsonify({'message': 'Nenhum registro enviado'}), 400
+    if len(records) > ATTENDANCE_BATCH_MAX:
+        return jsonify({'message': f'Máximo de {ATTENDANCE_BATCH_MAX} registros por lote'}), 400
+
+    now = datetime.datetime.now()
+    results = [None] * len(records)
+    parsed = []  # (index, event_id, student_id, type, timestamp)
+    for i, record in enumerate(records):
+        try:
+            parsed.append((i, *parse_batch_record(record, now)))
+        except ValueError as e:
+            results[i] = {'index': i, 'status': 'error', 'error': str(e)}
+
+    db = get_school_db(school_id)
+    cur = db.cursor()
+    created = []  # (index, student, type, timestamp)
+    try:
+        # Trava de escrita desde já: checagens e inserts veem o mesmo estado
+        cur.execute('BEGIN IMMEDIATE')
+
+        student_ids = sorted({p[2] for p in parsed})
+        students = {}
+        if student_ids:
+            placeholders = ','.join('?' * len(student_ids))
+            cur.execute(f'SELECT id, name, class_name FROM students WHERE id IN ({placeholders})', student_ids)
+            students = {row['id']: row for row in cur.fetchall()}
+
+        event_ids = sorted({p[1] for p in parsed if p[1]})
+        existing = {}
+        if event_ids:
+            placeholders = ','.join('?' * len(event_ids))
+            cur.execute(f'SELECT id, event_id, student_id, type, timestamp FROM attendance WHERE event_id IN ({placeholders})',
+                        event_ids)
+            existing = {row['event_id']: row for row in cur.fetchall()}
+
+        # Último registro (ts_epoch, timestamp) de cada aluno/tipo dentro da janela de debounce
+        debounce_seconds = int(ATTENDANCE_DEBOUNCE_MINUTES * 60)
+        last_seen = {}
+        if ATTENDANCE_DEBOUNCE_MINUTES > 0 and parsed:
+            cutoff = wall_clock_epoch(min(p[4] for p in parsed)) - debounce_seconds
+            placeholders = ','.join('?' * len(student_ids))
+            ts_epoch = ts_epoch_sql(db)
+            cur.execute(f'''
+                SELECT student_id, type, MAX({ts_epoch}) AS ts_epoch, timestamp FROM attendance
+                WHERE student_id IN ({placeholders}) AND {ts_epoch} >= ?
+                GROUP BY student_id, type
+            ''', (*student_ids, cutoff))
+            # timestamp vem da linha com o MAX(ts_epoch) (coluna solta do SQLite)
+            last_seen = {(row['student_id'], row['type']): (row['ts_epoch'], row['timestamp'])
+                         for row in cur.fetchall()}
+
+        to_insert = []
+        batch_events = {}  # {event_id: resultado criado neste lote}
+        in_batch = []      # (resultado duplicado, resultado original) do mesmo event_id
+        for i, event_id, student_id, event_type, timestamp in sorted(parsed, key=lambda p: p[4]):
+            result = {'index': i, 'event_id': event_id, 'student_id': student_id}
+            results[i] = result
+
+            if event_id in existing:
+                row = existing[event_id]
+                result.update({'status': 'duplicate', 'attendance_id': row['id'], 'timestamp': row['timestamp']})
+                continue
+            if event_id in batch_events:
+                # Mesmo event_id repetido dentro do lote
+                original = batch_events[event_id]
+                result.update({'status': 'duplicate', 'timestamp': original['timestamp']})
+                in_batch.append((result, original))
+                continue
+            student = students.get(student_id)
+            if not student:
+                result.update({'status': 'error', 'error': 'Aluno não encontrado'})
+                continue
+
+            epoch = wall_clock_epoch(timestamp)
+            last = last_seen.get((student_id, event_type))
+            if last and debounce_seconds > 0 and 0 <= epoch - last[0] < debounce_seconds:
+                result.update({'status': 'duplicate', 'timestamp': last[1]})
+                continue
+
+            if not last or epoch >= last[0]:
+                last_seen[(student_id, event_type)] = (epoch, timestamp.isoformat())
+            if event_id:
+                batch_events[event_id] = result
+            result.update({'status': 'created', 'student': student['name'], 'timestamp': timestamp.isoformat()})
+            to_insert.append((result, student, event_type, timestamp.isoformat(), event_id))
+
+        # Lote inteiro com executemany; os ids são lidos de volta logo depois
+        if to_insert:
+            rows = [(student['id'], event_type, ts, event_id, wall_clock_epoch(ts))
+                    for _, student, event_type, ts, event_id in to_insert]
+            cur.executemany('''
+                INSERT INTO attendance (student_id, type, timestamp, event_id, ts_epoch)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            attendance_ids = inserted_ids(cur, 'attendance', len(rows))
+            cur.executemany('''
+                INSERT INTO access_logs (student_id, event_type, timestamp, notified_guardian, ts_epoch)
+                VALUES (?, ?, ?, 0, ?)
+            ''', [(student_id, event_type, ts, epoch) for student_id, event_type, ts, _, epoch in rows])
+            log_ids = inserted_ids(cur, 'access_logs', len(rows))
+            # Resumo diário na mesma transação
+            attendance_rollup.record_events(cur, [(student['id'], student['class_name'], event_type, ts)
+                                                  for _, student, event_type, ts, _ in to_insert])
+            for (result, student, event_type, ts, _), attendance_id, log_id in zip(to_insert, attendance_ids, log_ids):
+                result['attendance_id'] = attendance_id
+                created.append((log_id, student, event_type, ts))
+        for result, original in in_batch:
+            result['attendance_id'] = original['attendance_id']
+
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Erro no lote de presença: {e}")
+        return jsonify({'message': 'Erro ao gravar lote', 'error': str(e)}), 500
+
+    if created:
+        sys_db = get_system_db()
+        school = sys_db.execute('SELECT name FROM schools WHERE id = ?', (school_id,)).fetchone()
+        for log_id, student, event_type, ts in created:
+            dispatcher.notify_student_event(sys_db, school_id, student, event_type, ts,
+                                            log_id=log_id, school_name=school['name'] if school else None)
+
+    statuses = [r['status'] for r in results]
+    return jsonify({
+        'success': True,
+        'created': statuses.count('created'),
+        'duplicates': statuses.count('duplicate'),
+        'errors': statuses.count('error'),
+        'results': results
+    })
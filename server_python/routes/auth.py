@@ -1,88 +1,78 @@
 from flask import Blueprint, request, jsonify, g
-import bcrypt
+from functools import wraps
+from collections import OrderedDict
+import threading
+import hashlib
 import jwt
 import datetime
+import time
 import os
 
 auth_bp = Blueprint('auth', __name__)
 SECRET_KEY = os.environ.get('SECRET_KEY', 'edufocus-secret-key-123')
 
+# Proxies reversos na frente do app (Render: 1); o IP do cliente é o último
+# X-Forwarded-For que eles acrescentaram. 0 = usar o endereço da conexão
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
+
+# Cache (LRU) dos claims de tokens já verificados, pelo hash do token
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '4096'))
+TOKEN_CACHE_MAX_AGE = int(os.environ.get('TOKEN_CACHE_MAX_AGE', '3600'))  # segundos, mesmo com exp maior
+
 from database import get_system_db
+from app_logging import get_logger
+from password_hasher import password_hasher, login_limiter, hash_password, PasswordHasherBusy
+import user_credentials
+
+log = get_logger('auth')
+
+def client_ip():
+    if TRUSTED_PROXY_HOPS and len(request.access_route) >= TRUSTED_PROXY_HOPS:
+        return request.access_route[-TRUSTED_PROXY_HOPS]
+    return request.remote_addr
+
+def login_slot(f):
+    """Limita logins simultâneos por IP e por email (password_hasher.LoginLimiter); acima do limite, 429."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        email = (request.get_json(silent=True) or {}).get('email')
+        with login_limiter.slot(client_ip(), email):
+            return f(*args, **kwargs)
+    return decorated
 
 @auth_bp.route('/api/login', methods=['POST'])
+@login_slot
 def login():
     data = request.json
     email = data.get('email')
     password = data.get('password')
-    print(f"🔒 Login attempt for: {email}")
     
     db = get_system_db()
     
-    # Check roles strictly in order
-    user = None
-    role = None
+    # Uma busca no índice de login (user_credentials.py), na ordem de prioridade
+    # super_admin > escola > professor > inspetor > responsável
+    user, role, table = user_credentials.load_user(db, email)
     
-    # 1. Super Admin
-    cur = db.cursor()
-    cur.execute('SELECT * FROM super_admins WHERE email = ?', (email,))
-    user = cur.fetchone()
-    if user:
-        role = 'super_admin'
-    
-    # 2. School
-    if not user:
-        cur.execute('SELECT * FROM schools WHERE email = ?', (email,))
-        user = cur.fetchone()
-        if user:
-            role = 'school_admin'
-            
-    # 3. Teacher
-    if not user:
-        cur.execute('SELECT * FROM teachers WHERE email = ?', (email,))
-        user = cur.fetchone()
-        if user:
-            role = 'teacher'
-            
-    # 4. Inspector
-    if not user:
-        cur.execute('SELECT * FROM inspectors WHERE email = ?', (email,))
-        user = cur.fetchone()
-        if user:
-            role = 'inspector'
-
-    # 5. Guardian (or Employee via guardian table)
-    if not user:
-        cur.execute('SELECT * FROM guardians WHERE email = ?', (email,))
-        user = cur.fetchone()
-        if user:
-            # Check if role column exists and uses it, otherwise default to guardian
-            if 'role' in user.keys() and user['role']:
-                role = user['role']
-            else:
-                role = 'guardian'
-            
     if not user:
+        log.info('login: usuário não encontrado', extra={'email': email})
         return jsonify({'message': 'Usuário não encontrado'}), 400
         
     # Verify password
     # Em produção, senhas devem estar hasheadas.
     # O user atual pode ter senhas em texto plano ou hash. 
     # O Node usava bcryptjs. Python usa bcrypt. O formato do hash é compatível ($2a$ ou $2b$).
+    # A verificação roda no pool de password_hasher, fora desta thread.
+    stored_password = user['password']
     try:
-        stored_password = user['password']
-        if stored_password.startswith('$2'):
-            if bcrypt.checkpw(password.encode('utf-8'), stored_password.encode('utf-8')):
-                valid = True
-            else:
-                valid = False
-        else:
-            # Fallback para texto plano (dev/testes antigos)
-            valid = (password == stored_password)
+        valid = password_hasher.check(password, stored_password)
+    except PasswordHasherBusy:
+        raise
     except Exception as e:
-        print(f"Erro ao verificar senha: {e}")
+        log.error('login: erro ao verificar senha', extra={'email': email, 'error': str(e)})
         valid = False
 
     if not valid:
+        log.info('login: senha inválida', extra={'email': email, 'role': role})
         return jsonify({'message': 'Senha inválida'}), 400
         
     # Generate Token
@@ -95,6 +85,8 @@ def login():
     }
     
     token = jwt.encode(token_payload, SECRET_KEY, algorithm='HS256')
+    log.info('login ok', extra={'email': email, 'role': role})
+    password_hasher.rehash_later(password, table, user['id'], stored_password)
     
     # Return user data (converter row para dict)
     user_dict = dict(user)
@@ -113,7 +105,7 @@ def register_school():
     
     # Hash password
     password = data.get('password')
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed = hash_password(password)
     
     try:
         cur = db.cursor()
@@ -139,7 +131,7 @@ def register_teacher():
     
     # Hash password
     password = data.get('password')
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed = hash_password(password)
     
     try:
         cur = db.cursor()
@@ -158,8 +150,36 @@ def register_teacher():
         print(f"Erro ao registrar professor: {e}")
         return jsonify({'message': 'Erro ao registrar professor. Email já existe?'}), 400
 
+_token_cache = OrderedDict()  # sha256(token) -> (claims, válido até)
+_token_cache_lock = threading.Lock()
+
+def decode_token(token):
+    """
+    Valida o JWT e retorna o payload (lança jwt.ExpiredSignatureError / jwt.InvalidTokenError).
+    Tokens válidos ficam em cache até o exp (no máximo TOKEN_CACHE_MAX_AGE),
+    então as requisições seguintes não refazem a verificação da assinatura.
+    """
+    key = hashlib.sha256(token.encode('utf-8')).digest()
+    now = time.time()
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+        if cached is not None:
+            if cached[1] > now:
+                _token_cache.move_to_end(key)
+                return dict(cached[0])
+            del _token_cache[key]
+
+    data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+
+    expires_at = min(data.get('exp') or now + TOKEN_CACHE_MAX_AGE, now + TOKEN_CACHE_MAX_AGE)
+    with _token_cache_lock:
+        _token_cache[key] = (dict(data), expires_at)
+        _token_cache.move_to_end(key)
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return data
+
 # Middleware check (decorator)
-from functools import wraps
 
 def token_required(f):
     @wraps(f)
@@ -171,23 +191,20 @@ def token_required(f):
                 token = auth_header.split(" ")[1]
         
         if not token:
-            print(f"❌ Token ausente na requisição")
+            log.debug('token ausente', extra={'path': request.path})
             return jsonify({'message': 'Token ausente'}), 401
             
         try:
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            g.user = data
-            print(f"✅ Token válido para usuário: {data.get('email', 'unknown')}")
+            g.user = decode_token(token)
         except jwt.ExpiredSignatureError:
-            print(f"❌ Token expirado")
+            log.debug('token expirado', extra={'path': request.path})
             return jsonify({'message': 'Token expirado. Faça login novamente.'}), 403
         except jwt.InvalidTokenError as e:
-            print(f"❌ Token inválido: {str(e)}")
+            log.warning('token inválido', extra={'path': request.path, 'error': str(e)})
             return jsonify({'message': 'Token inválido'}), 403
         except Exception as e:
-            print(f"❌ Erro ao validar token: {str(e)}")
+            log.error('erro ao validar token', extra={'path': request.path, 'error': str(e)})
             return jsonify({'message': 'Token inválido'}), 403
             
         return f(*args, **kwargs)
     return decorated
-
@@ -0,0 +1,99 @@
+from flask import Blueprint, request, jsonify, send_file
+from .auth import token_required, decode_token, SECRET_KEY
+import blob_store
+import hashlib
+import hmac
+import time
+import os
+
+blobs_bp = Blueprint('blobs', __name__)
+
+# Um ano: a URL inclui o hash do conteúdo, então nunca fica desatualizada.
+# 'private': são fotos de alunos, proxies/CDNs compartilhados não guardam
+BLOB_MAX_AGE = 365 * 24 * 3600
+# Validade das URLs assinadas (para <img src>, que não manda o header Authorization)
+BLOB_URL_TTL = int(os.environ.get('BLOB_URL_TTL', '3600'))
+
+
+def _blob_signature(name, expires):
+    return hmac.new(SECRET_KEY.encode('utf-8'), f'{name}:{expires}'.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def sign_blob_url(url, ttl=BLOB_URL_TTL):
+    """'/api/blobs/<nome>' -> mesma URL com ?exp=&sig=, válida por ttl segundos."""
+    name = url.rsplit('/', 1)[-1]
+    expires = int(time.time()) + ttl
+    return f'{url}?exp={expires}&sig={_blob_signature(name, expires)}'
+
+
+def sign_photo_url(value):
+    """photo_url gravado (/api/blobs/<nome>) -> URL assinada; outros valores passam direto."""
+    if isinstance(value, str) and value.startswith(blob_store.BLOB_URL_PREFIX) and '?' not in value:
+        return sign_blob_url(value)
+    return value
+
+
+def sign_photo_fields(item):
+    """Assina no lugar os campos photo_url do dict (respostas lidas pelo <img src> do cliente)."""
+    if 'photo_url' in item:
+        item['photo_url'] = sign_photo_url(item['photo_url'])
+    return item
+
+
+def blob_request_authorized(name):
+    """URL assinada e dentro da validade, ou token JWT (header Authorization ou ?token=)."""
+    sig = request.args.get('sig')
+    expires = request.args.get('exp', type=int)
+    if sig and expires:
+        return expires >= time.time() and hmac.compare_digest(sig, _blob_signature(name, expires))
+
+    token = request.args.get('token')
+    auth_header = request.headers.get('Authorization', '')
+    if not token and auth_header.startswith('Bearer '):
+        token = auth_header.split(' ')[1]
+    if not token:
+        return False
+    try:
+        decode_token(token)
+        return True
+    except Exception:
+        return False
+
+
+@blobs_bp.route('/api/blobs/<name>', methods=['GET'])
+def get_blob(name):
+    if not blob_request_authorized(name):
+        return jsonify({'error': 'Não autorizado'}), 401
+    found = blob_store.resolve(name, request.args.get('size', type=int))
+    if not found:
+        return jsonify({'error': 'Arquivo não encontrado'}), 404
+    path, mimetype = found
+
+    response = send_file(path, mimetype=mimetype, max_age=BLOB_MAX_AGE, conditional=True, etag=True)
+    response.headers['Cache-Control'] = f'private, max-age={BLOB_MAX_AGE}, immutable'
+    return response
+
+@blobs_bp.route('/api/blobs', methods=['POST'])
+@token_required
+def upload_blob():
+    """Upload direto (multipart 'file' ou JSON {"data": "data:image/...;base64,..."}) -> {"url": ...}"""
+    try:
+        if 'file' in request.files:
+            url = blob_store.put(request.files['file'].read())
+        else:
+            data = blob_store.decode_inline_image((request.json or {}).get('data'))
+            if not data:
+                return jsonify({'error': 'Imagem inválida'}), 400
+            url = blob_store.put(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'url': url, 'signed_url': sign_blob_url(url),
+                    'thumbnails': {size: f'{url}?size={size}' for size in blob_store.THUMBNAIL_SIZES}})
+
+@blobs_bp.route('/api/blobs/<name>/signed-url', methods=['GET'])
+@token_required
+def get_signed_blob_url(name):
+    """URL assinada de um blob para usar em <img src> sem o token na URL."""
+    if not blob_store.resolve(name):
+        return jsonify({'error': 'Arquivo não encontrado'}), 404
+    return jsonify({'url': sign_blob_url(f'{blob_store.BLOB_URL_PREFIX}{name}'), 'expires_in': BLOB_URL_TTL})
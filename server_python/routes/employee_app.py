@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify, g
 from .auth import token_required
+from .blobs import sign_photo_fields
 from database import get_system_db, get_school_db
+import blob_store
 import sqlite3
 import json
 import datetime
@@ -18,7 +20,7 @@ def find_employee_by_guardian_id(guardian_id):
             # Verifica se tem coluna guardian_id (já fizemos migração)
             emp = s_db.execute('SELECT * FROM employees WHERE guardian_id = ?', (guardian_id,)).fetchone()
             if emp:
-                emp_dict = dict(emp)
+                emp_dict = sign_photo_fields(dict(emp))
                 emp_dict['school_id'] = school['id']
                 emp_dict['school_name'] = school['name']
                 emp_dict['school_lat'] = school['latitude']
@@ -63,7 +65,7 @@ def register_clock():
     type_ = data.get('type') # clock_in, lunch_out, lunch_return, clock_out
     lat = data.get('latitude')
     lng = data.get('longitude')
-    photo = data.get('photo') # Base64 da foto tirada na hora
+    photo = blob_store.store_photo(data.get('photo')) # Selfie da hora (base64) -> referência no blob store
     timestamp = datetime.datetime.now()
     
     db = get_school_db(school_id)
@@ -76,7 +78,7 @@ def register_clock():
         db.execute('''
             INSERT INTO employee_attendance (employee_id, type, timestamp, latitude, longitude, photo_url, verified)
             VALUES (?, ?, ?, ?, ?, ?, 1)
-        ''', (emp_id, type_, timestamp, lat, lng, photo)) # photo aqui salvando base64 direto? Melhor salvar URL mas tempo é curto. Vou salvar string 'base64...'
+        ''', (emp_id, type_, timestamp, lat, lng, photo))
         db.commit()
     except sqlite3.OperationalError:
         # Tabela não existe, criar
@@ -116,6 +118,6 @@ def get_history():
             ORDER BY timestamp DESC
             LIMIT 50
         ''', (employee['id'],)).fetchall()
-        return jsonify([dict(r) for r in rows])
+        return jsonify([sign_photo_fields(dict(r)) for r in rows])
     except:
         return jsonify([])
@@ -1,17 +1,46 @@
 from flask import Blueprint, request, jsonify, g, Response
-from .auth import token_required, SECRET_KEY
-from database import get_system_db, get_school_db, SYSTEM_DB_PATH
+from .auth import token_required, login_slot, decode_token, SECRET_KEY
+from database import get_system_db, get_school_db, connect, detach_db, school_write, backfill_pending, SYSTEM_DB_PATH
+from guardian_index import index_link, get_guardian_schools, get_guardian_students
+from notification_bus import notification_bus, notify_student_guardians
+from .list_query import list_response, CHAT_MESSAGES_LIST
+from .streaming import stream_response, response_format, ROWS
+from .blobs import sign_photo_fields
+from app_logging import get_logger
+from password_hasher import password_hasher, hash_password, PasswordHasherBusy
+import attendance_rollup
+import calendar
 import json
-import time
-import bcrypt
 import datetime
 import jwt
 import sqlite3
 
 guardian_bp = Blueprint('guardian', __name__)
+log = get_logger('guardian')
+
+# Filtro fixo da listagem do chat (também conferido por check_query_plans.py)
+GUARDIAN_CHAT_WHERE = 'student_id = ? AND school_id = ?'
+
+# Notificações ainda não entregues ao responsável (também conferidas por check_query_plans.py)
+GUARDIAN_NEXT_NOTIFICATION_SQL = '''
+    SELECT al.id, al.student_id, s.name as student_name, s.photo_url, al.event_type, al.timestamp
+    FROM access_logs al
+    JOIN students s ON al.student_id = s.id
+    JOIN student_guardians sg ON s.id = sg.student_id
+    WHERE sg.guardian_id = ? AND al.notified_guardian = 0
+    ORDER BY al.timestamp DESC LIMIT 1
+'''
+GUARDIAN_PENDING_NOTIFICATIONS_SQL = '''
+    SELECT al.id, al.student_id, s.name as student_name, al.event_type, al.timestamp
+    FROM access_logs al
+    JOIN students s ON al.student_id = s.id
+    JOIN student_guardians sg ON s.id = sg.student_id
+    WHERE sg.guardian_id = ? AND al.notified_guardian = 0
+'''
 
 @guardian_bp.route('/api/guardian/login', methods=['POST'])
 @guardian_bp.route('/api/guardian/auth/login', methods=['POST'])
+@login_slot
 def login():
     data = request.json
     email = data.get('email')
@@ -20,50 +49,33 @@ def login():
     db = get_system_db()
     cur = db.cursor()
     
-    # Debug: mostrar todos os guardians
-    all_guardians = cur.execute('SELECT id, email FROM guardians').fetchall()
-    print(f"🔍 Total de guardians no banco: {len(all_guardians)}")
-    for g in all_guardians:
-        print(f"   - ID {g['id']}: {g['email']}")
-    
     cur.execute('SELECT * FROM guardians WHERE email = ?', (email,))
     guardian = cur.fetchone()
     
     if not guardian:
-        print(f"❌ Guardian não encontrado: {email}")
+        log.info('login responsável: não encontrado', extra={'email': email})
         return jsonify({'success': False, 'message': 'Credenciais inválidas'}), 401
     
-    print(f"✅ Guardian encontrado: {guardian['email']}")
-    print(f"🔑 Hash armazenado: {guardian['password'][:50]}...")
-    
     valid = False
     try:
-        if guardian['password'].startswith('$2'):
-            print(f"🔐 Verificando com bcrypt...")
-            if bcrypt.checkpw(password.encode('utf-8'), guardian['password'].encode('utf-8')):
-                valid = True
-                print(f"✅ Senha bcrypt válida!")
-            else:
-                print(f"❌ Senha bcrypt inválida!")
-        else:
-            print(f"🔐 Verificando senha plain text...")
-            if password == guardian['password']:
-                valid = True
-                print(f"✅ Senha plain válida!")
-            else:
-                print(f"❌ Senha plain inválida!")
+        # bcrypt no pool de password_hasher (texto plano dos cadastros antigos compara direto)
+        valid = password_hasher.check(password, guardian['password'])
+    except PasswordHasherBusy:
+        raise
     except Exception as e:
-        print(f"❌ Erro na verificação: {e}")
+        log.error('login responsável: erro na verificação', extra={'email': email, 'error': str(e)})
         valid = False
         
     if not valid:
-        print(f"❌ Autenticação falhou para {email}")
+        log.info('login responsável: senha inválida', extra={'email': email})
         return jsonify({'success': False, 'message': 'Credenciais inválidas'}), 401
+    log.info('login responsável ok', extra={'email': email})
+    password_hasher.rehash_later(password, 'guardians', guardian['id'], guardian['password'])
         
     token = jwt.encode({
         'id': guardian['id'],
         'email': guardian['email'],
-        'role': guardian.get('role', 'guardian'),
+        'role': (guardian['role'] if 'role' in guardian.keys() else None) or 'guardian',
         'exp': datetime.datetime.utcnow() + datetime.timedelta(days=30)
     }, SECRET_KEY, algorithm='HS256')
     
@@ -101,7 +113,7 @@ def register():
         return jsonify({'success': False, 'message': 'Email já cadastrado'}), 409
         
     # Hash password
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed_password = hash_password(password)
     
     try:
         cur.execute('''
@@ -130,47 +142,74 @@ def register():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao cadastrar: {str(e)}'}), 500
 
-@guardian_bp.route('/api/guardian/students', methods=['GET'])
-@token_required
-def get_students():
-    guardian_id = g.user.get('id')
-    sys_db = get_system_db()
-    
-    schools_cur = sys_db.cursor()
-    # Adicionado latitude e longitude
-    schools_cur.execute('SELECT id, name, latitude, longitude FROM schools')
-    schools = schools_cur.fetchall()
-    
-    all_students = []
-    
+def iter_school_rows(schools, query, params, decorate, require_table=None):
+    """
+    Linhas de query em cada escola do responsável, passadas por decorate(dict, school).
+    Uma escola por vez e sem fetchall: a conexão é aberta e devolvida ao pool
+    durante o streaming. Escolas com erro (ou sem require_table) são puladas.
+    """
     for school in schools:
         school_db = None
         try:
             school_db = get_school_db(school['id'])
-            cur = school_db.cursor()
-            
-            cur.execute('''
-                SELECT s.id, s.name, s.photo_url, s.class_name, sg.linked_at
-                FROM students s
-                JOIN student_guardians sg ON s.id = sg.student_id
-                WHERE sg.guardian_id = ?
-            ''', (guardian_id,))
-            
-            rows = cur.fetchall()
-            for row in rows:
-                student_data = dict(row)
-                student_data['school_id'] = school['id']
-                student_data['school_name'] = school['name']
-                student_data['latitude'] = school['latitude']
-                student_data['longitude'] = school['longitude']
-                all_students.append(student_data)
-                
+            if require_table:
+                try:
+                    school_db.execute(f'SELECT 1 FROM {require_table} LIMIT 1')
+                except sqlite3.Error:
+                    continue  # Tabela não existe nesta escola
+            for row in school_db.execute(query, params):
+                yield decorate(dict(row), school)
         except Exception as e:
+            log.warning('erro ao ler escola', extra={'school_id': school['id'], 'error': str(e)})
             continue
         finally:
             if school_db: school_db.close()
-            
-    return jsonify({'success': True, 'data': {'students': all_students}})
+
+def stream_guardian_rows(rows, wrapper, close=()):
+    """Agregação em streaming: JSON no envelope de sempre, ou ?format=ndjson (só as linhas)."""
+    try:
+        fmt = response_format()
+    except ValueError as e:
+        for conn in close:
+            conn.close()
+        return jsonify({'error': str(e)}), 400
+    return stream_response(rows, fmt, wrapper=wrapper, close=close)
+
+def teacher_name_lookup(sys_db, default):
+    """Nome do professor por id, consultado uma vez por professor na resposta."""
+    names = {}
+    def lookup(teacher_id):
+        if not teacher_id:
+            return default
+        if teacher_id not in names:
+            t = sys_db.execute('SELECT name FROM teachers WHERE id = ?', (teacher_id,)).fetchone()
+            names[teacher_id] = t['name'] if t else 'Professor'
+        return names[teacher_id]
+    return lookup
+
+@guardian_bp.route('/api/guardian/students', methods=['GET'])
+@token_required
+def get_students():
+    guardian_id = g.user.get('id')
+    sys_db = get_system_db()
+    
+    # Apenas escolas onde o responsável tem alunos (índice no system.db)
+    schools = get_guardian_schools(sys_db, guardian_id)
+    
+    def decorate(student_data, school):
+        student_data['school_id'] = school['id']
+        student_data['school_name'] = school['name']
+        student_data['latitude'] = school['latitude']
+        student_data['longitude'] = school['longitude']
+        return student_data
+    
+    rows = iter_school_rows(schools, '''
+        SELECT s.id, s.name, s.photo_url, s.class_name, sg.linked_at
+        FROM students s
+        JOIN student_guardians sg ON s.id = sg.student_id
+        WHERE sg.guardian_id = ?
+    ''', (guardian_id,), decorate)
+    return stream_guardian_rows(rows, {'success': True, 'data': {'students': ROWS}})
 
 @guardian_bp.route('/api/guardian/pickup', methods=['POST'])
 @token_required
@@ -213,9 +252,7 @@ def check_notifications():
     guardian_id = g.user.get('id')
     sys_db = get_system_db()
     
-    schools_cur = sys_db.cursor()
-    schools_cur.execute('SELECT id, name FROM schools')
-    schools = schools_cur.fetchall()
+    schools = get_guardian_schools(sys_db, guardian_id)
     
     notification = None
     
@@ -226,24 +263,16 @@ def check_notifications():
             cur = school_db.cursor()
             
             # Buscar apenas notificações não lidas
-            cur.execute('''
-                SELECT al.id, al.student_id, s.name as student_name, s.photo_url, al.event_type, al.timestamp
-                FROM access_logs al
-                JOIN students s ON al.student_id = s.id
-                JOIN student_guardians sg ON s.id = sg.student_id
-                WHERE sg.guardian_id = ? AND al.notified_guardian = 0
-                ORDER BY al.timestamp DESC LIMIT 1
-            ''', (guardian_id,))
+            cur.execute(GUARDIAN_NEXT_NOTIFICATION_SQL, (guardian_id,))
             
             row = cur.fetchone()
             if row:
-                notification = dict(row)
+                notification = sign_photo_fields(dict(row))
                 notification['school_id'] = school['id']
                 notification['school_name'] = school['name']
                 
                 # Marcar como notificado
-                cur.execute('UPDATE access_logs SET notified_guardian = 1 WHERE id = ?', (notification['id'],))
-                school_db.commit()
+                school_write(school['id'], 'UPDATE access_logs SET notified_guardian = 1 WHERE id = ?', (notification['id'],))
                 break  # Retorna apenas uma notificação por vez
                 
         except Exception as e:
@@ -259,107 +288,170 @@ def get_notifications():
     guardian_id = g.user.get('id')
     sys_db = get_system_db()
     
-    schools_cur = sys_db.cursor()
-    schools_cur.execute('SELECT id, name FROM schools')
-    schools = schools_cur.fetchall()
+    schools = get_guardian_schools(sys_db, guardian_id)
+    
+    def decorate(n, school):
+        n['school_id'] = school['id']
+        n['school_name'] = school['name']
+        n['read'] = False
+        return n
+    
+    # Mostra histórico (sem filtro de notified_guardian)
+    rows = iter_school_rows(schools, '''
+        SELECT al.id, al.student_id, s.name as student_name, al.event_type, al.timestamp
+        FROM access_logs al
+        JOIN students s ON al.student_id = s.id
+        JOIN student_guardians sg ON s.id = sg.student_id
+        WHERE sg.guardian_id = ?
+        ORDER BY al.timestamp DESC LIMIT 20
+    ''', (guardian_id,), decorate)
+    return stream_guardian_rows(rows, {'success': True, 'data': {'notifications': ROWS}})
+
+# Intervalo do comentário keep-alive enviado pelas conexões SSE ociosas
+SSE_KEEPALIVE_SECONDS = 15
+
+def get_sse_guardian_id():
+    """Valida o token (query string ou header) das rotas SSE. Retorna (guardian_id, resposta_de_erro)."""
+    token = request.args.get('token')
+    if not token and 'Authorization' in request.headers:
+        token = request.headers['Authorization'].split(' ')[1]
+        
+    if not token:
+        return None, (jsonify({'message': 'Token missing'}), 401)
     
-    all_notifs = []
+    try:
+        data = decode_token(token)
+        return data['id'], None
+    except:
+        return None, (jsonify({'message': 'Invalid token'}), 403)
+
+def fetch_pending_notifications(guardian_id):
+    """
+    Busca os access_logs ainda não entregues ao responsável e os marca como notificados.
+    Usado ao abrir uma conexão SSE, para entregar o que chegou enquanto ele estava offline.
+    """
+    sys_db = connect(SYSTEM_DB_PATH)
+    sys_db.row_factory = sqlite3.Row
+    schools = get_guardian_schools(sys_db, guardian_id)
+    sys_db.close()
     
+    pending = []
     for school in schools:
         school_db = None
         try:
             school_db = get_school_db(school['id'])
-            cur = school_db.cursor()
+            rows = school_db.execute(GUARDIAN_PENDING_NOTIFICATIONS_SQL, (guardian_id,)).fetchall()
             
-            # Mostra histórico (sem filtro de notified_guardian)
-            cur.execute('''
-                SELECT al.id, al.student_id, s.name as student_name, al.event_type, al.timestamp
-                FROM access_logs al
-                JOIN students s ON al.student_id = s.id
-                JOIN student_guardians sg ON s.id = sg.student_id
-                WHERE sg.guardian_id = ?
-                ORDER BY al.timestamp DESC LIMIT 20
-            ''', (guardian_id,))
+            if rows:
+                school_write(school['id'], 'UPDATE access_logs SET notified_guardian = 1 WHERE id = ?',
+                             [(r['id'],) for r in rows], many=True)
             
-            rows = cur.fetchall()
             for row in rows:
                 n = dict(row)
                 n['school_id'] = school['id']
                 n['school_name'] = school['name']
-                n['read'] = False 
-                all_notifs.append(n)
-        except:
+                pending.append(n)
+        except Exception as e:
+            log.error('erro ao buscar notificações pendentes', extra={'school_id': school['id'], 'error': str(e)})
             continue
         finally:
             if school_db: school_db.close()
+    
+    return pending
+
+def mark_notified(school_id, log_id):
+    """Marca como entregue um access_log recebido pelo barramento de notificações."""
+    try:
+        school_write(school_id, 'UPDATE access_logs SET notified_guardian = 1 WHERE id = ?', (log_id,))
+    except Exception as e:
+        log.error('erro ao marcar notificação', extra={'school_id': school_id, 'log_id': log_id, 'error': str(e)})
+
+def fetch_guardian_events(sys_db, guardian_id):
+    """Eventos das escolas do responsável: gerais ou das turmas dos seus alunos."""
+    all_schools = set()
+    all_students = []
+    
+    # Índice responsável -> escola/aluno no system.db
+    for s in get_guardian_students(sys_db, guardian_id):
+        all_schools.add(s['school_id'])
+        all_students.append({
+            'id': s['student_id'],
+            'class_name': s['class_name'],
+            'school_id': s['school_id']
+        })
+    
+    all_events = []
+    
+    for school_id in all_schools:
+        school_db = None
+        try:
+            school_db = get_school_db(school_id)
             
-    return jsonify({'success': True, 'data': {'notifications': all_notifs}})
+            # Buscar nome da escola
+            school_info = sys_db.execute('SELECT name FROM schools WHERE id = ?', (school_id,)).fetchone()
+            school_name = school_info['name'] if school_info else f'Escola {school_id}'
+            
+            # Buscar todos os eventos
+            events = school_db.execute('''
+                SELECT * FROM events 
+                ORDER BY event_date ASC
+            ''').fetchall()
+            
+            # Filtrar eventos relevantes para os alunos deste responsável
+            for event in events:
+                event_dict = dict(event)
+                event_dict['school_id'] = school_id
+                event_dict['school_name'] = school_name
+                
+                # Verificar se o evento é relevante
+                is_relevant = False
+                
+                # Eventos sem turma específica são para todos
+                if not event_dict.get('class_name'):
+                    is_relevant = True
+                else:
+                    # Verificar se algum aluno está na turma do evento
+                    for student in all_students:
+                        if student['school_id'] == school_id and student['class_name'] == event_dict.get('class_name'):
+                            is_relevant = True
+                            break
+                
+                if is_relevant:
+                    all_events.append(event_dict)
+        except Exception as e:
+            log.error('erro ao buscar eventos da escola', extra={'school_id': school_id, 'error': str(e)})
+            continue
+        finally:
+            if school_db: school_db.close()
+    
+    # Ordenar eventos por data
+    all_events.sort(key=lambda x: x.get('event_date') or '9999-12-31')
+    return all_events
 
 @guardian_bp.route('/api/guardian/events')
 def events():
-    token = request.args.get('token')
-    if not token and 'Authorization' in request.headers:
-        token = request.headers['Authorization'].split(' ')[1]
-        
-    if not token:
-        return jsonify({'message': 'Token missing'}), 401
-    
-    try:
-        data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        guardian_id = data['id']
-    except:
-        return jsonify({'message': 'Invalid token'}), 403
+    guardian_id, error = get_sse_guardian_id()
+    if error:
+        return error
 
     def generate():
         yield f"data: {json.dumps({'type': 'connected'})}\n\n"
         
-        while True:
-            try:
-                # Conexão manual para threads/generators
-                sys_db = sqlite3.connect(SYSTEM_DB_PATH)
-                sys_db.row_factory = sqlite3.Row
-                schools = sys_db.execute('SELECT id, name FROM schools').fetchall()
-                sys_db.close()
-                
-                for school in schools:
-                    school_db = None
-                    try:
-                        school_db = get_school_db(school['id'])
-                        
-                        # Apenas não notificados para SSE
-                        rows = school_db.execute('''
-                            SELECT al.id, al.student_id, s.name as student_name, al.event_type, al.timestamp
-                            FROM access_logs al
-                            JOIN students s ON al.student_id = s.id
-                            JOIN student_guardians sg ON s.id = sg.student_id
-                            WHERE sg.guardian_id = ? AND al.notified_guardian = 0
-                        ''', (guardian_id,)).fetchall()
-                        
-                        if rows:
-                            # Marcar como notificado
-                            ids = [str(dict(r)['id']) for r in rows]
-                            if ids:
-                                school_db.execute(f"UPDATE access_logs SET notified_guardian = 1 WHERE id IN ({','.join(ids)})")
-                                school_db.commit()
-
-                        for row in rows:
-                            n = dict(row)
-                            n['school_name'] = school['name']
-                            yield f"data: {json.dumps({'type': 'notification', 'data': n})}\n\n"
-                            
-                    except Exception as e:
-                        pass
-                    finally:
-                        if school_db:
-                            try:
-                                school_db.close()
-                            except:
-                                pass
-                                
-            except Exception as e:
-                pass
+        # Assinar antes de buscar pendências para não perder nada entre as duas etapas
+        with notification_bus.subscribe(guardian_id) as sub:
+            for n in fetch_pending_notifications(guardian_id):
+                yield f"data: {json.dumps({'type': 'notification', 'data': n})}\n\n"
             
-            time.sleep(3)
+            while True:
+                message = sub.get(timeout=SSE_KEEPALIVE_SECONDS)
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                
+                if message.get('type') == 'notification':
+                    n = message['data']
+                    mark_notified(n['school_id'], n['id'])
+                    yield f"data: {json.dumps(message)}\n\n"
             
     return Response(generate(), mimetype='text/event-stream')
 
@@ -367,126 +459,51 @@ def events():
 def events_stream():
     """
     Server-Sent Events (SSE) para eventos escolares em tempo real.
-    Substitui o polling por uma conexão persistente.
+    Fica bloqueado no barramento de notificações em vez de consultar os bancos periodicamente.
     """
-    token = request.args.get('token')
-    if not token and 'Authorization' in request.headers:
-        token = request.headers['Authorization'].split(' ')[1]
-        
-    if not token:
-        return jsonify({'message': 'Token missing'}), 401
-    
-    try:
-        data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        guardian_id = data['id']
-    except:
-        return jsonify({'message': 'Invalid token'}), 403
+    guardian_id, error = get_sse_guardian_id()
+    if error:
+        return error
+
+    def load_events():
+        sys_db = connect(SYSTEM_DB_PATH)
+        sys_db.row_factory = sqlite3.Row
+        try:
+            return fetch_guardian_events(sys_db, guardian_id)
+        finally:
+            sys_db.close()
 
     def generate():
         # Enviar confirmação de conexão
         yield f"data: {json.dumps({'type': 'connected'})}\n\n"
         
-        last_event_count = 0
-        
-        while True:
+        with notification_bus.subscribe(guardian_id) as sub:
+            for n in fetch_pending_notifications(guardian_id):
+                yield f"data: {json.dumps({'type': 'notification', 'data': n})}\n\n"
+            
             try:
-                # Buscar eventos atualizados
-                sys_db = sqlite3.connect(SYSTEM_DB_PATH)
-                sys_db.row_factory = sqlite3.Row
-                schools = sys_db.execute('SELECT id FROM schools').fetchall()
-                
-                all_schools = set()
-                all_students = []
-                
-                # Buscar alunos vinculados
-                for school_row in schools:
-                    school_id = school_row['id']
-                    try:
-                        school_db = get_school_db(school_id)
-                        students = school_db.execute('''
-                            SELECT s.id, s.name, s.class_name 
-                            FROM students s
-                            JOIN student_guardians sg ON s.id = sg.student_id
-                            WHERE sg.guardian_id = ?
-                        ''', (guardian_id,)).fetchall()
-                        
-                        if students:
-                            all_schools.add(school_id)
-                            for s in students:
-                                all_students.append({
-                                    'id': s['id'],
-                                    'class_name': s['class_name'],
-                                    'school_id': school_id
-                                })
-                        school_db.close()
-                    except:
-                        continue
-                
-                # Check Notifications
-                for school_id in all_schools:
-                    try:
-                        school_db = get_school_db(school_id)
-                        notifs = school_db.execute('''
-                            SELECT al.id, al.student_id, s.name as student_name, al.event_type 
-                            FROM access_logs al
-                            JOIN students s ON al.student_id = s.id
-                            JOIN student_guardians sg ON s.id = sg.student_id
-                            WHERE sg.guardian_id = ? AND al.notified_guardian = 0
-                        ''', (guardian_id,)).fetchall()
-                        if notifs:
-                            ids_to_update = [str(n['id']) for n in notifs]
-                            school_db.execute(f"UPDATE access_logs SET notified_guardian = 1 WHERE id IN ({','.join(ids_to_update)})")
-                            school_db.commit()
-                            for n in notifs:
-                                yield f"data: {json.dumps({'type': 'notification', 'data': dict(n)})}\n\n"
-                        school_db.close()
-                    except: pass
-
-                # Buscar eventos
-                all_events = []
-                for school_id in all_schools:
-                    try:
-                        school_db = get_school_db(school_id)
-                        school_info = sys_db.execute('SELECT name FROM schools WHERE id = ?', (school_id,)).fetchone()
-                        school_name = school_info['name'] if school_info else f'Escola {school_id}'
-                        
-                        events = school_db.execute('SELECT * FROM events ORDER BY event_date ASC').fetchall()
-                        
-                        for event in events:
-                            event_dict = dict(event)
-                            event_dict['school_id'] = school_id
-                            event_dict['school_name'] = school_name
-                            
-                            # Filtrar eventos relevantes
-                            is_relevant = False
-                            if not event_dict.get('class_name'):
-                                is_relevant = True
-                            else:
-                                for student in all_students:
-                                    if student['school_id'] == school_id and student['class_name'] == event_dict.get('class_name'):
-                                        is_relevant = True
-                                        break
-                            
-                            if is_relevant:
-                                all_events.append(event_dict)
-                        
-                        school_db.close()
-                    except:
-                        continue
-                
-                sys_db.close()
-                
-                # Enviar eventos se houver mudança
-                current_count = len(all_events)
-                if current_count != last_event_count:
-                    all_events.sort(key=lambda x: x.get('event_date', '9999-12-31'))
-                    yield f"data: {json.dumps({'type': 'events', 'data': all_events})}\n\n"
-                    last_event_count = current_count
-                
+                yield f"data: {json.dumps({'type': 'events', 'data': load_events()})}\n\n"
             except Exception as e:
-                print(f"Erro no SSE de eventos: {e}")
+                log.error('erro no SSE de eventos', extra={'guardian_id': guardian_id, 'error': str(e)})
             
-            time.sleep(5)  # Verificar a cada 5 segundos
+            while True:
+                message = sub.get(timeout=SSE_KEEPALIVE_SECONDS)
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                
+                msg_type = message.get('type')
+                if msg_type == 'notification':
+                    n = message['data']
+                    mark_notified(n['school_id'], n['id'])
+                    yield f"data: {json.dumps(message)}\n\n"
+                elif msg_type == 'events_changed':
+                    try:
+                        yield f"data: {json.dumps({'type': 'events', 'data': load_events()})}\n\n"
+                    except Exception as e:
+                        log.error('erro no SSE de eventos', extra={'guardian_id': guardian_id, 'error': str(e)})
+                elif msg_type == 'chat':
+                    yield f"data: {json.dumps(message)}\n\n"
             
     return Response(generate(), mimetype='text/event-stream')
 
@@ -535,7 +552,7 @@ def search_students(school_id):
             params.append(class_name)
             
         students = school_db.execute(query, params).fetchall()
-        return jsonify([dict(s) for s in students])
+        return jsonify([sign_photo_fields(dict(s)) for s in students])
     except Exception as e:
         return jsonify([])
     finally:
@@ -563,29 +580,58 @@ def get_student_attendance():
         return jsonify([])
         
     try:
-        m_str = f"{month:02d}"
-        y_str = str(year)
+        start_day = f"{year}-{month:02d}-01"
+        end_day = f"{year}-{month:02d}-{calendar.monthrange(year, month)[1]:02d}"
         
         school_db = None
         try:
             school_db = get_school_db(school_id)
             
-            # Buscar de access_logs (que tem event_type: arrival, departure)
-            like_pattern = f"{y_str}-{m_str}-%"
-            
-            rows = school_db.execute('''
-                SELECT timestamp, event_type as type FROM access_logs 
-                WHERE student_id = ? AND timestamp LIKE ?
-            ''', (student_id, like_pattern)).fetchall()
+            # Calendário do mês pelo resumo diário (attendance_rollup): primeira chegada
+            # e última saída de cada dia, no mesmo formato {timestamp, type} de antes
+            query, params = attendance_rollup.day_events_query(
+                start_day, end_day, int(student_id), raw=backfill_pending(school_db, 'attendance_rollups'))
+            rows = school_db.execute(f'SELECT timestamp, type FROM ({query}) ORDER BY timestamp', params).fetchall()
             
             return jsonify([dict(r) for r in rows])
         finally:
             if school_db: school_db.close()
             
     except Exception as e:
-        print(f"Erro attendance: {e}")
+        log.error('erro ao buscar frequência do aluno', extra={'school_id': school_id, 'error': str(e)})
         return jsonify([])
 
+@guardian_bp.route('/api/guardian/student-attendance/daily', methods=['GET'])
+@token_required
+def get_student_attendance_daily():
+    """Calendário do mês pelo resumo diário: um item por dia com chegada, saída e atraso."""
+    school_id = request.args.get('schoolId')
+    student_id = request.args.get('studentId', type=int)
+    today = datetime.date.today()
+    month = request.args.get('month', today.month, type=int)
+    year = request.args.get('year', today.year, type=int)
+    
+    if not (school_id and student_id):
+        return jsonify({'days': [], 'present': 0, 'late': 0})
+    
+    school_db = None
+    try:
+        school_db = get_school_db(school_id)
+        start_day = f"{year}-{month:02d}-01"
+        end_day = f"{year}-{month:02d}-{calendar.monthrange(year, month)[1]:02d}"
+        raw = backfill_pending(school_db, 'attendance_rollups')
+        days = [dict(r) for r in attendance_rollup.student_days(school_db, start_day, end_day, student_id, raw=raw)]
+        return jsonify({
+            'days': days,
+            'present': sum(d['present'] for d in days),
+            'late': sum(d['late'] for d in days)
+        })
+    except Exception as e:
+        log.error('erro ao buscar frequência diária do aluno', extra={'school_id': school_id, 'error': str(e)})
+        return jsonify({'days': [], 'present': 0, 'late': 0})
+    finally:
+        if school_db: school_db.close()
+
 @guardian_bp.route('/api/guardian/school-events', methods=['GET'])
 @token_required
 def get_school_events():
@@ -596,98 +642,13 @@ def get_school_events():
     guardian_id = g.user.get('id')
     
     try:
-        # Buscar todas as escolas onde o responsável tem filhos
-        sys_db = get_system_db()
-        
-        # Buscar todos os alunos vinculados ao responsável
-        all_schools = set()
-        all_students = []
-        
-        # Procurar em todas as escolas (brute force, mas funcional)
-        schools = sys_db.execute('SELECT id FROM schools').fetchall()
-        
-        for school_row in schools:
-            school_id = school_row['id']
-            try:
-                school_db = get_school_db(school_id)
-                students = school_db.execute('''
-                    SELECT s.id, s.name, s.class_name 
-                    FROM students s
-                    JOIN student_guardians sg ON s.id = sg.student_id
-                    WHERE sg.guardian_id = ?
-                ''', (guardian_id,)).fetchall()
-                
-                if students:
-                    all_schools.add(school_id)
-                    for s in students:
-                        all_students.append({
-                            'id': s['id'],
-                            'name': s['name'],
-                            'class_name': s['class_name'],
-                            'school_id': school_id
-                        })
-                school_db.close()
-            except Exception as e:
-                print(f"Erro ao verificar escola {school_id}: {e}")
-                continue
-        
-        if not all_schools:
-            return jsonify({'success': True, 'events': []})
-        
-        # Buscar eventos de todas as escolas
-        all_events = []
-        
-        for school_id in all_schools:
-            try:
-                school_db = get_school_db(school_id)
-                
-                # Buscar nome da escola
-                school_info = sys_db.execute('SELECT name FROM schools WHERE id = ?', (school_id,)).fetchone()
-                school_name = school_info['name'] if school_info else f'Escola {school_id}'
-                
-                # Buscar todos os eventos
-                events = school_db.execute('''
-                    SELECT * FROM events 
-                    ORDER BY event_date ASC
-                ''').fetchall()
-                
-                # Filtrar eventos relevantes para os alunos deste responsável
-                for event in events:
-                    event_dict = dict(event)
-                    event_dict['school_id'] = school_id
-                    event_dict['school_name'] = school_name
-                    
-                    # Verificar se o evento é relevante
-                    is_relevant = False
-                    
-                    # Eventos sem turma específica são para todos
-                    if not event_dict.get('class_name'):
-                        is_relevant = True
-                    else:
-                        # Verificar se algum aluno está na turma do evento
-                        for student in all_students:
-                            if student['school_id'] == school_id and student['class_name'] == event_dict.get('class_name'):
-                                is_relevant = True
-                                break
-                    
-                    if is_relevant:
-                        all_events.append(event_dict)
-                
-                school_db.close()
-            except Exception as e:
-                print(f"Erro ao buscar eventos da escola {school_id}: {e}")
-                continue
+        all_events = fetch_guardian_events(get_system_db(), guardian_id)
         
-        # Ordenar eventos por data
-        all_events.sort(key=lambda x: x.get('event_date', '9999-12-31'))
-        
-        print(f"✅ Retornando {len(all_events)} eventos para responsável {guardian_id}")
+        log.debug('eventos do responsável', extra={'guardian_id': guardian_id, 'events': len(all_events)})
         return jsonify({'success': True, 'events': all_events})
         
     except Exception as e:
-        print(f"❌ Erro em get_school_events: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception('erro ao buscar eventos do responsável', extra={'guardian_id': guardian_id, 'error': str(e)})
         return jsonify({'success': False, 'events': [], 'error': str(e)})
 
 @guardian_bp.route('/api/guardian/link-student', methods=['POST'])
@@ -714,6 +675,9 @@ def link_student():
         school_db.execute('INSERT INTO student_guardians (student_id, guardian_id) VALUES (?, ?)', 
                           (student_id, guardian_id))
         school_db.commit()
+
+        student = school_db.execute('SELECT class_name FROM students WHERE id = ?', (student_id,)).fetchone()
+        index_link(get_system_db(), guardian_id, school_id, student_id, student['class_name'] if student else None)
         
         return jsonify({'success': True, 'message': 'Vinculado com sucesso'})
     except Exception as e:
@@ -809,14 +773,14 @@ def confirm_event_participation(school_id, event_id):
                 else:
                     school_db.execute("INSERT INTO event_participations (event_id, student_id, status, receipt_url) VALUES (?, ?, 'confirmed', ?)", (event_id, sid, receipt_url))
             except Exception as ex:
-                print(f"Erro ao inserir participacao: {ex}")
+                log.error('erro ao inserir participação', extra={'event_id': event_id, 'student_id': sid, 'error': str(ex)})
                 pass
                 
         school_db.commit()
         return jsonify({'success': True, 'count': len(students_to_confirm)})
         
     except Exception as e:
-        print(f"Erro confirmacao rota: {e}")
+        log.error('erro ao confirmar participação', extra={'event_id': event_id, 'error': str(e)})
         return jsonify({'message': str(e)}), 500
     finally:
         if school_db: school_db.close()
@@ -832,8 +796,10 @@ def get_chat_messages(student_id):
     if not school_id:
         return jsonify({'message': 'School ID required'}), 400
         
-    school_db = None
     try:
+        # Conexão: list_response tira do teardown (que roda antes do streaming) e
+        # devolve ao pool quando a lista inteira termina de ser enviada; com
+        # ?limit= a página é lida antes e o teardown a devolve
         school_db = get_school_db(school_id)
         
         # Verificar se tem permissão (é pai desse aluno)
@@ -842,22 +808,10 @@ def get_chat_messages(student_id):
         if not perm:
             return jsonify({'message': 'Unauthorized'}), 403
             
-        cur = school_db.execute('''
-            SELECT * FROM chat_messages 
-            WHERE student_id = ? AND school_id = ?
-            ORDER BY timestamp ASC
-        ''', (student_id, school_id))
-        
-        msgs = [dict(m) for m in cur.fetchall()]
-        
-
-
-        return jsonify(msgs)
+        return list_response(school_db, CHAT_MESSAGES_LIST, GUARDIAN_CHAT_WHERE, (student_id, school_id))
     except Exception as e:
-        print(f"Erro chat GET: {e}")
+        log.error('erro ao listar chat', extra={'student_id': student_id, 'error': str(e)})
         return jsonify([])
-    finally:
-        if school_db: school_db.close()
 
 @guardian_bp.route('/api/guardian/chat/<int:student_id>/messages', methods=['POST'])
 @token_required
@@ -911,10 +865,16 @@ def send_chat_message(student_id):
             VALUES (?, ?, 'guardian', ?, ?, ?, ?, ?, datetime('now'))
         ''', (student_id, school_id, guardian_id, msg_type, text, file_url, file_name))
         school_db.commit()
+
+        # Outros responsáveis do mesmo aluno acompanham a conversa
+        notify_student_guardians(get_system_db(), school_id, student_id, {
+            'type': 'chat',
+            'data': {'school_id': int(school_id), 'student_id': student_id, 'sender_type': 'guardian', 'message_type': msg_type}
+        })
         
         return jsonify({'success': True})
     except Exception as e:
-        print(f"Erro chat POST: {e}")
+        log.error('erro ao enviar mensagem no chat', extra={'student_id': student_id, 'error': str(e)})
         return jsonify({'error': str(e)}), 500
     finally:
         if school_db: school_db.close()
@@ -924,135 +884,72 @@ def send_chat_message(student_id):
 def get_invoices():
     guardian_id = g.user.get('id')
     sys_db = get_system_db()
-    schools = sys_db.execute('SELECT id, name FROM schools').fetchall()
-    
-    all_invoices = []
-    
-    for school in schools:
-        school_db = None
-        try:
-            school_db = get_school_db(school['id'])
-            # Verificar se tabela existe
-            try:
-                school_db.execute('SELECT 1 FROM invoices LIMIT 1')
-            except:
-                continue # Tabela não existe nesta escola
-                
-            # Join to get student info and verify guardian
-            query = '''
-                SELECT i.*, s.name as student_name, s.class_name
-                FROM invoices i
-                JOIN students s ON i.student_id = s.id
-                JOIN student_guardians sg ON s.id = sg.student_id
-                WHERE sg.guardian_id = ?
-                ORDER BY i.due_date DESC
-            '''
-            rows = school_db.execute(query, (guardian_id,)).fetchall()
-            for r in rows:
-                inv = dict(r)
-                inv['school_id'] = school['id']
-                inv['school_name'] = school['name']
-                all_invoices.append(inv)
-        except Exception as e:
-            print(f"Erro ao buscar faturas escola {school['id']}: {e}")
-            continue
-        finally:
-             if school_db: school_db.close()
-             
-    return jsonify({'success': True, 'invoices': all_invoices})
+    schools = get_guardian_schools(sys_db, guardian_id)
+    
+    def decorate(inv, school):
+        inv['school_id'] = school['id']
+        inv['school_name'] = school['name']
+        return inv
+    
+    # Join to get student info and verify guardian
+    rows = iter_school_rows(schools, '''
+        SELECT i.*, s.name as student_name, s.class_name
+        FROM invoices i
+        JOIN students s ON i.student_id = s.id
+        JOIN student_guardians sg ON s.id = sg.student_id
+        WHERE sg.guardian_id = ?
+        ORDER BY i.due_date DESC
+    ''', (guardian_id,), decorate, require_table='invoices')
+    return stream_guardian_rows(rows, {'success': True, 'invoices': ROWS})
 
 @guardian_bp.route('/api/guardian/grades', methods=['GET'])
 @token_required
 def get_grades():
     guardian_id = g.user.get('id')
     sys_db = get_system_db()
-    schools = sys_db.execute('SELECT id, name FROM schools').fetchall()
-    
-    all_grades = []
-    
-    for school in schools:
-        school_db = None
-        try:
-            school_db = get_school_db(school['id'])
-            # Verificar se tabela existe
-            try:
-                school_db.execute('SELECT 1 FROM student_grades LIMIT 1')
-            except:
-                continue 
-                
-            query = '''
-                SELECT g.*, s.name as student_name, s.class_name
-                FROM student_grades g
-                JOIN students s ON g.student_id = s.id
-                JOIN student_guardians sg ON s.id = sg.student_id
-                WHERE sg.guardian_id = ?
-                ORDER BY g.created_at DESC
-            '''
-            
-            rows = school_db.execute(query, (guardian_id,)).fetchall()
-            for r in rows:
-                item = dict(r)
-                item['school_id'] = school['id']
-                item['school_name'] = school['name']
-                # Fetch teacher name from system db
-                if item.get('teacher_id'):
-                    t = sys_db.execute('SELECT name FROM teachers WHERE id = ?', (item['teacher_id'],)).fetchone()
-                    item['teacher_name'] = t['name'] if t else 'Professor'
-                else:
-                    item['teacher_name'] = 'Professor'
-                    
-                all_grades.append(item)
-        except Exception as e:
-            # print(f"Erro ao buscar notas escola {school['id']}: {e}")
-            continue
-        finally:
-             if school_db: school_db.close()
-             
-    return jsonify({'success': True, 'grades': all_grades})
+    schools = get_guardian_schools(sys_db, guardian_id)
+    # Nomes dos professores vêm do system.db durante o streaming
+    teacher_name = teacher_name_lookup(sys_db, 'Professor')
+    
+    def decorate(item, school):
+        item['school_id'] = school['id']
+        item['school_name'] = school['name']
+        item['teacher_name'] = teacher_name(item.get('teacher_id'))
+        return item
+    
+    rows = iter_school_rows(schools, '''
+        SELECT g.*, s.name as student_name, s.class_name
+        FROM student_grades g
+        JOIN students s ON g.student_id = s.id
+        JOIN student_guardians sg ON s.id = sg.student_id
+        WHERE sg.guardian_id = ?
+        ORDER BY g.created_at DESC
+    ''', (guardian_id,), decorate, require_table='student_grades')
+    return stream_guardian_rows(rows, {'success': True, 'grades': ROWS}, close=[detach_db(sys_db)])
 
 @guardian_bp.route('/api/guardian/reports', methods=['GET'])
 @token_required
 def get_reports():
     guardian_id = g.user.get('id')
     sys_db = get_system_db()
-    schools = sys_db.execute('SELECT id, name FROM schools').fetchall()
-    
-    all_reports = []
-    
-    for school in schools:
-        school_db = None
-        try:
-            school_db = get_school_db(school['id'])
-            try:
-                school_db.execute('SELECT 1 FROM student_reports LIMIT 1')
-            except:
-                continue 
-                
-            query = '''
-                SELECT r.*, s.name as student_name, s.class_name
-                FROM student_reports r
-                JOIN students s ON r.student_id = s.id
-                JOIN student_guardians sg ON s.id = sg.student_id
-                WHERE sg.guardian_id = ?
-                ORDER BY r.created_at DESC
-            '''
-            rows = school_db.execute(query, (guardian_id,)).fetchall()
-            for r in rows:
-                item = dict(r)
-                item['school_id'] = school['id']
-                item['school_name'] = school['name']
-                if item.get('teacher_id'):
-                    t = sys_db.execute('SELECT name FROM teachers WHERE id = ?', (item['teacher_id'],)).fetchone()
-                    item['teacher_name'] = t['name'] if t else 'Professor'
-                else:
-                    item['teacher_name'] = 'Coordenação'
-                all_reports.append(item)
-        except Exception as e:
-            continue
-        finally:
-             if school_db: school_db.close()
-             
-    return jsonify({'success': True, 'reports': all_reports})
+    schools = get_guardian_schools(sys_db, guardian_id)
+    teacher_name = teacher_name_lookup(sys_db, 'Coordenação')
+    
+    def decorate(item, school):
+        item['school_id'] = school['id']
+        item['school_name'] = school['name']
+        item['teacher_name'] = teacher_name(item.get('teacher_id'))
+        return item
+    
+    rows = iter_school_rows(schools, '''
+        SELECT r.*, s.name as student_name, s.class_name
+        FROM student_reports r
+        JOIN students s ON r.student_id = s.id
+        JOIN student_guardians sg ON s.id = sg.student_id
+        WHERE sg.guardian_id = ?
+        ORDER BY r.created_at DESC
+    ''', (guardian_id,), decorate, require_table='student_reports')
+    return stream_guardian_rows(rows, {'success': True, 'reports': ROWS}, close=[detach_db(sys_db)])
 
 
 
@@ -0,0 +1,160 @@
+"""
+Camada comum das rotas de listagem: projeção de colunas, filtros e ordenação
+em colunas indexadas, paginação por cursor (keyset) e resposta JSON em streaming.
+
+Parâmetros aceitos por toda rota que usa list_response():
+    fields=id,name,class_name   colunas retornadas (padrão: todas, menos as ocultas)
+    sort=name | sort=-name      ordenação ('-' = decrescente), só nas colunas da rota
+    limit=50                    tamanho da página; sem limit a lista vem inteira
+    cursor=...                  valor de X-Next-Cursor da página anterior
+    format=ndjson               um objeto por linha em vez do array (ver streaming.py)
+    <coluna>=valor              filtro de igualdade nas colunas em filters
+
+A resposta continua sendo um array JSON (clientes antigos não mudam); a próxima
+página vem nos headers X-Next-Cursor e Link (rel="next").
+"""
+import json
+import base64
+from urllib.parse import urlencode
+from flask import jsonify, request
+from database import table_columns, detach_db
+from .streaming import stream_response, response_format
+
+LIST_MAX_LIMIT = 500
+
+
+class ListQuery:
+    """
+    Descrição de uma listagem: tabela, colunas ordenáveis (precisam de índice
+    que comece por elas, ou pelos filtros fixos da rota seguidos delas),
+    filtros permitidos e colunas que nunca saem na resposta.
+    """
+
+    def __init__(self, table, sorts=('id',), default_sort='id', filters=(), hidden=(), key='id'):
+        self.table = table
+        self.sorts = set(sorts) | {key}
+        self.default_sort = default_sort
+        self.filters = tuple(filters)
+        self.hidden = set(hidden)
+        self.key = key
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError('cursor inválido')
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError('cursor inválido')
+    return values
+
+
+def keyset_condition(column, key, descending, value, last_key):
+    """
+    Linhas depois de (value, last_key) na ordem (column, key). SQLite ordena
+    NULL antes de tudo no ASC (e por último no DESC), por isso os casos à parte.
+    """
+    op = '<' if descending else '>'
+    if column == key:
+        return f'{key} {op} ?', [last_key]
+    if value is None:
+        if descending:
+            return f'({column} IS NULL AND {key} < ?)', [last_key]
+        return f'(({column} IS NULL AND {key} > ?) OR {column} IS NOT NULL)', [last_key]
+    condition = f'(({column}, {key}) {op} (?, ?)'
+    return condition + (f' OR {column} IS NULL)' if descending else ')'), [value, last_key]
+
+
+def build_list_query(db, spec, args, where='', params=()):
+    """(sql, parâmetros, campos da resposta, coluna de ordenação, limit). ValueError se os args forem inválidos."""
+    available = table_columns(db, spec.table) - spec.hidden
+
+    fields = [f for f in (args.get('fields') or '').split(',') if f.strip()]
+    fields = [f.strip() for f in fields] or sorted(available, key=lambda c: (c != spec.key, c))
+    unknown = [f for f in fields if f not in available]
+    if unknown:
+        raise ValueError(f"Campos desconhecidos: {', '.join(unknown)}")
+
+    sort = args.get('sort') or spec.default_sort
+    descending = sort.startswith('-')
+    sort_column = sort.lstrip('-')
+    if sort_column not in spec.sorts or sort_column not in available:
+        raise ValueError(f"Ordenação não permitida: {sort_column}")
+
+    conditions = [where] if where else []
+    params = list(params)
+    for column in spec.filters:
+        if column in args:
+            conditions.append(f'{column} = ?')
+            params.append(args.get(column))
+
+    if args.get('cursor'):
+        value, last_key = decode_cursor(args['cursor'])
+        condition, values = keyset_condition(sort_column, spec.key, descending, value, last_key)
+        conditions.append(condition)
+        params.extend(values)
+
+    limit = None
+    if args.get('limit'):
+        try:
+            limit = int(args['limit'])
+        except ValueError:
+            raise ValueError('limit inválido')
+        limit = max(1, min(limit, LIST_MAX_LIMIT))
+
+    selected = list(dict.fromkeys(fields + [spec.key, sort_column]))
+    direction = 'DESC' if descending else 'ASC'
+    sql = f"SELECT {', '.join(selected)} FROM {spec.table}"
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += f' ORDER BY {sort_column} {direction}, {spec.key} {direction}'
+    if limit:
+        sql += f' LIMIT {limit + 1}'
+    return sql, params, fields, sort_column, limit
+
+
+def list_response(db, spec, where='', params=(), args=None):
+    """
+    Executa a listagem descrita por spec (mais where/params fixos da rota)
+    segundo os parâmetros da requisição e devolve a Response em streaming.
+    """
+    args = request.args if args is None else args
+    try:
+        fmt = response_format()
+        sql, params, fields, sort_column, limit = build_list_query(db, spec, args, where, params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    cursor = db.execute(sql, params)
+    headers = {}
+    owned = None
+    if limit:
+        # Página limitada: já sabemos se existe a próxima antes de começar a resposta
+        rows = cursor.fetchall()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor([last[sort_column], last[spec.key]])
+            query = {k: v for k, v in args.items() if k != 'cursor'}
+            query['cursor'] = next_cursor
+            headers['X-Next-Cursor'] = next_cursor
+            headers['Link'] = f'<{request.path}?{urlencode(query)}>; rel="next"'
+    else:
+        # Lista inteira lida do cursor durante o envio: a conexão sai do
+        # teardown da requisição (que roda antes do streaming) e é fechada no fim
+        rows = cursor
+        owned = detach_db(db)
+
+    return stream_response(rows, fmt, fields, close=[owned], headers=headers)
+
+
+# Listagens das rotas (índices em database.school_list_indexes / system_list_indexes)
+STUDENTS_LIST = ListQuery('students', sorts=('name',), filters=('class_name',))
+EMPLOYEES_LIST = ListQuery('employees', sorts=('name',), filters=('role',))
+EVENTS_LIST = ListQuery('events', sorts=('event_date',), default_sort='-event_date', filters=('class_name', 'type'))
+CHAT_MESSAGES_LIST = ListQuery('chat_messages', sorts=('timestamp',), default_sort='timestamp')
+SCHOOLS_LIST = ListQuery('schools', sorts=('name',), hidden=('password',))
@@ -1,22 +1,58 @@
 from flask import Blueprint, request, jsonify, g
 from .auth import token_required
 from .affiliate_helpers import get_accessible_school_id
-from database import get_system_db, get_school_db
-import bcrypt
+from database import get_system_db, get_school_db, day_range_epoch, ts_epoch_sql, backfill_pending, detach_db
+from guardian_index import index_link, index_unlink, index_update_class
+from notification_bus import notify_student_guardians, notify_school_guardians
+from .attendance import publish_access_log
+from .list_query import list_response, STUDENTS_LIST, EMPLOYEES_LIST, EVENTS_LIST, CHAT_MESSAGES_LIST
+from .streaming import stream_response, response_format, cursor_fields
+from .blobs import sign_photo_fields
+from face_index_sync import push_student_face, remove_student_face
+import attendance_rollup
+import blob_store
+import datetime
+from password_hasher import hash_password
+from app_logging import get_logger
 
 school_bp = Blueprint('school', __name__)
+log = get_logger('school')
+
+# Filtro fixo da listagem do chat (também conferido por check_query_plans.py)
+SCHOOL_CHAT_WHERE = 'student_id = ?'
+
+# Frequência de alunos e folha de ponto por período (também conferidas por check_query_plans.py)
+SCHOOL_ATTENDANCE_SQL = '''
+    SELECT a.id, a.student_id, a.timestamp, a.type, 
+           s.name as student_name, s.class_name, s.photo_url
+    FROM attendance a
+    JOIN students s ON a.student_id = s.id
+    WHERE 1=1
+'''
+EMPLOYEE_ATTENDANCE_SQL = '''
+    SELECT ea.*, e.name as employee_name, e.role as employee_role, e.employee_id as matricula
+    FROM employee_attendance ea
+    JOIN employees e ON ea.employee_id = e.id
+    WHERE 1=1
+'''
+
+def attendance_range_query(query, ts_epoch, start=None, end=None):
+    """(sql, parâmetros) de SCHOOL_/EMPLOYEE_ATTENDANCE_SQL no período [start, end), do mais recente."""
+    params = []
+    if start is not None:
+        query += f" AND {ts_epoch} >= ?"
+        params.append(start)
+    if end is not None:
+        query += f" AND {ts_epoch} < ?"
+        params.append(end)
+    return query + f" ORDER BY {ts_epoch} DESC", params
 
 @school_bp.route('/api/school/students', methods=['GET'])
 @token_required
 def get_students():
     school_id = get_accessible_school_id()
     db = get_school_db(school_id)
-    cur = db.cursor()
-    
-    # Lógica idêntica ao Funcionário: Leitura direta da tabela
-    cur.execute('SELECT * FROM students')
-    students = [dict(row) for row in cur.fetchall()]
-    return jsonify(students)
+    return list_response(db, STUDENTS_LIST)
 
 @school_bp.route('/api/school/students', methods=['POST'])
 @token_required
@@ -25,6 +61,7 @@ def create_student():
     school_id = g.user.get('school_id') or g.user.get('id')
     db = get_school_db(school_id)
     cur = db.cursor()
+    guardian_id = None
     
     try:
         # 1. Preparar Descritor (Lógica idêntica ao Funcionário)
@@ -45,7 +82,7 @@ def create_student():
             data.get('name'),
             data.get('parent_email'),
             data.get('phone'),
-            data.get('photo_url'),
+            blob_store.store_photo(data.get('photo_url')),
             data.get('class_name', 'Sem turma'),
             data.get('age'),
             descriptor
@@ -61,12 +98,11 @@ def create_student():
             sys_cur.execute('SELECT * FROM guardians WHERE email = ?', (parent_email,))
             guardian = sys_cur.fetchone()
             
-            guardian_id = None
             if not guardian:
                 # Criar novo responsável
                 import random
                 password = ''.join(random.choices('abcdefghijklmnopqrstuvwxyz0123456789', k=8))
-                hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+                hashed = hash_password(password)
                 
                 sys_cur.execute('''
                     INSERT INTO guardians (email, password, name, phone)
@@ -85,6 +121,12 @@ def create_student():
             ''', (student_id, guardian_id))
             
         db.commit()
+
+        if guardian_id:
+            index_link(get_system_db(), guardian_id, school_id, student_id, data.get('class_name', 'Sem turma'))
+        if descriptor:
+            push_student_face(school_id, student_id, descriptor, {**data, 'class_name': data.get('class_name', 'Sem turma')})
+
         return jsonify({'message': 'Aluno criado com sucesso', 'id': student_id})
         
     except Exception as e:
@@ -183,7 +225,7 @@ def get_class_students(class_id):
     
     # Buscar alunos por class_name
     cur.execute('SELECT * FROM students WHERE class_name = ?', (class_name,))
-    students = [dict(row) for row in cur.fetchall()]
+    students = [sign_photo_fields(dict(row)) for row in cur.fetchall()]
     
     return jsonify(students)
 
@@ -314,7 +356,11 @@ def update_student_face(student_id):
         db.execute('UPDATE students SET face_descriptor = ? WHERE id = ?', (descriptor, student_id))
             
         db.commit()
+        student = db.execute('SELECT name, phone, class_name FROM students WHERE id = ?', (student_id,)).fetchone()
         db.close()
+
+        if student:
+            push_student_face(school_id, student_id, descriptor, dict(student))
         
         return jsonify({'success': True, 'message': 'Biometria atualizada'})
     except Exception as e:
@@ -330,9 +376,7 @@ def get_events():
     
     try:
         db = get_school_db(school_id)
-        events = db.execute('SELECT * FROM events ORDER BY event_date DESC').fetchall()
-        db.close()
-        return jsonify([dict(e) for e in events])
+        return list_response(db, EVENTS_LIST)
     except Exception as e:
         print(f"❌ Erro ao buscar eventos: {e}")
         return jsonify([])
@@ -361,6 +405,8 @@ def create_event():
         ))
         db.commit()
         db.close()
+        notify_school_guardians(get_system_db(), school_id, {'type': 'events_changed', 'data': {'school_id': school_id}},
+                                class_name=data.get('class_name'))
         return jsonify({'success': True})
     except Exception as e:
         print(f"❌ Erro ao criar evento: {e}")
@@ -391,6 +437,7 @@ def update_event(event_id):
         ))
         db.commit()
         db.close()
+        notify_school_guardians(get_system_db(), school_id, {'type': 'events_changed', 'data': {'school_id': school_id}})
         return jsonify({'success': True})
     except Exception as e:
         print(f"❌ Erro ao atualizar evento: {e}")
@@ -407,6 +454,7 @@ def delete_event(event_id):
         db.execute('DELETE FROM events WHERE id = ?', (event_id,))
         db.commit()
         db.close()
+        notify_school_guardians(get_system_db(), school_id, {'type': 'events_changed', 'data': {'school_id': school_id}})
         return jsonify({'success': True})
     except Exception as e:
         print(f"❌ Erro ao deletar evento: {e}")
@@ -468,9 +516,8 @@ def create_inspector():
     db = get_system_db()
     
     # Hash password
-    import bcrypt
     password = data.get('password')
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed = hash_password(password)
     
     try:
         db.execute('''
@@ -547,7 +594,7 @@ def get_pickups():
     
     # Nota: g.name vem do system.db, então precisamos fazer um join manual ou subquery se possível
     # Mas como pickup_requests tem o guardian_id, podemos buscar os nomes no system.db depois
-    pickups = [dict(row) for row in cur.fetchall()]
+    pickups = [sign_photo_fields(dict(row)) for row in cur.fetchall()]
     
     sys_db = get_system_db()
     for p in pickups:
@@ -568,13 +615,24 @@ def update_pickup_status(request_id):
     db.execute('UPDATE pickup_requests SET status = ? WHERE id = ?', (status, request_id))
     
     # Notificar responsável se status relevante
+    log = None
     if status in ['released', 'calling', 'approved', 'confirmed']:
-        row = db.execute('SELECT student_id FROM pickup_requests WHERE id = ?', (request_id,)).fetchone()
+        row = db.execute('''
+            SELECT p.student_id as id, s.name FROM pickup_requests p
+            JOIN students s ON p.student_id = s.id
+            WHERE p.id = ?
+        ''', (request_id,)).fetchone()
         if row:
-            db.execute('INSERT INTO access_logs (student_id, event_type, notified_guardian) VALUES (?, ?, 0)',
-                       (row['student_id'], f'pickup_{status}'))
+            cur = db.execute('INSERT INTO access_logs (student_id, event_type, notified_guardian) VALUES (?, ?, 0)',
+                             (row['id'], f'pickup_{status}'))
+            log = (row, cur.lastrowid)
 
     db.commit()
+
+    if log:
+        student, log_id = log
+        timestamp = db.execute('SELECT timestamp FROM access_logs WHERE id = ?', (log_id,)).fetchone()['timestamp']
+        publish_access_log(school_id, student, log_id, f'pickup_{status}', timestamp)
     
     return jsonify({'success': True})
 
@@ -591,7 +649,7 @@ def update_student(student_id):
             UPDATE students SET name=?, parent_email=?, phone=?, photo_url=?, class_name=?, age=?
             WHERE id=?
         ''', (data.get('name'), data.get('parent_email'), data.get('phone'), 
-              data.get('photo_url'), data.get('class_name'), data.get('age'), student_id))
+              blob_store.store_photo(data.get('photo_url')), data.get('class_name'), data.get('age'), student_id))
         
         # Atualizar descritor facial se fornecido
         if data.get('face_descriptor'):
@@ -603,6 +661,12 @@ def update_student(student_id):
             db.execute('INSERT INTO face_descriptors (student_id, descriptor) VALUES (?, ?)', (student_id, descriptor))
         
         db.commit()
+        index_update_class(get_system_db(), school_id, student_id, data.get('class_name'))
+        if data.get('face_descriptor'):
+            # Dados do aluno como ficaram gravados (o request pode vir com campos a mais ou faltando)
+            student = db.execute('SELECT name, phone, class_name FROM students WHERE id = ?', (student_id,)).fetchone()
+            if student:
+                push_student_face(school_id, student_id, data.get('face_descriptor'), dict(student))
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -616,6 +680,8 @@ def delete_student(student_id):
     db.execute('DELETE FROM student_guardians WHERE student_id = ?', (student_id,))
     db.execute('DELETE FROM students WHERE id = ?', (student_id,))
     db.commit()
+    index_unlink(get_system_db(), school_id, student_id)
+    remove_student_face(school_id, student_id)
     return jsonify({'success': True})
 
 # ====== EMPLOYEES ======
@@ -624,8 +690,7 @@ def delete_student(student_id):
 def get_employees():
     school_id = g.user.get('school_id') or g.user.get('id')
     db = get_school_db(school_id)
-    employees = db.execute('SELECT * FROM employees').fetchall()
-    return jsonify([dict(e) for e in employees])
+    return list_response(db, EMPLOYEES_LIST)
 
 @school_bp.route('/api/school/employees', methods=['POST'])
 @token_required
@@ -637,7 +702,7 @@ def create_employee():
     import random
     import string
     password_plain = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
-    hashed = bcrypt.hashpw(password_plain.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed = hash_password(password_plain)
     
     email = data.get('email')
     
@@ -668,7 +733,7 @@ def create_employee():
     ''', (
         data.get('name'), 
         data.get('role'), 
-        data.get('photo_url'), 
+        blob_store.store_photo(data.get('photo_url')), 
         data.get('face_descriptor'),
         data.get('email'),
         data.get('phone'),
@@ -701,7 +766,7 @@ def update_employee(emp_id):
     ''', (
         data.get('name'), 
         data.get('role'), 
-        data.get('photo_url'), 
+        blob_store.store_photo(data.get('photo_url')), 
         data.get('face_descriptor'),
         data.get('email'),
         data.get('phone'),
@@ -732,7 +797,7 @@ def update_employee(emp_id):
                 
                 if reset_password:
                     new_password = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
-                    hashed = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+                    hashed = hash_password(new_password)
                     sys_db.execute('UPDATE guardians SET password=? WHERE id=?', (hashed, guardian_id))
                 
                 sys_db.commit()
@@ -745,7 +810,7 @@ def update_employee(emp_id):
                     # Se pediu reset, reseta do existente
                     if reset_password:
                         new_password = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
-                        hashed = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+                        hashed = hash_password(new_password)
                         sys_db.execute('UPDATE guardians SET password=? WHERE id=?', (hashed, guardian_id))
                     
                     # GARANTIR que a role seja employee (caso fosse guardian simples antes)
@@ -753,7 +818,7 @@ def update_employee(emp_id):
                     sys_db.commit()
                 else:
                     new_password = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
-                    hashed = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+                    hashed = hash_password(new_password)
                     sys_db.execute('INSERT INTO guardians (name, email, password, phone, role) VALUES (?, ?, ?, ?, "employee")',
                                   (data.get('name'), email, hashed, data.get('phone')))
                     guardian_id = sys_db.execute('SELECT last_insert_rowid()').fetchone()[0]
@@ -813,11 +878,7 @@ def get_chat_messages(student_id):
     db = get_school_db(school_id)
     
     # Busca mensagens da nova tabela chat_messages
-    messages = db.execute('''
-        SELECT * FROM chat_messages WHERE student_id = ? ORDER BY timestamp ASC
-    ''', (student_id,)).fetchall()
-    
-    return jsonify([dict(m) for m in messages])
+    return list_response(db, CHAT_MESSAGES_LIST, SCHOOL_CHAT_WHERE, (student_id,))
 
 @school_bp.route('/api/school/chat/<int:student_id>/messages', methods=['POST'])
 @token_required
@@ -859,6 +920,10 @@ def send_chat_message(student_id):
             VALUES (?, ?, 'school', ?, ?, ?, ?, ?, datetime('now'))
         ''', (student_id, school_id, school_id, msg_type, text, file_url, file_name))
         db.commit()
+        notify_student_guardians(get_system_db(), school_id, student_id, {
+            'type': 'chat',
+            'data': {'school_id': school_id, 'student_id': student_id, 'sender_type': 'school', 'message_type': msg_type}
+        })
         return jsonify({'success': True})
     except Exception as e:
         print(f"Erro chat POST school: {e}")
@@ -903,10 +968,12 @@ def broadcast_message():
     db = get_school_db(school_id)
     
     students_to_send = []
+    class_name = None
     if class_id:
         try:
             c = db.execute("SELECT name FROM classes WHERE id = ?", (class_id,)).fetchone()
             if c:
+                class_name = c['name']
                 students_to_send = db.execute("SELECT id FROM students WHERE class_name = ?", (c['name'],)).fetchall()
         except:
             pass
@@ -925,6 +992,11 @@ def broadcast_message():
             print(f"Error sending broadcast to student {s['id']}: {e}")
 
     db.commit()
+    if count:
+        notify_school_guardians(get_system_db(), school_id, {
+            'type': 'chat',
+            'data': {'school_id': school_id, 'sender_type': 'school', 'message_type': msg_type, 'broadcast': True}
+        }, class_name=class_name)
     return jsonify({'success': True, 'count': count})
 
 # ====== SUPPORT ======
@@ -1123,28 +1195,26 @@ def get_employee_attendance():
     start_date = request.args.get('startDate')
     end_date = request.args.get('endDate')
     
-    query = '''
-        SELECT ea.*, e.name as employee_name, e.role as employee_role, e.employee_id as matricula
-        FROM employee_attendance ea
-        JOIN employees e ON ea.employee_id = e.id
-        WHERE 1=1
-    '''
-    params = []
+    # Folha de ponto: ?format=csv baixa a planilha, ?format=ndjson uma linha por registro
+    try:
+        fmt = response_format(('json', 'ndjson', 'csv'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
+    # Período por ts_epoch (idx_employee_attendance_ts_epoch), dias inteiros
     if date_filter:
-        query += " AND date(ea.timestamp) = ?"
-        params.append(date_filter)
-    
-    if start_date and end_date:
-        query += " AND date(ea.timestamp) BETWEEN ? AND ?"
-        params.append(start_date)
-        params.append(end_date)
-        
-    query += " ORDER BY ea.timestamp DESC"
+        start_date = end_date = date_filter
     
     try:
-        records = db.execute(query, params).fetchall()
-        return jsonify([dict(r) for r in records])
+        start = end = None
+        if start_date and end_date:
+            start, end = day_range_epoch(start_date[:10], end_date[:10])
+        query, params = attendance_range_query(EMPLOYEE_ATTENDANCE_SQL, ts_epoch_sql(db, 'ea.'), start, end)
+        
+        # Lido do cursor durante o envio (memória constante em exportações longas)
+        cursor = db.execute(query, params)
+        filename = f"ponto_{start_date[:10]}_{end_date[:10]}.csv" if start_date and end_date else 'ponto.csv'
+        return stream_response(cursor, fmt, cursor_fields(cursor), filename=filename, close=[detach_db(db)])
     except Exception as e:
         print(f"Erro employee-attendance: {e}")
         return jsonify([])
@@ -1162,48 +1232,85 @@ def get_school_attendance(school_id=None):
     start_date = request.args.get('startDate')
     end_date = request.args.get('endDate')
     
+    # Exportação da frequência: ?format=csv (planilha) ou ?format=ndjson
+    try:
+        fmt = response_format(('json', 'ndjson', 'csv'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # ?view=daily (relatório do mês): mesmos campos, mas só a primeira chegada e a
+    # última saída de cada aluno/dia, lidas do resumo diário em vez de attendance
+    if request.args.get('view') == 'daily':
+        return get_school_attendance_days(school_id, start_date, end_date, fmt)
+    
     try:
         db = get_school_db(school_id)
         
-        # Se start e end são iguais (ex carregando hoje), usar LIKE para simplificar e evitar problemas de hora
-        if start_date and end_date and start_date == end_date:
-             query = '''
-                SELECT a.id, a.student_id, a.timestamp, a.type, 
-                       s.name as student_name, s.class_name, s.photo_url
-                FROM attendance a
-                JOIN students s ON a.student_id = s.id
-                WHERE a.timestamp LIKE ?
-                ORDER BY a.timestamp DESC
-             '''
-             # start_date geralmente é YYYY-MM-DD
-             params = [f"{start_date}%"]
-        else:
-            query = '''
-                SELECT a.id, a.student_id, a.timestamp, a.type, 
-                       s.name as student_name, s.class_name, s.photo_url
-                FROM attendance a
-                JOIN students s ON a.student_id = s.id
-                WHERE 1=1
-            '''
-            params = []
-            
-            if start_date:
-                query += " AND a.timestamp >= ?"
-                params.append(start_date)
-            
-            if end_date:
-                if len(end_date) == 10:
-                     end_date += 'T23:59:59'
-                query += " AND a.timestamp <= ?"
-                params.append(end_date + 'Z') # Z para garantir UTC se necessário
-                
-            query += " ORDER BY a.timestamp DESC"
+        # Período por ts_epoch (idx_attendance_ts_epoch); datas AAAA-MM-DD incluem o dia inteiro
+        start, end = day_range_epoch(start_date, end_date)
+        query, params = attendance_range_query(SCHOOL_ATTENDANCE_SQL, ts_epoch_sql(db, 'a.'), start, end)
 
-        rows = db.execute(query, params).fetchall()
-        return jsonify([dict(r) for r in rows])
+        cursor = db.execute(query, params)
+        filename = f"frequencia_{(start_date or 'inicio')[:10]}_{(end_date or 'hoje')[:10]}.csv"
+        return stream_response(cursor, fmt, cursor_fields(cursor), filename=filename, close=[detach_db(db)])
     except Exception as e:
         print(f"Erro em get_school_attendance: {e}")
         return jsonify([])
 
+def get_school_attendance_days(school_id, start_date, end_date, fmt):
+    today = datetime.date.today().isoformat()
+    start_day = (start_date or today)[:10]
+    end_day = (end_date or start_day)[:10]
+    try:
+        db = get_school_db(school_id)
+        events, params = attendance_rollup.day_events_query(
+            start_day, end_day, raw=backfill_pending(db, 'attendance_rollups'))
+        cursor = db.execute(f'''
+            SELECT NULL AS id, e.student_id, e.timestamp, e.type,
+                   s.name as student_name, s.class_name, s.photo_url
+            FROM ({events}) e
+            JOIN students s ON e.student_id = s.id
+            ORDER BY e.timestamp DESC
+        ''', params)
+        filename = f"frequencia_{start_day}_{end_day}.csv"
+        return stream_response(cursor, fmt, cursor_fields(cursor), filename=filename, close=[detach_db(db)])
+    except Exception as e:
+        log.error('erro ao buscar frequência pelo resumo diário', extra={'school_id': school_id, 'error': str(e)})
+        return jsonify([])
+
+@school_bp.route('/api/school/<int:school_id>/attendance/daily', methods=['GET'])
+@school_bp.route('/api/school/attendance/daily', methods=['GET'])
+@token_required
+def get_school_attendance_daily(school_id=None):
+    """
+    Painel/relatório de frequência a partir do resumo diário (attendance_rollup):
+    por turma (presentes, atrasados, faltas) e por aluno (primeira chegada,
+    última saída, atraso). startDate/endDate AAAA-MM-DD, padrão hoje.
+    Filtros opcionais: className, studentId.
+    """
+    if not school_id:
+        school_id = g.user.get('school_id') or g.user.get('id')
+    
+    today = datetime.date.today().isoformat()
+    start_date = (request.args.get('startDate') or today)[:10]
+    end_date = (request.args.get('endDate') or start_date)[:10]
+    class_name = request.args.get('className')
+    student_id = request.args.get('studentId', type=int)
+    
+    try:
+        db = get_school_db(school_id)
+        raw = backfill_pending(db, 'attendance_rollups')
+        classes = attendance_rollup.class_days(db, start_date, end_date, class_name, raw)
+        students = attendance_rollup.student_days(db, start_date, end_date, student_id, class_name, raw)
+        return jsonify({
+            'startDate': start_date,
+            'endDate': end_date,
+            'classes': [dict(r) for r in classes],
+            'students': [dict(r) for r in students]
+        })
+    except Exception as e:
+        log.error('erro ao buscar resumo diário de frequência', extra={'school_id': school_id, 'error': str(e)})
+        return jsonify({'error': str(e)}), 500
+
 # Fim do arquivo (Duplicatas removidas)
 
@@ -0,0 +1,140 @@
+"""
+Respostas grandes escritas direto do cursor, em blocos de ~64 KB, sem montar a
+lista de dicts nem o JSON inteiro na memória (exportações de semestre, agregações
+do responsável em várias escolas).
+
+Formato escolhido por ?format= (ou pelo header Accept):
+    json     array JSON (padrão; mesmo corpo que jsonify(lista) gerava)
+    ndjson   um objeto JSON por linha (application/x-ndjson)
+    csv      planilha com cabeçalho (text/csv, baixada como arquivo); só nas
+             exportações que aceitam
+
+Campos photo_url com referência do blob store saem como URL assinada (ver
+routes/blobs.py).
+
+O teardown da requisição roda antes do corpo ser enviado: as conexões lidas
+durante o streaming saem dele com detach_db() e são passadas em close=.
+"""
+import io
+import csv
+import json
+from flask import Response, request
+from .blobs import sign_photo_fields
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# Marca o lugar do array dentro do envelope JSON (ver json_envelope)
+ROWS = '\x00rows\x00'
+
+
+def response_format(allowed=('json', 'ndjson')):
+    """Formato pedido pelo cliente. ValueError se não estiver em allowed."""
+    fmt = request.args.get('format')
+    if fmt:
+        if fmt not in allowed:
+            raise ValueError(f"Formato não suportado: {fmt} (use {', '.join(allowed)})")
+        return fmt
+    best = request.accept_mimetypes.best_match([FORMATS[f] for f in allowed])
+    return next((f for f in allowed if FORMATS[f] == best), allowed[0])
+
+
+def cursor_fields(cursor):
+    """Nomes das colunas do SELECT (para o cabeçalho do CSV mesmo sem linhas)."""
+    return [d[0] for d in cursor.description] if cursor.description else None
+
+
+def json_envelope(wrapper):
+    """
+    Prefixo e sufixo do JSON em volta do array, ex:
+    {'success': True, 'invoices': ROWS} -> ('{"success": true, "invoices": [', ']}')
+    """
+    prefix, suffix = json.dumps(wrapper).split(json.dumps(ROWS))
+    return prefix + '[', ']' + suffix
+
+
+def _row_dict(row, fields):
+    # photo_url do blob store sai assinado: o <img src> não manda o token
+    return sign_photo_fields(dict(row) if fields is None else {f: row[f] for f in fields})
+
+
+def json_array_pieces(rows, fields=None, wrapper=None):
+    prefix, suffix = json_envelope(wrapper) if wrapper is not None else ('[', ']')
+    yield prefix
+    first = True
+    for row in rows:
+        item = json.dumps(_row_dict(row, fields), default=str)
+        yield item if first else ',' + item
+        first = False
+    yield suffix
+
+
+def ndjson_pieces(rows, fields=None):
+    for row in rows:
+        yield json.dumps(_row_dict(row, fields), default=str) + '\n'
+
+
+def csv_pieces(rows, fields=None):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    header_written = False
+    if fields is not None:
+        writer.writerow(fields)
+        header_written = True
+    for row in rows:
+        if not header_written:
+            fields = list(row.keys())
+            writer.writerow(fields)
+            header_written = True
+        writer.writerow([row[f] for f in fields])
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate(0)
+    yield out.getvalue()
+
+
+def chunked(pieces):
+    """Junta os pedaços em blocos de ~STREAM_CHUNK_BYTES (um write por bloco, não por linha)."""
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK_BYTES:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_response(rows, fmt='json', fields=None, wrapper=None, filename=None, close=(), headers=None):
+    """
+    Response em streaming com as linhas (sqlite3.Row ou dict) no formato fmt.
+
+    fields:   colunas, na ordem (padrão: todas as da linha)
+    wrapper:  envelope do array no formato json, ex {'success': True, 'grades': ROWS};
+              ndjson e csv trazem só as linhas
+    filename: nome do download (Content-Disposition) no formato csv
+    close:    conexões fechadas quando a resposta termina (ou o cliente desiste)
+    """
+    if fmt == 'csv':
+        pieces = csv_pieces(rows, fields)
+    elif fmt == 'ndjson':
+        pieces = ndjson_pieces(rows, fields)
+    else:
+        pieces = json_array_pieces(rows, fields, wrapper)
+
+    headers = dict(headers or {})
+    mimetype = FORMATS.get(fmt, FORMATS['json'])
+    if fmt == 'csv' and filename:
+        headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+    response = Response(chunked(pieces), mimetype=mimetype, headers=headers)
+    for conn in close:
+        if conn is not None:
+            response.call_on_close(conn.close)
+    return response
@@ -1,9 +1,13 @@
 from flask import Blueprint, jsonify, request, g
 from .auth import token_required
 from database import get_system_db, get_school_db
+from .list_query import list_response, STUDENTS_LIST
 
 teacher_bp = Blueprint('teacher', __name__)
 
+# Alunos da turma (também conferido por check_query_plans.py)
+CLASS_STUDENTS_WHERE = 'class_name = (SELECT name FROM classes WHERE id = ?)'
+
 @teacher_bp.route('/api/teacher/me', methods=['GET'])
 @token_required
 def get_teacher_info():
@@ -63,8 +67,7 @@ def get_class_students():
     
     try:
         school_db = get_school_db(school_id)
-        rows = school_db.execute('SELECT * FROM students WHERE class_name = (SELECT name FROM classes WHERE id = ?)', (class_id,)).fetchall()
-        return jsonify([dict(r) for r in rows])
+        return list_response(school_db, STUDENTS_LIST, CLASS_STUDENTS_WHERE, (class_id,))
     except:
         return jsonify([])
 
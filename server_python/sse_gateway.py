@@ -0,0 +1,356 @@
+"""
+Gateway SSE assíncrono (ASGI) para o app do responsável.
+
+Atende /api/guardian/events e /api/guardian/events-stream com o mesmo
+contrato das rotas Flask, mas sem prender uma thread por conexão: um único
+processo mantém dezenas de milhares de conexões ociosas.
+
+- Autenticação: mesmo JWT de routes/auth.py (decode_token).
+- Dados: mesmas consultas de routes/guardian.py, executadas num pool de
+  threads limitado (DB_WORKERS) para não sobrecarregar os bancos.
+- Heartbeat: comentário keep-alive a cada HEARTBEAT_SECONDS.
+- Retomada: cada mensagem tem um id; ao reconectar com Last-Event-ID, o
+  cliente recebe o que perdeu (buffer por responsável, REPLAY_BUFFER_SIZE).
+- Backpressure: se a fila de uma conexão enche (cliente lento), a conexão é
+  encerrada e o EventSource reconecta usando Last-Event-ID.
+
+Como rodar (o backend do barramento precisa ser compartilhado entre processos):
+    NOTIFICATION_BUS_BACKEND=sqlite gunicorn app:app ...
+    NOTIFICATION_BUS_BACKEND=sqlite uvicorn sse_gateway:app --host 0.0.0.0 --port 5003
+"""
+import os
+import json
+import time
+import asyncio
+import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from database import SYSTEM_DB_PATH, connect
+from notification_bus import notification_bus
+from routes.auth import decode_token
+from routes.guardian import fetch_pending_notifications, fetch_guardian_events, mark_notified
+from app_logging import get_logger
+
+log = get_logger('sse_gateway')
+
+HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS', '15'))
+STREAM_QUEUE_SIZE = 64        # mensagens pendentes por conexão antes de desconectar
+REPLAY_BUFFER_SIZE = 50       # mensagens guardadas por responsável para Last-Event-ID
+REPLAY_TTL_SECONDS = 120      # tempo que o buffer sobrevive sem conexões abertas
+DB_WORKERS = int(os.environ.get('SSE_DB_WORKERS', '8'))
+
+ALLOWED_ORIGINS = {"http://localhost:5173", "http://localhost:3001", "http://127.0.0.1:5173", "http://127.0.0.1:3001"}
+
+# Tipos de mensagem entregues por cada rota
+STREAM_TYPES = {
+    '/api/guardian/events': {'notification'},
+    '/api/guardian/events-stream': {'notification', 'events', 'chat'},
+}
+
+# Prefixo dos ids de evento: ids de outra execução do gateway são ignorados
+RUN_ID = format(int(time.time()), 'x')
+
+HEARTBEAT = object()
+OVERFLOW = object()
+
+
+class GuardianStream:
+    """Uma conexão SSE aberta."""
+
+    def __init__(self, kinds):
+        self.kinds = kinds
+        self.queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+
+    def offer(self, item):
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            if item is HEARTBEAT:
+                return True
+            # Cliente lento: encerrar; ele reconecta e recupera via Last-Event-ID
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+            return False
+
+
+class GuardianChannel:
+    """
+    Assinatura do barramento compartilhada por todas as conexões de um responsável.
+    Numera as mensagens, guarda as últimas para retomada e distribui para as conexões.
+    """
+
+    def __init__(self, gateway, guardian_id):
+        self.gateway = gateway
+        self.guardian_id = guardian_id
+        self.channel = str(guardian_id)
+        self.streams = set()
+        self.buffer = deque(maxlen=REPLAY_BUFFER_SIZE)  # [seq, message, delivered]
+        self.seq = 0
+        self.idle_since = None
+
+    # Chamado pela thread do barramento
+    def _put(self, message):
+        self.gateway.loop.call_soon_threadsafe(self.dispatch, message)
+
+    def dispatch(self, message):
+        msg_type = message.get('type')
+
+        if msg_type == 'notification':
+            self.publish(message)
+        elif msg_type == 'events_changed':
+            if any('events' in s.kinds for s in self.streams):
+                asyncio.ensure_future(self.refresh_events())
+        elif msg_type == 'chat':
+            self.publish(message)
+
+    async def refresh_events(self):
+        try:
+            events = await self.gateway.run_db(load_events, self.guardian_id)
+            self.publish({'type': 'events', 'data': events})
+        except Exception as e:
+            log.error('erro no SSE de eventos', extra={'guardian_id': self.guardian_id, 'error': str(e)})
+
+    def publish(self, message):
+        self.seq += 1
+        entry = [self.seq, message, False]
+        self.buffer.append(entry)
+        for stream in list(self.streams):
+            if message['type'] in stream.kinds:
+                stream.offer((self.event_id(self.seq), message))
+                entry[2] = True
+
+    def sent(self, message):
+        """
+        Mensagem escrita numa conexão. Só então a notificação é marcada como
+        entregue (como na rota Flask): sem conexão aberta ela continua pendente
+        e sai em fetch_pending_notifications na próxima.
+        """
+        if message.get('type') == 'notification':
+            data = message['data']
+            self.gateway.run_db(mark_notified, data['school_id'], data['id'])
+
+    def event_id(self, seq):
+        return f"{RUN_ID}-{seq}"
+
+    def missed_since(self, last_event_id):
+        """Mensagens do buffer que a nova conexão ainda não recebeu."""
+        last_seq = None
+        if last_event_id and last_event_id.startswith(RUN_ID + '-'):
+            try:
+                last_seq = int(last_event_id.split('-', 1)[1])
+            except ValueError:
+                pass
+
+        for entry in self.buffer:
+            seq, message, delivered = entry
+            if (last_seq is not None and seq > last_seq) or (last_seq is None and not delivered):
+                entry[2] = True
+                yield seq, message
+
+    def add(self, stream):
+        self.streams.add(stream)
+        self.idle_since = None
+
+    def remove(self, stream):
+        self.streams.discard(stream)
+        if not self.streams:
+            self.idle_since = time.monotonic()
+
+
+class SSEGateway:
+    def __init__(self):
+        self.loop = None
+        self.channels = {}  # {guardian_id: GuardianChannel}
+        self.executor = None
+        self.ticker = None
+
+    async def startup(self):
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='sse-db')
+        self.ticker = asyncio.ensure_future(self.tick())
+
+    async def shutdown(self):
+        if self.ticker:
+            self.ticker.cancel()
+        for channel in list(self.channels.values()):
+            notification_bus.detach(channel)
+        self.channels.clear()
+        if self.executor:
+            self.executor.shutdown(wait=False)
+
+    def run_db(self, fn, *args):
+        return self.loop.run_in_executor(self.executor, fn, *args)
+
+    def channel_for(self, guardian_id):
+        channel = self.channels.get(guardian_id)
+        if channel is None:
+            channel = self.channels[guardian_id] = GuardianChannel(self, guardian_id)
+            notification_bus.attach(channel)
+        return channel
+
+    async def tick(self):
+        """Heartbeat de todas as conexões e limpeza de buffers sem conexões."""
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            now = time.monotonic()
+            for guardian_id, channel in list(self.channels.items()):
+                for stream in list(channel.streams):
+                    stream.offer(HEARTBEAT)
+                if channel.idle_since and now - channel.idle_since > REPLAY_TTL_SECONDS:
+                    notification_bus.detach(channel)
+                    del self.channels[guardian_id]
+
+    async def stream(self, path, guardian_id, last_event_id, send, receive, cors_headers=()):
+        kinds = STREAM_TYPES[path]
+        channel = self.channel_for(guardian_id)
+        stream = GuardianStream(kinds)
+        channel.add(stream)
+
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': list(cors_headers) + [
+                    (b'content-type', b'text/event-stream'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+            await send_event(send, {'type': 'connected'})
+
+            # Retomada: o que ficou no buffer desde o último id recebido pelo cliente
+            replayed = set()
+            for seq, message in channel.missed_since(last_event_id):
+                if message['type'] in kinds:
+                    await send_event(send, message, channel.event_id(seq))
+                    channel.sent(message)
+                    if message['type'] == 'notification':
+                        replayed.add((message['data']['school_id'], message['data']['id']))
+
+            # Pendências gravadas enquanto ninguém deste responsável estava conectado
+            # (as que acabaram de sair pela retomada ainda podem constar como pendentes)
+            for n in await self.run_db(fetch_pending_notifications, guardian_id):
+                if (n['school_id'], n['id']) not in replayed:
+                    channel.publish({'type': 'notification', 'data': n})
+
+            if 'events' in kinds:
+                asyncio.ensure_future(channel.refresh_events())
+
+            disconnect = asyncio.ensure_future(wait_disconnect(receive))
+            try:
+                while True:
+                    getter = asyncio.ensure_future(stream.queue.get())
+                    done, _ = await asyncio.wait({getter, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                    if disconnect in done:
+                        getter.cancel()
+                        break
+
+                    item = getter.result()
+                    if item is OVERFLOW:
+                        break
+                    if item is HEARTBEAT:
+                        await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+                        continue
+
+                    event_id, message = item
+                    await send_event(send, message, event_id)
+                    channel.sent(message)
+            finally:
+                disconnect.cancel()
+
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        except OSError:
+            pass
+        finally:
+            channel.remove(stream)
+
+
+def load_events(guardian_id):
+    sys_db = connect(SYSTEM_DB_PATH)
+    sys_db.row_factory = sqlite3.Row
+    try:
+        return fetch_guardian_events(sys_db, guardian_id)
+    finally:
+        sys_db.close()
+
+
+async def send_event(send, message, event_id=None):
+    body = f"id: {event_id}\n" if event_id else ''
+    body += f"data: {json.dumps(message)}\n\n"
+    await send({'type': 'http.response.body', 'body': body.encode('utf-8'), 'more_body': True})
+
+
+async def wait_disconnect(receive):
+    while True:
+        event = await receive()
+        if event['type'] == 'http.disconnect':
+            return
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': list(headers) + [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+gateway = SSEGateway()
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            event = await receive()
+            if event['type'] == 'lifespan.startup':
+                await gateway.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif event['type'] == 'lifespan.shutdown':
+                await gateway.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+    origin = headers.get('origin')
+    cors = []
+    if origin in ALLOWED_ORIGINS:
+        cors = [(b'access-control-allow-origin', origin.encode()), (b'access-control-allow-credentials', b'true')]
+
+    path = scope['path']
+    if path == '/health':
+        return await send_json(send, 200, {
+            'status': 'healthy',
+            'service': 'edufocus-sse-gateway',
+            'guardians': len(gateway.channels),
+            'connections': sum(len(c.streams) for c in gateway.channels.values())
+        })
+
+    if path not in STREAM_TYPES or scope['method'] != 'GET':
+        return await send_json(send, 404, {'message': 'Not found'}, cors)
+
+    # Mesma regra das rotas Flask: token na query string ou no header Authorization
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    token = query.get('token', [None])[0]
+    if not token and headers.get('authorization', '').startswith('Bearer '):
+        token = headers['authorization'].split(' ')[1]
+
+    if not token:
+        return await send_json(send, 401, {'message': 'Token missing'}, cors)
+
+    try:
+        guardian_id = decode_token(token)['id']
+    except Exception:
+        return await send_json(send, 403, {'message': 'Invalid token'}, cors)
+
+    last_event_id = headers.get('last-event-id') or query.get('lastEventId', [None])[0]
+
+    await gateway.stream(path, guardian_id, last_event_id, send, receive, cors)
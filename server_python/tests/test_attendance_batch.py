@@ -0,0 +1,88 @@
+"""
+Lote de presença (/api/attendance/batch): os ids devolvidos e os notificados
+são os das linhas gravadas, mesmo com buracos na sequência das tabelas.
+
+    cd server_python && python -m pytest -q tests
+"""
+import os
+import sys
+import datetime
+
+import jwt
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database  # noqa: E402
+from routes import attendance  # noqa: E402
+from routes.auth import SECRET_KEY  # noqa: E402
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_DIR', str(tmp_path))
+    monkeypatch.setattr(database, 'SYSTEM_DB_PATH', str(tmp_path / 'system.db'))
+    pool = database.SchoolConnectionPool()
+    monkeypatch.setattr(database, 'school_db_pool', pool)
+    notified = []
+    monkeypatch.setattr(attendance.dispatcher, 'notify_student_event',
+                        lambda sys_db, school_id, student, event_type, ts, **kw: notified.append(kw['log_id']))
+    database.init_system_db()
+
+    conn = database.get_school_db(1)
+    conn.execute("INSERT INTO students (id, name, class_name) VALUES (1, 'Ana', '5A'), (2, 'Bia', '5A')")
+    # Linhas apagadas: sqlite_sequence fica à frente de MAX(id)
+    conn.execute("INSERT INTO access_logs (student_id, event_type, timestamp) VALUES (1, 'arrival', '2026-01-01T07:00:00')")
+    conn.execute('DELETE FROM access_logs')
+    conn.commit()
+    conn.close()
+
+    app = Flask(__name__)
+    database.init_app(app)
+    app.register_blueprint(attendance.attendance_bp)
+    token = jwt.encode({'id': 1, 'role': 'school_admin', 'school_id': 1,
+                        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1)}, SECRET_KEY, algorithm='HS256')
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    client.notified = notified
+    yield client
+    pool.clear()
+
+
+def test_batch_returns_ids_of_inserted_rows(client):
+    r = client.post('/api/attendance/batch', json={'records': [
+        {'student_id': 1, 'type': 'arrival', 'timestamp': '2026-10-18T07:00:00', 'event_id': 'a'},
+        {'student_id': 2, 'type': 'arrival', 'timestamp': '2026-10-18T07:01:00', 'event_id': 'b'},
+        {'student_id': 2, 'type': 'arrival', 'timestamp': '2026-10-18T07:01:00', 'event_id': 'b'},
+    ]})
+    body = r.get_json()
+    assert body['created'] == 2 and body['duplicates'] == 1
+
+    conn = database.connect(os.path.join(database.DB_DIR, 'school_1.db'))
+    rows = dict(conn.execute('SELECT event_id, id FROM attendance').fetchall())
+    log_ids = [row[0] for row in conn.execute('SELECT id FROM access_logs ORDER BY id')]
+    conn.close()
+
+    assert [res['attendance_id'] for res in body['results']] == [rows['a'], rows['b'], rows['b']]
+    assert client.notified == log_ids
+
+
+def test_batch_updates_daily_rollup_once_per_student_day(client):
+    r = client.post('/api/attendance/batch', json={'records': [
+        {'student_id': 1, 'type': 'arrival', 'timestamp': '2026-10-18T07:40:00'},
+        {'student_id': 1, 'type': 'arrival', 'timestamp': '2026-10-18T07:10:00'},
+        {'student_id': 1, 'type': 'departure', 'timestamp': '2026-10-18T12:00:00'},
+        {'student_id': 1, 'type': 'departure', 'timestamp': '2026-10-18T12:30:00'},
+        {'student_id': 2, 'type': 'arrival', 'timestamp': '2026-10-18T07:50:00'},
+    ]})
+    assert r.get_json()['created'] == 5
+
+    conn = database.connect(os.path.join(database.DB_DIR, 'school_1.db'))
+    days = conn.execute('''
+        SELECT student_id, first_arrival, last_departure, late FROM attendance_daily_student ORDER BY student_id
+    ''').fetchall()
+    classes = conn.execute('SELECT class_name, present, late FROM attendance_daily_class').fetchall()
+    conn.close()
+
+    assert days == [(1, '2026-10-18T07:10:00', '2026-10-18T12:30:00', 0), (2, '2026-10-18T07:50:00', None, 1)]
+    assert classes == [('5A', 2, 1)]
@@ -0,0 +1,54 @@
+"""
+Debounce de chegada/saída (routes/attendance.py): a janela é medida por
+ts_epoch, não pelo texto de timestamp ('2026-10-18T07:31' x '2026-10-18 07:31').
+
+    cd server_python && python -m pytest -q tests
+"""
+import os
+import sys
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database  # noqa: E402
+from routes import attendance  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_DIR', str(tmp_path))
+    pool = database.SchoolConnectionPool()
+    monkeypatch.setattr(database, 'school_db_pool', pool)
+    monkeypatch.setattr(attendance, 'ATTENDANCE_DEBOUNCE_MINUTES', 5)
+    conn = database.get_school_db(1)
+    conn.execute("INSERT INTO students (id, name, class_name) VALUES (1, 'Ana', '5A')")
+    conn.commit()
+    yield conn
+    conn.close()
+    pool.clear()
+
+
+def student(conn):
+    return conn.execute('SELECT * FROM students WHERE id = 1').fetchone()
+
+
+def test_debounce_sees_timestamp_written_with_space(db):
+    # Registro gravado por script antigo: espaço entre data e hora, sem ts_epoch
+    db.execute("INSERT INTO attendance (student_id, timestamp, type) VALUES (1, '2026-10-18 07:31:00', 'arrival')")
+    db.commit()
+
+    now = datetime.datetime(2026, 10, 18, 7, 33)
+    recent, log_id = attendance.record_attendance(db, student(db), 'arrival', now)
+    assert recent['timestamp'] == '2026-10-18 07:31:00'
+    assert log_id is None
+
+
+def test_record_outside_window_is_inserted_in_one_transaction(db):
+    first, _ = attendance.record_attendance(db, student(db), 'arrival', datetime.datetime(2026, 10, 18, 7, 0))
+    second, log_id = attendance.record_attendance(db, student(db), 'arrival', datetime.datetime(2026, 10, 18, 7, 6))
+    assert first is None and second is None
+    assert log_id is not None
+    assert not db.in_transaction
+    assert db.execute('SELECT COUNT(*) FROM attendance').fetchone()[0] == 2
+    assert db.execute('SELECT COUNT(*) FROM access_logs').fetchone()[0] == 2
@@ -0,0 +1,71 @@
+"""
+Backfills adiados (database.defer_backfill): escola grande não preenche ts_epoch
+nem reconstrói o resumo de presença no primeiro acesso; os leitores usam
+timestamp / attendance até o migrate.py --backfill (run_pending_backfills) concluir.
+
+    cd server_python && python -m pytest -q tests
+"""
+import os
+import sys
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database  # noqa: E402
+import attendance_rollup  # noqa: E402
+from routes import attendance  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_DIR', str(tmp_path))
+    monkeypatch.setattr(database, 'BACKFILL_REQUEST_LIMIT', 1)
+    monkeypatch.setattr(attendance, 'ATTENDANCE_DEBOUNCE_MINUTES', 5)
+
+    # Escola criada antes do ts_epoch (migração 6), já com registros
+    conn = database.connect(database.school_db_path(1))
+    database.apply_migrations(conn, database.SCHOOL_MIGRATIONS[:5])
+    conn.execute("INSERT INTO students (id, name, class_name) VALUES (1, 'Ana', '5A')")
+    conn.executemany("INSERT INTO attendance (student_id, timestamp, type) VALUES (1, ?, 'arrival')",
+                     [('2026-10-17T07:10:00',), ('2026-10-18 07:31:00',)])
+    conn.commit()
+    conn.close()
+
+    pool = database.SchoolConnectionPool()
+    monkeypatch.setattr(database, 'school_db_pool', pool)
+    conn = database.get_school_db(1)
+    yield conn
+    conn.close()
+    pool.clear()
+
+
+def test_large_backfill_is_deferred_and_readers_fall_back(db):
+    assert database.backfill_pending(db, 'ts_epoch')
+    assert db.execute('SELECT COUNT(*) FROM attendance WHERE ts_epoch IS NULL').fetchone()[0] == 2
+
+    student = db.execute('SELECT * FROM students WHERE id = 1').fetchone()
+    recent, log_id = attendance.record_attendance(db, student, 'arrival', datetime.datetime(2026, 10, 18, 7, 33))
+    assert recent['timestamp'] == '2026-10-18 07:31:00'
+    assert log_id is None
+
+
+def test_run_pending_backfills_finishes_it(db):
+    assert database.run_pending_backfills(db) == ['ts_epoch', 'attendance_rollups']
+    assert db.execute('SELECT COUNT(*) FROM attendance WHERE ts_epoch IS NULL').fetchone()[0] == 0
+    assert not database.backfill_pending(db, 'ts_epoch')
+    assert database.ts_epoch_sql(db, 'a.') == 'a.ts_epoch'
+
+
+def test_rollup_readers_use_attendance_while_rebuild_is_pending(db):
+    assert database.backfill_pending(db, 'attendance_rollups')
+    assert not attendance_rollup.student_days(db, '2026-10-17', '2026-10-18', 1)
+
+    raw = [dict(r) for r in attendance_rollup.student_days(db, '2026-10-17', '2026-10-18', 1, raw=True)]
+    assert [(d['day'], d['first_arrival'], d['late']) for d in raw] == [
+        ('2026-10-17', '2026-10-17T07:10:00', 0), ('2026-10-18', '2026-10-18T07:31:00', 1)]
+    classes = attendance_rollup.class_days(db, '2026-10-18', '2026-10-18', raw=True)
+    assert [(c['class_name'], c['present'], c['late'], c['absent']) for c in classes] == [('5A', 1, 1, 0)]
+
+    assert database.run_pending_backfills(db) == ['ts_epoch', 'attendance_rollups']
+    assert [dict(r) for r in attendance_rollup.student_days(db, '2026-10-17', '2026-10-18', 1)] == raw
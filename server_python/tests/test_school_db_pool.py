@@ -0,0 +1,74 @@
+"""
+Pool de conexões das escolas: uma conexão devolvida pela rota (db.close()) não
+pode ser devolvida de novo pelo teardown depois de emprestada a outra requisição.
+
+    cd server_python && python -m pytest -q tests
+"""
+import os
+import sys
+import threading
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_DIR', str(tmp_path))
+    pool = database.SchoolConnectionPool()
+    monkeypatch.setattr(database, 'school_db_pool', pool)
+    app = Flask(__name__)
+    database.init_app(app)
+    yield app
+    pool.clear()
+
+
+def test_close_then_teardown_does_not_release_conn_of_other_request(app):
+    with app.app_context():
+        conn_a = database.get_school_db(1)
+        conn_a.close()  # a rota devolve a conexão antes do fim da requisição
+
+        # Outra requisição (outra thread) pega a mesma conexão do pool
+        taken = {}
+        ready, done = threading.Event(), threading.Event()
+
+        def request_b():
+            with app.app_context():
+                taken['b'] = database.get_school_db(1)
+                ready.set()
+                done.wait(5)
+
+        worker = threading.Thread(target=request_b)
+        worker.start()
+        ready.wait(5)
+        assert taken['b'] is conn_a
+    # Teardown de A rodou aqui: não pode ter devolvido a conexão de B
+
+    try:
+        assert taken['b']._checked_out
+        with app.app_context():
+            conn_c = database.get_school_db(1)
+            assert conn_c is not taken['b']
+    finally:
+        done.set()
+        worker.join(5)
+
+
+def test_teardown_releases_connections_not_closed_by_route(app):
+    with app.app_context():
+        conn = database.get_school_db(1)
+    assert not conn._checked_out
+
+    with app.app_context():
+        assert database.get_school_db(1) is conn
+
+
+def test_detached_connection_is_left_to_its_owner(app):
+    with app.app_context():
+        conn = database.detach_db(database.get_school_db(1))
+    assert conn._checked_out
+    conn.close()
+    assert not conn._checked_out
@@ -0,0 +1,45 @@
+"""
+Fila de escrita: um erro ao conectar (ou no ROLLBACK) falha só o grupo atual;
+a thread escritora continua viva e as próximas escritas são aplicadas.
+
+    cd server_python && python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database  # noqa: E402
+
+
+def test_writer_survives_connect_failure(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'school_1.db')
+    real_connect = database.connect
+    calls = {'n': 0}
+
+    def flaky_connect(path, **kwargs):
+        calls['n'] += 1
+        if calls['n'] == 1:
+            raise OSError('disco indisponível')
+        return real_connect(path, **kwargs)
+
+    monkeypatch.setattr(database, 'connect', flaky_connect)
+    wq = database.WriteQueue(db_path)
+
+    with pytest.raises(OSError):
+        wq.execute('CREATE TABLE t (x INTEGER)')
+    assert wq._thread.is_alive()
+
+    wq.execute('CREATE TABLE t (x INTEGER)')
+    assert wq.execute('INSERT INTO t (x) VALUES (?)', (1,)) == 1
+
+
+def test_dead_writer_thread_is_restarted(tmp_path):
+    wq = database.WriteQueue(str(tmp_path / 'school_2.db'))
+    wq.execute('CREATE TABLE t (x INTEGER)')
+
+    # Simula uma thread que morreu: a próxima escrita sobe outra
+    wq._thread = type('Dead', (), {'is_alive': lambda self: False})()
+    assert wq.execute('INSERT INTO t (x) VALUES (1)') == 1
+    assert wq._thread.is_alive()
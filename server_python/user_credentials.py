@@ -0,0 +1,101 @@
+"""
+Índice de login (tabela user_credentials no system.db): email -> papel, tabela e id.
+
+O login procurava o email em até cinco tabelas, uma de cada vez. Agora é uma
+busca no índice e uma leitura pela chave primária da tabela do usuário.
+
+O índice é mantido por triggers nas próprias tabelas de usuário, então vale para
+toda rota ou script que cadastra, altera ou remove usuários. Se o mesmo email
+existir em mais de uma tabela, vale a ordem de CREDENTIAL_TABLES (a mesma do
+login antigo).
+
+Reconstrução manual (ex: após restaurar backup):
+    python user_credentials.py
+"""
+import sqlite3
+
+# (tabela, papel) na ordem de prioridade do login; papel None = coluna role da linha
+CREDENTIAL_TABLES = [
+    ('super_admins', 'super_admin'),
+    ('schools', 'school_admin'),
+    ('teachers', 'teacher'),
+    ('inspectors', 'inspector'),
+    ('guardians', None),
+]
+
+
+def _role_sql(role, row):
+    # Responsáveis podem ter outro papel na coluna role (ex: funcionário)
+    return f"'{role}'" if role else f"COALESCE(NULLIF({row}.role, ''), 'guardian')"
+
+
+def create_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS user_credentials (
+        user_table TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        email TEXT NOT NULL,
+        rank INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        PRIMARY KEY (user_table, user_id)
+    ) WITHOUT ROWID''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_credentials_email ON user_credentials(email, rank)')
+
+    for rank, (table, role) in enumerate(CREDENTIAL_TABLES):
+        upsert = f'''
+            INSERT OR REPLACE INTO user_credentials (user_table, user_id, email, rank, role)
+            SELECT '{table}', NEW.id, NEW.email, {rank}, {_role_sql(role, 'NEW')}
+            WHERE NEW.email IS NOT NULL;
+        '''
+        delete = f"DELETE FROM user_credentials WHERE user_table = '{table}' AND user_id = OLD.id;"
+        watched = 'email, id, role' if role is None else 'email, id'
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_credentials_insert')
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_credentials_update')
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_credentials_delete')
+        conn.execute(f'CREATE TRIGGER trg_{table}_credentials_insert AFTER INSERT ON {table} BEGIN {upsert} END')
+        conn.execute(f'CREATE TRIGGER trg_{table}_credentials_update AFTER UPDATE OF {watched} ON {table} '
+                     f'BEGIN {delete} {upsert} END')
+        conn.execute(f'CREATE TRIGGER trg_{table}_credentials_delete AFTER DELETE ON {table} BEGIN {delete} END')
+
+
+def rebuild(conn):
+    """Recria o índice a partir das tabelas de usuário. Retorna quantas credenciais."""
+    conn.execute('DELETE FROM user_credentials')
+    for rank, (table, role) in enumerate(CREDENTIAL_TABLES):
+        conn.execute(f'''
+            INSERT OR REPLACE INTO user_credentials (user_table, user_id, email, rank, role)
+            SELECT '{table}', id, email, {rank}, {_role_sql(role, table)}
+            FROM {table} WHERE email IS NOT NULL
+        ''')
+    return conn.execute('SELECT COUNT(*) FROM user_credentials').fetchone()[0]
+
+
+def lookup(sys_db, email):
+    """(role, user_table, user_id) de quem faz login com este email, ou None."""
+    return sys_db.execute('''
+        SELECT role, user_table, user_id FROM user_credentials
+        WHERE email = ? ORDER BY rank LIMIT 1
+    ''', (email,)).fetchone()
+
+
+def load_user(sys_db, email):
+    """(linha do usuário, papel, tabela) para o login, ou (None, None, None) se o email não existir."""
+    cred = lookup(sys_db, email)
+    if not cred:
+        return None, None, None
+    role, table, user_id = cred
+    # table vem do próprio índice (sempre uma de CREDENTIAL_TABLES)
+    user = sys_db.execute(f'SELECT * FROM {table} WHERE id = ?', (user_id,)).fetchone()
+    return user, role, table
+
+
+if __name__ == '__main__':
+    from database import SYSTEM_DB_PATH, connect, init_system_db
+    init_system_db()
+    conn = connect(SYSTEM_DB_PATH)
+    try:
+        total = rebuild(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"✅ Índice de login reconstruído: {total} credenciais")